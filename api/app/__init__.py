@@ -8,9 +8,29 @@ from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
 
+from app.cache import TTLCache
+from app.encoding import JSONEncoder
+from app.hashing import HashingPool
+from app.images import ImageStore
+from app.mail_queue import MailQueue
+
 db = SQLAlchemy()
 migrate = Migrate(db)
 mail = Mail()
+# sends the mails of send_email in the background
+mail_queue = MailQueue()
+# caches the users verified by token, see User.check_token
+token_cache = TTLCache()
+# caches the token epoch of users verified by signed token
+epoch_cache = TTLCache()
+# caches the credentials recently verified by basic auth
+login_cache = TTLCache()
+# caches the power drawn by the borrowed items over windows of dates
+power_cache = TTLCache()
+# caches the dashboard of the inventory
+dashboard_cache = TTLCache()
+hash_pool = HashingPool()
+image_store = ImageStore()
 
 
 def create_app(config_class=Config):
@@ -18,10 +38,19 @@ def create_app(config_class=Config):
     objects and registers the blueprint modules."""
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.json_encoder = JSONEncoder
 
     db.init_app(app)
     migrate.init_app(app, db)
     mail.init_app(app)
+    mail_queue.init_app(app, mail)
+    token_cache.init_app(app, "TOKEN_CACHE")
+    epoch_cache.init_app(app, "TOKEN_CACHE")
+    login_cache.init_app(app, "LOGIN_CACHE")
+    power_cache.init_app(app, "POWER_CACHE")
+    dashboard_cache.init_app(app, "DASHBOARD_CACHE")
+    hash_pool.init_app(app)
+    image_store.init_app(app)
 
     from app.api import bp as api_bp
 
@@ -31,6 +60,10 @@ def create_app(config_class=Config):
 
     app.register_blueprint(error_bp)
 
+    from app.cli import bp as cli_bp
+
+    app.register_blueprint(cli_bp)
+
     # Handles application logs by mail and in files when deployed.
     if not app.debug and not app.testing:
         # we cannot yet have mail logs with a SMTP over SSL connection
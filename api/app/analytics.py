@@ -0,0 +1,162 @@
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from app import db
+from app.models import (
+    USAGE_COLUMNS,
+    Borrowing,
+    Item,
+    ItemUsage,
+    User,
+    UserUsage,
+    month_days,
+    usage_deltas,
+)
+
+# the analytics only read the usage rollups, never the borrowings themselves
+
+
+def rebuild_usages(chunk_size: int = 500) -> int:
+    """Recomputes the usage rollups from every borrowing, in the current transaction.
+    Borrowings are read chunk_size at a time and the rollups are accumulated in
+    memory, one counter per item or user and month. Returns the number of
+    borrowings read."""
+    if not isinstance(chunk_size, int):
+        raise TypeError("Bad arguments type")
+    query = (
+        db.session.query(*[getattr(Borrowing, c) for c in USAGE_COLUMNS])
+        .execution_options(stream_results=True)
+        .yield_per(chunk_size)
+    )
+    count = 0
+
+    def rows():
+        nonlocal count
+        for row in query:
+            count += 1
+            yield tuple(row)
+
+    items, users = usage_deltas(rows(), 1)
+    db.session.query(ItemUsage).delete()
+    db.session.query(UserUsage).delete()
+    for model, key, usages in [
+        (ItemUsage, "item_id", items),
+        (UserUsage, "user_id", users),
+    ]:
+        values = [
+            {
+                key: id,
+                "month": month,
+                "borrowings": borrowings,
+                "borrowed_quantity": quantity,
+                "unit_days": unit_days,
+            }
+            for (id, month), (borrowings, quantity, unit_days) in usages.items()
+        ]
+        for i in range(0, len(values), chunk_size):
+            db.session.execute(model.__table__.insert(), values[i : i + chunk_size])
+    return count
+
+
+def _totals(model) -> list:
+    """Returns the sums of the counters of a usage rollup"""
+    return [
+        func.sum(model.borrowings),
+        func.sum(model.borrowed_quantity),
+        func.sum(model.unit_days),
+    ]
+
+
+def item_utilization(start: date, end: date, limit: int = 10) -> list[dict]:
+    """Returns the limit most used items over the months from start to end (first
+    days of the months, included), by decreasing units in use summed over the days.
+    The utilization of an item is the share of its units in use on average over
+    these days."""
+    if not (
+        isinstance(start, date) and isinstance(end, date) and isinstance(limit, int)
+    ):
+        raise TypeError("Bad arguments type")
+    last_day = (end + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    days = (last_day - start).days + 1
+    unit_days = func.sum(ItemUsage.unit_days)
+    query = (
+        db.session.query(
+            ItemUsage.item_id, Item.name, Item.quantity, *_totals(ItemUsage)
+        )
+        .join(Item, Item.id == ItemUsage.item_id)
+        .filter(ItemUsage.month >= start, ItemUsage.month <= end)
+        .group_by(ItemUsage.item_id, Item.name, Item.quantity)
+        .having(unit_days > 0)
+        .order_by(unit_days.desc(), ItemUsage.item_id)
+        .limit(limit)
+    )
+    return [
+        {
+            "id": id,
+            "name": name,
+            "quantity": quantity,
+            "borrowings": borrowings,
+            "borrowed_quantity": borrowed_quantity,
+            "unit_days": unit_days,
+            "utilization": round(unit_days / (quantity * days), 4)
+            if quantity
+            else None,
+        }
+        for id, name, quantity, borrowings, borrowed_quantity, unit_days in query
+    ]
+
+
+def top_borrowers(start: date, end: date, limit: int = 10) -> list[dict]:
+    """Returns the limit users who started the most borrowings over the months from
+    start to end (first days of the months, included)"""
+    if not (
+        isinstance(start, date) and isinstance(end, date) and isinstance(limit, int)
+    ):
+        raise TypeError("Bad arguments type")
+    borrowings = func.sum(UserUsage.borrowings)
+    borrowed_quantity = func.sum(UserUsage.borrowed_quantity)
+    query = (
+        db.session.query(UserUsage.user_id, User.username, *_totals(UserUsage))
+        .join(User, User.id == UserUsage.user_id)
+        .filter(UserUsage.month >= start, UserUsage.month <= end)
+        .group_by(UserUsage.user_id, User.username)
+        .having(borrowings > 0)
+        .order_by(borrowings.desc(), borrowed_quantity.desc(), UserUsage.user_id)
+        .limit(limit)
+    )
+    return [
+        {
+            "id": id,
+            "username": username,
+            "borrowings": borrowings,
+            "borrowed_quantity": borrowed_quantity,
+            "unit_days": unit_days,
+        }
+        for id, username, borrowings, borrowed_quantity, unit_days in query
+    ]
+
+
+def monthly_volume(start: date, end: date) -> list[dict]:
+    """Returns the borrowings of each month from start to end (first days of the
+    months, included), months without borrowings included"""
+    if not (isinstance(start, date) and isinstance(end, date)):
+        raise TypeError("Bad arguments type")
+    query = (
+        db.session.query(ItemUsage.month, *_totals(ItemUsage))
+        .filter(ItemUsage.month >= start, ItemUsage.month <= end)
+        .group_by(ItemUsage.month)
+    )
+    volumes = {month: totals for month, *totals in query}
+    elements = []
+    for month, _ in month_days(start, end):
+        borrowings, borrowed_quantity, unit_days = volumes.get(month, [0, 0, 0])
+        elements.append(
+            {
+                "month": month.isoformat()[:7],
+                "borrowings": borrowings,
+                "borrowed_quantity": borrowed_quantity,
+                "unit_days": unit_days,
+            }
+        )
+    return elements
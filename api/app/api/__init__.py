@@ -2,4 +2,14 @@ from flask import Blueprint
 
 bp = Blueprint("api", __name__)
 
-from app.api import users, borrowings, items, errors, tokens
+from app.api import (
+    users,
+    borrowings,
+    items,
+    errors,
+    tokens,
+    analytics,
+    calendar,
+    power,
+    dashboard,
+)
@@ -0,0 +1,69 @@
+from typing import Union
+
+from flask import Response, jsonify, request
+from app import analytics
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.dates import month_window
+from app.api.errors import bad_request
+from app.models import Role
+
+
+def _window_and_limit() -> Union[tuple, Response]:
+    """Returns the window of months and the limit of a request, or an error
+    response"""
+    try:
+        start, end = month_window(request.args)
+    except ValueError:
+        return bad_request("from and to should be months (2024-01), from before to")
+    return start, end, max(1, min(request.args.get("limit", 10, type=int), 100))
+
+
+@bp.route("/analytics/items", methods=["GET"])
+@token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
+def get_item_analytics():
+    """Retrieves the most used items over a window of months, with their
+    utilization: the share of their units in use on average over the window. Only
+    reufs are allowed for this request.
+
+    Args (in the GET request):
+        - from: the first month of the window, as year and month (2024-01)
+        - to: the last month of the window
+        - limit: the number of items to return. 10 by default, at most 100"""
+    window = _window_and_limit()
+    if isinstance(window, Response):
+        return window
+    return jsonify({"elements": analytics.item_utilization(*window)})
+
+
+@bp.route("/analytics/borrowers", methods=["GET"])
+@token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
+def get_borrower_analytics():
+    """Retrieves the users who started the most borrowings over a window of months.
+    Only reufs are allowed for this request.
+
+    Args (in the GET request):
+        - from: the first month of the window, as year and month (2024-01)
+        - to: the last month of the window
+        - limit: the number of users to return. 10 by default, at most 100"""
+    window = _window_and_limit()
+    if isinstance(window, Response):
+        return window
+    return jsonify({"elements": analytics.top_borrowers(*window)})
+
+
+@bp.route("/analytics/monthly", methods=["GET"])
+@token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
+def get_monthly_analytics():
+    """Retrieves the number of borrowings, of units borrowed and of units in use
+    summed over the days of each month of a window. Only reufs are allowed for this
+    request.
+
+    Args (in the GET request):
+        - from: the first month of the window, as year and month (2024-01)
+        - to: the last month of the window"""
+    try:
+        start, end = month_window(request.args)
+    except ValueError:
+        return bad_request("from and to should be months (2024-01), from before to")
+    return jsonify({"elements": analytics.monthly_volume(start, end)})
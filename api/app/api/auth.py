@@ -1,4 +1,12 @@
+import hashlib
+import hmac
+
+from flask import abort, current_app
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import hash_pool, login_cache
+from app.hashing import PoolFull
 from app.models import User
 from app.api.errors import error_response
 
@@ -6,11 +14,41 @@ basic_auth = HTTPBasicAuth()
 token_auth = HTTPTokenAuth()
 
 
+def credentials_digest(username: str, password: str) -> str:
+    """Keyed digest of the credentials, used as key of the login cache so that
+    passwords are never kept in memory"""
+    return hmac.new(
+        current_app.config["SECRET_KEY"].encode(),
+        f"{username}\0{password}".encode(),
+        hashlib.sha256,
+    ).hexdigest()
+
+
 @basic_auth.verify_password
 def verify_password(username, password):
+    """Verifies the credentials on the hashing pool, unless they were verified
+    recently. Hashes made with an outdated method are upgraded on the fly, the
+    caller is expected to commit."""
     user = User.query.filter_by(username=username).first()
-    if user and user.check_password(password):
+    if not (user and user.password_hash and isinstance(password, str)):
+        return None
+    key = credentials_digest(username, password)
+    # comparing hashes makes a password change invalidate the cached entry
+    if login_cache.get(key) == user.password_hash:
         return user
+    try:
+        if not hash_pool.run(check_password_hash, user.password_hash, password):
+            return None
+        if user.password_needs_rehash():
+            user.password_hash = hash_pool.run(
+                generate_password_hash,
+                password,
+                current_app.config["PASSWORD_HASH_METHOD"],
+            )
+    except PoolFull:
+        abort(503)
+    login_cache.set(key, user.password_hash)
+    return user
 
 
 @basic_auth.error_handler
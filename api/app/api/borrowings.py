@@ -1,30 +1,166 @@
-from flask import jsonify
+import random
+from datetime import date
+from time import sleep
+from typing import Callable
+
+from flask import Response, current_app, jsonify, request, url_for
+from app import db
 from app.api import bp
 from app.api.auth import token_auth
+from app.api.conditional import collection_validator, not_modified, with_validators
+from app.api.errors import bad_request, error_response, unauthorized
+from app.models import Borrowing, Item, Role, User
+
+
+def _history(query, reuf_view: bool, endpoint: str, id: int) -> Response:
+    """Returns the page of the borrowings of the query asked by the request, most
+    recent first, paginated by cursor. Like cursor pages of every borrowing, it is
+    only checked against the ETag of the history for conditional requests."""
+    etag = collection_validator(
+        lambda: Borrowing.collection_etag(query, reuf_view), False
+    )
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    per_page = max(1, min(request.args.get("per_page", 10, type=int), 100))
+    try:
+        data = Borrowing.to_cursor_collection_dict(
+            query,
+            [Borrowing.timestamp, Borrowing.id],
+            request.args.get("cursor") or None,
+            per_page,
+            endpoint,
+            reuf_view,
+            descending=True,
+            with_total=request.args.get("with_total", 0, type=int) == 1,
+            id=id,
+        )
+    except ValueError:
+        return bad_request("the given cursor is not valid")
+    return with_validators(jsonify(data), etag)
 
 
 @bp.route("/borrowings/with_item/<int:id>", methods=["GET"])
 @token_auth.login_required
 def get_borrowings_with_item(id):
-    return jsonify({})
+    """Retrieves the history of the borrowings of the item with the given id, most
+    recent first, if the current user holds the roles required to see it. Reufs see
+    every borrowing, other users only theirs. Pages are read from the
+    (item_id, timestamp) index, their cost does not depend on their depth.
+
+    Args (in the GET request):
+        - cursor: the cursor of the page we want to have informations for, empty or
+        absent for the first one. The 'next' link holds the cursor of the next page.
+        - per_page: the number of elements per page. 10 by default, should be
+        less that 100
+        - with_total: set to 1 to count the total number of borrowings"""
+    current_user = token_auth.current_user()
+    Item.accessible_query(current_user.get_roles()).filter_by(id=id).first_or_404()
+    reuf_view = current_user.has_one_of_roles([Role.REUF, Role.REUF_ADMIN])
+    query = Borrowing.query.filter_by(item_id=id)
+    if not reuf_view:
+        query = query.filter_by(user_id=current_user.id)
+    return _history(query, reuf_view, "api.get_borrowings_with_item", id)
 
 
 @bp.route("/borrowings/for_user/<int:id>", methods=["GET"])
 @token_auth.login_required
 def get_borrowings_for_user(id):
-    return jsonify({})
+    """Retrieves the history of the borrowings of the user with the given id, most
+    recent first. Users can only see their borrowings, reufs can see the ones of
+    every user. Pages are read from the (user_id, timestamp) index, their cost does
+    not depend on their depth.
+
+    Args (in the GET request):
+        - cursor: the cursor of the page we want to have informations for, empty or
+        absent for the first one. The 'next' link holds the cursor of the next page.
+        - per_page: the number of elements per page. 10 by default, should be
+        less that 100
+        - with_total: set to 1 to count the total number of borrowings"""
+    current_user = token_auth.current_user()
+    reuf_view = current_user.has_one_of_roles([Role.REUF, Role.REUF_ADMIN])
+    if current_user.id != id and not reuf_view:
+        return unauthorized()
+    User.query.get_or_404(id)
+    query = Borrowing.query.filter_by(user_id=id)
+    return _history(query, reuf_view, "api.get_borrowings_for_user", id)
 
 
 @bp.route("/borrowings/<int:id>", methods=["GET"])
 @token_auth.login_required
 def get_borrowing(id):
-    return jsonify({})
+    """Retrieves the borrowing with the given id. Users can only see their
+    borrowings, reufs can see every borrowing. Answers with a 304 if the copy of the
+    client is still valid (If-None-Match or If-Modified-Since headers), which
+    depends on the borrower and the borrowed item too."""
+    current_user = token_auth.current_user()
+    reuf_view = current_user.has_one_of_roles([Role.REUF, Role.REUF_ADMIN])
+    borrowing = Borrowing.query.filter_by(id=id)
+    if not reuf_view:
+        borrowing = borrowing.filter_by(user_id=current_user.id)
+    borrowing = borrowing.first_or_404()
+    etag, modified = borrowing.validators(reuf_view)
+    response = not_modified(etag, modified)
+    if response is not None:
+        return response
+    return with_validators(jsonify(borrowing.to_dict(reuf_view)), etag, modified)
 
 
 @bp.route("/borrowings/", methods=["GET"])
-@token_auth.login_required
+@token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
 def get_borrowings():
-    return jsonify({})
+    """Retrieves the history of all the borrowings, most recent first. Only reufs
+    are allowed for this request.
+
+    Args (in the GET request):
+        - cursor: the cursor of the page we want to have informations for, empty for
+        the first one. The 'next' link holds the cursor of the next page.
+        - with_total: set to 1 to count the total number of borrowings
+        - page: the page we want to have informations for, used when no cursor is
+        given. Deep pages are slow to compute, prefer the cursor.
+        - per_page: the number of elements per page. 10 by default, should be
+        less that 100
+        - stream: set to 1 to stream every borrowing instead of a page
+
+    Answers with a 304 if the copy of the client is still valid (If-None-Match
+    header), checked from the number of borrowings and the last modification of
+    the borrowings, users and items. Cursor pages and streams only compute the
+    ETag for conditional requests, pages by number always send it."""
+    stream = request.args.get("stream", 0, type=int) == 1
+    etag = collection_validator(
+        lambda: Borrowing.collection_etag(Borrowing.query),
+        not stream and "cursor" not in request.args,
+    )
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    if stream:
+        query = Borrowing.query.order_by(
+            Borrowing.timestamp.desc(), Borrowing.id.desc()
+        )
+        return with_validators(Borrowing.to_collection_stream(query, True), etag)
+    per_page = max(1, min(request.args.get("per_page", 10, type=int), 100))
+    if "cursor" in request.args:
+        try:
+            data = Borrowing.to_cursor_collection_dict(
+                Borrowing.query,
+                [Borrowing.timestamp, Borrowing.id],
+                request.args["cursor"] or None,
+                per_page,
+                "api.get_borrowings",
+                True,
+                descending=True,
+                with_total=request.args.get("with_total", 0, type=int) == 1,
+            )
+        except ValueError:
+            return bad_request("the given cursor is not valid")
+        return with_validators(jsonify(data), etag)
+    page = request.args.get("page", 1, type=int)
+    query = Borrowing.query.order_by(Borrowing.timestamp.desc(), Borrowing.id.desc())
+    data = Borrowing.to_collection_dict(
+        query, page, per_page, "api.get_borrowings", True
+    )
+    return with_validators(jsonify(data), etag)
 
 
 @bp.route("/borrowings/<int:id>", methods=["PUT"])
@@ -33,10 +169,179 @@ def modify_borrowing(id):
     return jsonify({})
 
 
+def _commit_claiming_items(prepare: Callable) -> Response:
+    """Commits the borrowings added by prepare() once the versions of their items
+    are claimed, calling prepare() again when a concurrent borrowing of one of the
+    items got committed first.
+
+    prepare() returns either an error response, or the versions of the items read
+    before checking their availability and a function building the response once
+    the borrowings are committed."""
+    attempts = current_app.config["BORROWING_ATTEMPTS"]
+    for attempt in range(attempts):
+        prepared = prepare()
+        if isinstance(prepared, Response):
+            return prepared
+        versions, respond = prepared
+        if Item.claim_versions(versions):
+            db.session.commit()
+            return respond()
+        db.session.rollback()
+        if attempt + 1 < attempts:
+            # randomized exponential backoff, so that the conflicting requests do
+            # not collide again
+            sleep(random.uniform(0, 0.002 * 2**attempt))
+    return error_response(
+        409, "the items are being borrowed concurrently, please try again"
+    )
+
+
+def _borrowing_dates(data: dict) -> tuple[date, date]:
+    """Parses the ISO borrowing_date and return_date of data. Raises ValueError if
+    one of them is missing or invalid."""
+    try:
+        return (
+            date.fromisoformat(data["borrowing_date"]),
+            date.fromisoformat(data["return_date"]),
+        )
+    except (KeyError, TypeError):
+        raise ValueError("missing dates")
+
+
 @bp.route("/borrowings/borrow/<int:item_id>/<int:user_id>", methods=["POST"])
 @token_auth.login_required
 def borrow_item(item_id, user_id):
-    return jsonify({})
+    """Creates a borrowing of an item for a user. Users can only borrow for
+    themselves, reufs can borrow for anyone.
+
+    Args (in the POSTed value):
+        - borrowing_date, return_date: first and last days of the borrowing
+        (included), in ISO format
+        - borrowed_quantity: the number of units borrowed
+        - borrowing_description, remarks: optional strings
+
+    The availability check and the insertion are atomic: the version of the item is
+    claimed in the transaction inserting the borrowing, which is retried from the
+    check when a concurrent borrowing of the same item got committed first."""
+    current_user = token_auth.current_user()
+    if current_user.id != user_id and not current_user.has_one_of_roles(
+        [Role.REUF, Role.REUF_ADMIN]
+    ):
+        return unauthorized()
+    data = request.get_json() or {}
+    try:
+        borrowing_date, return_date = _borrowing_dates(data)
+    except ValueError:
+        return bad_request("must include borrowing_date and return_date in ISO format")
+    quantity = data.get("borrowed_quantity", 1)
+    # booleans are ints
+    if not (type(quantity) is int and quantity > 0):
+        return bad_request("borrowed_quantity should be a positive integer")
+
+    def prepare():
+        user = User.query.get_or_404(user_id)
+        # the version is read before the availability is checked
+        item = Item.accessible_query(user.roles).filter_by(id=item_id).first_or_404()
+        version = item.version
+        try:
+            borrowing = user.borrow(
+                item,
+                borrowing_date,
+                return_date,
+                quantity,
+                data.get("borrowing_description", ""),
+                data.get("remarks", ""),
+            )
+        except TypeError:
+            return bad_request("the given values do not have the right types")
+        except ValueError as e:
+            return bad_request(str(e))
+        db.session.add(borrowing)
+
+        def respond():
+            response = jsonify(borrowing.to_dict(True))
+            response.status_code = 201
+            response.headers["Location"] = url_for("api.get_borrowing", id=borrowing.id)
+            return response
+
+        return {item.id: version}, respond
+
+    return _commit_claiming_items(prepare)
+
+
+@bp.route("/borrowings/checkout/<int:user_id>", methods=["POST"])
+@token_auth.login_required
+def checkout(user_id):
+    """Creates the borrowings of several items for a user, for the same dates, at
+    once: either every borrowing is created, or none. Users can only borrow for
+    themselves, reufs can borrow for anyone.
+
+    Args (in the POSTed value):
+        - borrowing_date, return_date: first and last days of the borrowings
+        (included), in ISO format
+        - items: list of {"id": item id, "quantity": number of units borrowed}, of
+        at most 100 items. Quantities of the same item are summed.
+        - borrowing_description, remarks: optional strings
+
+    Validating and inserting the borrowings takes a constant number of queries, the
+    borrowings are inserted with a single statement."""
+    current_user = token_auth.current_user()
+    if current_user.id != user_id and not current_user.has_one_of_roles(
+        [Role.REUF, Role.REUF_ADMIN]
+    ):
+        return unauthorized()
+    data = request.get_json() or {}
+    try:
+        borrowing_date, return_date = _borrowing_dates(data)
+    except ValueError:
+        return bad_request("must include borrowing_date and return_date in ISO format")
+    lines = data.get("items")
+    if not isinstance(lines, list) or not 0 < len(lines) <= 100:
+        return bad_request("must include a list of 1 to 100 items")
+    quantities = {}
+    for line in lines:
+        # booleans are ints, and negative lines would cancel out once summed
+        if not (
+            isinstance(line, dict)
+            and type(line.get("id")) is int
+            and type(line.get("quantity", 1)) is int
+            and line.get("quantity", 1) > 0
+        ):
+            return bad_request(
+                "items must have an integer id and a positive integer quantity"
+            )
+        quantities[line["id"]] = quantities.get(line["id"], 0) + line.get("quantity", 1)
+
+    def prepare():
+        user = User.query.get_or_404(user_id)
+        try:
+            rows, versions = user.checkout(
+                quantities,
+                borrowing_date,
+                return_date,
+                data.get("borrowing_description", ""),
+                data.get("remarks", ""),
+            )
+        except TypeError:
+            return bad_request("the given values do not have the right types")
+        except ValueError as e:
+            return bad_request(str(e))
+        Borrowing.insert_rows(rows)
+
+        def respond():
+            borrowings = (
+                Borrowing.query.options(*Borrowing.collection_load_options())
+                .filter_by(user_id=user_id, timestamp=rows[0]["timestamp"])
+                .filter(Borrowing.item_id.in_(list(quantities)))
+                .order_by(Borrowing.id)
+            )
+            response = jsonify({"elements": [b.to_dict(True) for b in borrowings]})
+            response.status_code = 201
+            return response
+
+        return versions, respond
+
+    return _commit_claiming_items(prepare)
 
 
 @bp.route("/borrowings/<int:id>", methods=["DELETE"])
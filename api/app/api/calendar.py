@@ -0,0 +1,55 @@
+from flask import current_app, jsonify, request
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.dates import date_window
+from app.api.errors import bad_request
+from app.encoding import runs
+from app.models import Item
+
+
+@bp.route("/calendar", methods=["GET"])
+@token_auth.login_required
+def get_calendar():
+    """Retrieves the number of units in use on each day of a window of dates, for
+    every item the current user can see that is borrowed during the window. The
+    borrowings are fetched with a single query.
+
+    The days of an item are given by its in_use list of pairs [day, units]: units
+    are in use from the day-th day of the window (0 being from) until the day of
+    the next pair, or until to for the last one.
+
+    Args (in the GET request):
+        - from: the first day of the window, in ISO format (2024-01-22)
+        - to: the last day of the window, in ISO format. The window spans at most
+        CALENDAR_MAX_DAYS days
+        - id: the id of an item to include. Can be repeated, every item is
+        included if not given"""
+    try:
+        start, end = date_window(request.args)
+    except ValueError:
+        return bad_request("from and to should be ISO dates, from before to")
+    max_days = current_app.config["CALENDAR_MAX_DAYS"]
+    if (end - start).days >= max_days:
+        return bad_request(f"the window should span at most {max_days} days")
+    ids = request.args.getlist("id", type=int)
+    usages = Item.daily_usages(ids or None, start, end)
+    items = Item.accessible_query(token_auth.current_user().get_roles())
+    if ids:
+        items = items.filter(Item.id.in_(ids))
+    items = items.with_entities(Item.id, Item.name, Item.quantity).order_by(Item.id)
+    return jsonify(
+        {
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "elements": [
+                {
+                    "id": id,
+                    "name": name,
+                    "quantity": quantity,
+                    "in_use": runs(usages[id]),
+                }
+                for id, name, quantity in items
+                if id in usages
+            ],
+        }
+    )
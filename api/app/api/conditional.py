@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+from typing import Callable, Union
+
+from flask import Response, request
+
+
+def collection_validator(etag: Callable[[], str], counted: bool) -> Union[str, None]:
+    """Returns the ETag of a collection, given by the etag function, or None if it
+    is not worth computing for the request.
+
+    The ETag of a collection aggregates every element of the collection (see
+    PaginatedAPIMixin.collection_etag), which costs as much as counting them. Pages
+    by number count them anyway (counted), but cursor pages and streams avoid
+    scanning the collection: these only compute the ETag to answer a conditional
+    request. The ETag does not depend on the page or the mode, the one of any page
+    of the collection can be checked this way."""
+    if counted or request.if_none_match or request.if_modified_since is not None:
+        return etag()
+    return None
+
+
+def not_modified(
+    etag: Union[str, None], last_modified: datetime = None
+) -> Union[Response, None]:
+    """Returns a 304 response if the copy of the client, given by the If-None-Match
+    or If-Modified-Since header of the request, is still valid, before the body is
+    serialized. Returns None otherwise, the response should then be sent through
+    with_validators.
+
+    Args:
+        - etag: the current ETag of the representation, None if it is not known
+        - last_modified: when the representation last changed (in UTC), None if it
+        is unknown"""
+    if etag is None and last_modified is None:
+        return None
+    if request.if_none_match:
+        fresh = etag is not None and request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        fresh = (
+            since is not None
+            and last_modified is not None
+            and last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+        )
+    if not fresh:
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def with_validators(
+    response: Response, etag: Union[str, None], last_modified: datetime = None
+) -> Response:
+    """Sets the ETag and Last-Modified headers of the response, when they are
+    known. Clients and caches are asked to check their copy with them before using
+    it."""
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # the representation depends on the roles of the authenticated user
+    response.vary.add("Authorization")
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,21 @@
+from datetime import date
+
+from flask import current_app, jsonify
+from app import dashboard
+from app.api import bp
+from app.api.auth import token_auth
+from app.models import Role
+
+
+@bp.route("/dashboard", methods=["GET"])
+@token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
+def get_dashboard():
+    """Retrieves the value of the inventory (value times quantity of the items) and
+    the number of items that need cleaning, are damaged, expire within
+    REMINDER_EXPIRY_DAYS or are borrowed today, in total, per location ("locations")
+    and per box of each location ("boxes"). Only reufs are allowed for this request.
+
+    The dashboard is cached until an item or a borrowing changes."""
+    return jsonify(
+        dashboard.summary(date.today(), current_app.config["REMINDER_EXPIRY_DAYS"])
+    )
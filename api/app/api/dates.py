@@ -0,0 +1,25 @@
+from datetime import date
+
+from werkzeug.datastructures import MultiDict
+
+
+def date_window(args: MultiDict) -> tuple[date, date]:
+    """Returns the window of dates given by the 'from' and 'to' arguments of a
+    request, in ISO format (2024-01-22). Raises ValueError if one is missing or
+    invalid, or if the window ends before it starts."""
+    start = date.fromisoformat(args.get("from", ""))
+    end = date.fromisoformat(args.get("to", ""))
+    if end < start:
+        raise ValueError("the window should end after it starts")
+    return start, end
+
+
+def month_window(args: MultiDict) -> tuple[date, date]:
+    """Returns the first days of the months given by the 'from' and 'to' arguments
+    of a request, as years and months (2024-01). Raises ValueError if one is missing
+    or invalid, or if the window ends before it starts."""
+    start = date.fromisoformat(args.get("from", "") + "-01")
+    end = date.fromisoformat(args.get("to", "") + "-01")
+    if end < start:
+        raise ValueError("the window should end after it starts")
+    return start, end
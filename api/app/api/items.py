@@ -1,25 +1,298 @@
-from flask import jsonify
+from datetime import date
+
+from flask import (
+    Response,
+    current_app,
+    jsonify,
+    request,
+    send_file,
+    stream_with_context,
+)
+from werkzeug.datastructures import MultiDict
+from app import db, image_store, inventory
 from app.api import bp
 from app.api.auth import token_auth
+from app.api.conditional import collection_validator, not_modified, with_validators
+from app.api.dates import date_window
+from app.api.errors import bad_request, error_response
 from app.models import Role, Item
 
+# arguments of the requests filtering items, see _item_filters
+FILTER_ARGS = Item.FACETS + ["expires_after", "expires_before"]
+
+
+def _item_filters(args: MultiDict, facets: list[str]) -> dict:
+    """Returns the filters (see Item.filter_query) given by the arguments of a
+    request. Facets can be repeated to accept several values, needs_cleaning takes
+    'true' or 'false', expires_after and expires_before take ISO dates. Raises
+    ValueError if a value is invalid or if a facet that is not in facets is used."""
+    filters = {}
+    for facet in Item.FACETS:
+        values = args.getlist(facet)
+        if not values:
+            continue
+        if facet not in facets:
+            raise ValueError(f"cannot filter on {facet}")
+        if facet == "needs_cleaning":
+            if not set(values) <= {"true", "false"}:
+                raise ValueError("needs_cleaning should be true or false")
+            values = [v == "true" for v in values]
+        filters[facet] = values
+    for name in ["expires_after", "expires_before"]:
+        if name in args:
+            try:
+                filters[name] = date.fromisoformat(args[name])
+            except ValueError:
+                raise ValueError(f"{name} should be an ISO date")
+    return filters
+
 
 @bp.route("/items/<int:id>", methods=["GET"])
 @token_auth.login_required
 def get_item(id):
-    return jsonify({})
+    """Retrieves the item with the given id, if the current user holds the roles
+    required to see it. Answers with a 304 if the copy of the client is still valid
+    (If-None-Match or If-Modified-Since headers)."""
+    current_user = token_auth.current_user()
+    item = Item.accessible_query(current_user.get_roles()).filter_by(id=id)
+    item = item.first_or_404()
+    reuf_view = current_user.has_one_of_roles([Role.REUF, Role.REUF_ADMIN])
+    etag, modified = item.validators(reuf_view)
+    response = not_modified(etag, modified)
+    if response is not None:
+        return response
+    return with_validators(jsonify(item.to_dict(reuf_view)), etag, modified)
 
 
 @bp.route("/items/", methods=["GET"])
 @token_auth.login_required
 def get_items():
-    return jsonify({})
+    """Retrieves a paginated view of the items the current user holds the roles
+    required to see. Items are filtered by the database, pages and totals are
+    therefore exact.
+
+    Args (in the GET request):
+        - page: the page we want to have informations for
+        - per_page: the number of elements per page. 10 by default, should be
+        less that 100
+        - stream: set to 1 to stream every item instead of a page
+        - condition, and for reufs location, box_name and needs_cleaning (true or
+        false): only returns the items with this value. Can be repeated to accept
+        several values.
+        - expires_after, expires_before: only returns the items expiring between
+        these dates (included), in ISO format
+        - facets: set to 1 to count the items for each value of the facets above
+        in '_facets'. The counts of a facet ignore its own filter.
+
+    Answers with a 304 if the copy of the client is still valid (If-None-Match
+    header), checked from the number of items the current user can see and their
+    last modification. Streams only compute the ETag for conditional requests,
+    pages always send it."""
+    current_user = token_auth.current_user()
+    reuf_view = current_user.has_one_of_roles([Role.REUF, Role.REUF_ADMIN])
+    facets = [f for f in Item.FACETS if reuf_view or f not in Item.REUF_FACETS]
+    try:
+        filters = _item_filters(request.args, facets)
+    except ValueError as e:
+        return bad_request(str(e))
+    accessible = Item.accessible_query(current_user.get_roles())
+    stream = request.args.get("stream", 0, type=int) == 1
+    # the filtered items, pages and facets only change with the accessible items
+    etag = collection_validator(
+        lambda: Item.collection_etag(accessible, reuf_view, current_user.role_mask),
+        not stream,
+    )
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    query = Item.filter_query(accessible, filters).order_by(Item.id)
+    if stream:
+        return with_validators(Item.to_collection_stream(query, reuf_view), etag)
+    page = request.args.get("page", 1, type=int)
+    per_page = max(1, min(request.args.get("per_page", 10, type=int), 100))
+    # the links of the pages keep the filters
+    args = {a: request.args.getlist(a) for a in FILTER_ARGS if a in request.args}
+    data = Item.to_collection_dict(
+        query, page, per_page, "api.get_items", reuf_view, **args
+    )
+    if request.args.get("facets", 0, type=int) == 1:
+        data["_facets"] = Item.facet_counts(accessible, filters, facets)
+    return with_validators(jsonify(data), etag)
+
+
+@bp.route("/items/search", methods=["GET"])
+@token_auth.login_required
+def search_items():
+    """Retrieves a paginated view of the items the current user can see that contain
+    every word of the search, as a word or a prefix, by decreasing relevance.
+
+    Args (in the GET request):
+        - q: the searched words
+        - page: the page we want to have informations for
+        - per_page: the number of elements per page. 10 by default, should be
+        less that 100
+
+    Answers with a 304 if the copy of the client is still valid (If-None-Match
+    header), checked against the items the user can see. The ETag scans them, it is
+    only computed for conditional requests."""
+    current_user = token_auth.current_user()
+    reuf_view = current_user.has_one_of_roles([Role.REUF, Role.REUF_ADMIN])
+    q = request.args.get("q", "")
+    try:
+        query = Item.search(q, current_user.get_roles())
+    except ValueError:
+        return bad_request("q should contain at least one word")
+    etag = collection_validator(
+        lambda: Item.collection_etag(
+            Item.accessible_query(current_user.get_roles()),
+            reuf_view,
+            current_user.role_mask,
+        ),
+        False,
+    )
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    page = request.args.get("page", 1, type=int)
+    per_page = max(1, min(request.args.get("per_page", 10, type=int), 100))
+    data = Item.to_collection_dict(
+        query, page, per_page, "api.search_items", reuf_view, q=q
+    )
+    return with_validators(jsonify(data), etag)
+
+
+@bp.route("/items/import", methods=["POST"])
+@token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
+def import_items():
+    """Creates items from the body of the request, or from its 'file' file if it is
+    a form: a CSV file with a header or JSON Lines, with the fields listed in
+    app.inventory.FIELDS. Rows are parsed while the body is read and inserted by
+    chunks of INVENTORY_CHUNK_SIZE rows, each in its own transaction. Invalid rows
+    and rows which name is taken are skipped.
+
+    Args (in the query string):
+        - format: csv or jsonl, given by the content type of the file otherwise
+
+    Returns the number of items created and the errors of the rows skipped, by
+    line."""
+    file = request.files.get("file")
+    mimetype = file.mimetype if file else request.mimetype
+    format = request.args.get("format") or {
+        m: f for f, m in inventory.MIMETYPES.items()
+    }.get(mimetype)
+    try:
+        rows = inventory.read_rows(file.stream if file else request.stream, format)
+        report = inventory.import_items(
+            rows, current_app.config["INVENTORY_CHUNK_SIZE"]
+        )
+    except ValueError as e:
+        return bad_request(str(e))
+    return jsonify(report)
+
+
+@bp.route("/items/export", methods=["GET"])
+@token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
+def export_items():
+    """Streams every item as a CSV file with a header or as JSON Lines, ready to be
+    imported again. The memory used does not depend on the number of items.
+
+    Args (in the GET request):
+        - format: csv (by default) or jsonl"""
+    format = request.args.get("format", "csv")
+    if format not in inventory.FORMATS:
+        return bad_request("format should be one of " + ", ".join(inventory.FORMATS))
+    chunks = inventory.export_items(format, current_app.config["INVENTORY_CHUNK_SIZE"])
+    return Response(
+        stream_with_context(chunks),
+        mimetype=inventory.MIMETYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=items.{format}"},
+    )
+
+
+@bp.route("/items/<int:id>/availability", methods=["GET"])
+@token_auth.login_required
+def get_item_availability(id):
+    """Retrieves the number of units of the item with the given id that are in use
+    and available over a window of dates.
+
+    Args (in the GET request):
+        - from: the first day of the window, in ISO format (2024-01-22)
+        - to: the last day of the window, in ISO format"""
+    try:
+        start, end = date_window(request.args)
+    except ValueError:
+        return bad_request("from and to should be ISO dates, from before to")
+    current_user = token_auth.current_user()
+    item = Item.accessible_query(current_user.get_roles()).filter_by(id=id)
+    item = item.first_or_404()
+    in_use = Item.peak_usages([item.id], start, end).get(item.id, 0)
+    return jsonify(item.availability_dict(start, end, in_use))
+
+
+@bp.route("/items/availability", methods=["GET"])
+@token_auth.login_required
+def get_items_availability():
+    """Retrieves the availability over a window of dates of several items at once,
+    computed from a single query on the borrowings.
+
+    Args (in the GET request):
+        - from: the first day of the window, in ISO format (2024-01-22)
+        - to: the last day of the window, in ISO format
+        - id: the id of an item to include. Can be repeated, every item the current
+        user can see is included if not given"""
+    try:
+        start, end = date_window(request.args)
+    except ValueError:
+        return bad_request("from and to should be ISO dates, from before to")
+    ids = request.args.getlist("id", type=int)
+    query = Item.accessible_query(token_auth.current_user().get_roles())
+    if ids:
+        query = query.filter(Item.id.in_(ids))
+    peaks = Item.peak_usages(ids or None, start, end)
+    return jsonify(
+        {
+            "elements": [
+                item.availability_dict(start, end, peaks.get(item.id, 0))
+                for item in query.order_by(Item.id)
+            ]
+        }
+    )
 
 
 @bp.route("items/image/<int:id>", methods=["GET"])
 @token_auth.login_required
 def get_item_image(id):
-    return jsonify({})
+    """Retrieves the image of the item with the given id, if the current user holds
+    the roles required to see it. The file is sent as is by the server, with an ETag
+    derived from its content: requests with a matching If-None-Match are answered
+    with a 304, and Range requests with the requested part.
+        - size: the size of the thumbnail to retrieve instead, one of
+        IMAGE_THUMBNAIL_SIZES"""
+    size = request.args.get("size", type=int)
+    sizes = current_app.config["IMAGE_THUMBNAIL_SIZES"]
+    if "size" in request.args and size not in sizes:
+        return bad_request("size should be one of " + ", ".join(map(str, sizes)))
+    (key,) = (
+        Item.accessible_query(token_auth.current_user().get_roles())
+        .filter_by(id=id)
+        .with_entities(Item.image_key)
+        .first_or_404()
+    )
+    if key is None:
+        return error_response(404, "this item has no image")
+    try:
+        path = (
+            image_store.path(key) if size is None else image_store.thumbnail(key, size)
+        )
+        etag = key if size is None else f"{key}-{size}"
+        response = send_file(path, etag=etag, conditional=True)
+    except FileNotFoundError:
+        # the image was replaced meanwhile
+        return error_response(404, "this item has no image")
+    # the image of an item can change, clients check their copy is still valid
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @bp.route("/items/", methods=["POST"])
@@ -29,9 +302,25 @@ def add_item():
 
 
 @bp.route("items/image/<int:id>", methods=["PUT"])
-@token_auth.login_required
+@token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
 def update_item_image(id):
-    return jsonify({})
+    """Replaces the image of the item with the given id by the body of the request,
+    or by its 'image' file if it is a form. Images are JPEG, PNG, GIF or WebP files
+    of up to IMAGE_MAX_SIZE bytes. Identical images are stored once."""
+    current_user = token_auth.current_user()
+    item = (
+        Item.accessible_query(current_user.get_roles()).filter_by(id=id).first_or_404()
+    )
+    file = request.files.get("image")
+    try:
+        key = image_store.save(file.stream if file else request.stream)
+    except ValueError as e:
+        return bad_request(str(e))
+    previous, item.image_key = item.image_key, key
+    db.session.commit()
+    if previous is not None and previous != key and not Item.image_in_use(previous):
+        image_store.delete(previous)
+    return jsonify(item.to_dict(True))
 
 
 @bp.route("/items/<int:id>", methods=["PUT"])
@@ -42,5 +331,5 @@ def update_item(id):
 
 @bp.route("/items/<int:id>", methods=["DELETE"])
 @token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
-def delete_item():
+def delete_item(id):
     return jsonify({})
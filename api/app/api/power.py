@@ -0,0 +1,97 @@
+from datetime import date
+from typing import Union
+
+from flask import Response, current_app, jsonify, request
+from app import power
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.dates import date_window
+from app.api.errors import bad_request
+from app.models import Role
+
+
+def _planned_borrowings(data: dict) -> Union[list[dict], Response]:
+    """Returns the planned borrowings of a POSTed value with their dates parsed, or
+    an error response"""
+    planned = data.get("borrowings")
+    if not isinstance(planned, list) or not 0 < len(planned) <= 1000:
+        return bad_request("must include a list of 1 to 1000 borrowings")
+    borrowings = []
+    for borrowing in planned:
+        if not (
+            isinstance(borrowing, dict)
+            and type(borrowing.get("id")) is int
+            and type(borrowing.get("quantity", 1)) is int
+            and borrowing.get("quantity", 1) > 0
+        ):
+            return bad_request(
+                "borrowings must have an integer id and a positive integer quantity"
+            )
+        try:
+            borrowing_date = date.fromisoformat(borrowing["borrowing_date"])
+            return_date = date.fromisoformat(borrowing["return_date"])
+        except (KeyError, TypeError, ValueError):
+            return bad_request(
+                "borrowings must include borrowing_date and return_date in ISO format"
+            )
+        if return_date < borrowing_date:
+            return bad_request("borrowings must end after they start")
+        borrowings.append(
+            {
+                "id": borrowing["id"],
+                "quantity": borrowing.get("quantity", 1),
+                "borrowing_date": borrowing_date,
+                "return_date": return_date,
+            }
+        )
+    return borrowings
+
+
+@bp.route("/power", methods=["GET", "POST"])
+@token_auth.login_required(role=[Role.REUF, Role.REUF_ADMIN])
+def get_power():
+    """Retrieves the power drawn (in Watts) on each day of a window of dates by the
+    borrowed items: the sum of their power times the quantity borrowed. Planned
+    borrowings can be POSTed to be added to the existing ones. Only reufs are
+    allowed for this request.
+
+    The response gives the peak draw and its first day, the draw summed over the
+    days (watt_days), and the draw of each day as a list of pairs [day, watts]:
+    watts are drawn from the day-th day of the window (0 being from) until the day
+    of the next pair, or until to for the last one.
+
+    Args (in the GET request, or in the POSTed value):
+        - from: the first day of the window, in ISO format (2024-01-22). When
+        borrowings are POSTed, from and to default to the first and last days of
+        the borrowings
+        - to: the last day of the window, in ISO format. The window spans at most
+        CALENDAR_MAX_DAYS days
+        - borrowings: in the POSTed value only, list of at most 1000 planned
+        borrowings {"id": item id, "quantity": number of units, "borrowing_date",
+        "return_date": first and last days of the borrowing, in ISO format}"""
+    planned = None
+    args = request.args
+    if request.method == "POST":
+        data = request.get_json() or {}
+        if not isinstance(data, dict):
+            return bad_request("the POSTed value should be an object")
+        planned = _planned_borrowings(data)
+        if isinstance(planned, Response):
+            return planned
+        args = {
+            "from": data.get("from")
+            or min([b["borrowing_date"] for b in planned]).isoformat(),
+            "to": data.get("to")
+            or max([b["return_date"] for b in planned]).isoformat(),
+        }
+    try:
+        start, end = date_window(args)
+    except (TypeError, ValueError):
+        return bad_request("from and to should be ISO dates, from before to")
+    max_days = current_app.config["CALENDAR_MAX_DAYS"]
+    if (end - start).days >= max_days:
+        return bad_request(f"the window should span at most {max_days} days")
+    try:
+        return jsonify(power.power_report(start, end, planned))
+    except ValueError as e:
+        return bad_request(str(e))
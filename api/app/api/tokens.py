@@ -38,7 +38,6 @@ def revoke_token(id):
 def revoke_all_token():
     """Allows an admin to revoke the tokens of every users. They should all
     re-authenticate with basic auth to obtain a new one."""
-    all_users = User.query.all()
-    [u.revoke_token() for u in all_users]
+    User.revoke_all_tokens()
     db.session.commit()
     return "", 204
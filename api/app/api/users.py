@@ -3,6 +3,7 @@ from app import db
 from app.models import User, Role
 from app.api import bp
 from app.api.auth import token_auth
+from app.api.conditional import collection_validator, not_modified, with_validators
 from app.api.errors import bad_request, unauthorized
 
 
@@ -10,13 +11,20 @@ from app.api.errors import bad_request, unauthorized
 @token_auth.login_required()
 def get_user(id):
     """Retrieves information of the user with the given id. Users can only see
-    their information, only reufs can see informations of other users."""
+    their information, only reufs can see informations of other users. Answers with
+    a 304 if the copy of the client is still valid (If-None-Match or
+    If-Modified-Since headers)."""
     current_is_reuf = token_auth.current_user().has_one_of_roles(
         [Role.REUF, Role.REUF_ADMIN]
     )
     if token_auth.current_user().id != id and not current_is_reuf:
         return unauthorized()
-    return jsonify(User.query.get_or_404(id).to_dict(current_is_reuf))
+    user = User.query.get_or_404(id)
+    etag, modified = user.validators(current_is_reuf)
+    response = not_modified(etag, modified)
+    if response is not None:
+        return response
+    return with_validators(jsonify(user.to_dict(current_is_reuf)), etag, modified)
 
 
 @bp.route("/users", methods=["GET"])
@@ -28,11 +36,55 @@ def get_users():
     Args (in the GET request):
         - page: the page we want to have informations for
         - per_page: the number of elements per page. 10 by default, should be
-        less that 100"""
+        less that 100
+        - role: only returns the users holding this role. Can be repeated to get
+        the users holding one of several roles
+        - cursor: paginates by cursor instead of page number when given, empty for
+        the first page. The 'next' link holds the cursor of the next page.
+        - with_total: set to 1 to count the total number of users in cursor mode
+        - stream: set to 1 to stream every user instead of a page
+
+    Answers with a 304 if the copy of the client is still valid (If-None-Match
+    header), checked from the number of users and their last modification. Cursor
+    pages and streams only compute the ETag for conditional requests, pages by
+    number always send it."""
     page = request.args.get("page", 1, type=int)
-    per_page = min(request.args.get("per_page", 10, type=int), 100)
-    data = User.to_collection_dict(User.query, page, per_page, "api.get_users")
-    return jsonify(data)
+    per_page = max(1, min(request.args.get("per_page", 10, type=int), 100))
+    query = User.query
+    role_args = request.args.getlist("role")
+    if role_args:
+        try:
+            roles = list(set(Role(r) for r in role_args))
+        except ValueError:
+            return bad_request("the given roles do not exist")
+        query = User.with_one_of_roles(roles)
+    stream = request.args.get("stream", 0, type=int) == 1
+    etag = collection_validator(
+        lambda: User.collection_etag(query), not stream and "cursor" not in request.args
+    )
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    if stream:
+        return with_validators(User.to_collection_stream(query.order_by(User.id)), etag)
+    if "cursor" in request.args:
+        try:
+            data = User.to_cursor_collection_dict(
+                query,
+                [User.id],
+                request.args["cursor"] or None,
+                per_page,
+                "api.get_users",
+                with_total=request.args.get("with_total", 0, type=int) == 1,
+                role=role_args,
+            )
+        except ValueError:
+            return bad_request("the given cursor is not valid")
+        return with_validators(jsonify(data), etag)
+    data = User.to_collection_dict(
+        query.order_by(User.id), page, per_page, "api.get_users", role=role_args
+    )
+    return with_validators(jsonify(data), etag)
 
 
 @bp.route("/users", methods=["POST"])
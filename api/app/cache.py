@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Hashable, Union
+
+from flask import Flask
+
+
+class TTLCache(object):
+    """Bounded in-process cache with least recently used eviction and a per entry
+    time to live. Every worker process holds its own instance, entries are
+    therefore only invalidated in the process performing the invalidation.
+
+    Hits and misses are counted to be able to tune the size and lifetime of the
+    cache from the application logs."""
+
+    def __init__(self, maxsize: int = 0, ttl: float = 0.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def init_app(self, app: Flask, prefix: str) -> None:
+        """Configures the cache from the app config values '<prefix>_SIZE' and
+        '<prefix>_TTL'. A size of 0 disables the cache."""
+        self.maxsize = app.config.get(prefix + "_SIZE", 0)
+        self.ttl = app.config.get(prefix + "_TTL", 0)
+        self.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key: Hashable) -> Union[Any, None]:
+        """Returns the value stored for key if it is still alive, None otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        """Stores value for key. The entry lives for the cache ttl, or for the given
+        ttl if it is shorter."""
+        if not self.enabled:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Removes the entry for key, if any"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Removes every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,111 @@
+import os
+from datetime import date
+
+import click
+from flask import Blueprint, current_app
+
+from app import db
+from app.analytics import rebuild_usages
+from app.inventory import FORMATS, export_items, import_items, read_rows
+from app.reminders import collect_digests, mark_reminded, send_digests
+
+bp = Blueprint("cli", __name__, cli_group=None)
+
+
+@bp.cli.command("send-reminders")
+@click.option(
+    "--expiry-days",
+    type=int,
+    default=None,
+    help="Reports the items expiring within this number of days.",
+)
+@click.option(
+    "--overdue-days",
+    type=int,
+    default=None,
+    help="Reports the borrowings which return date passed within this number of "
+    + "days.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Prints the digests instead of mailing them."
+)
+def send_reminders(expiry_days, overdue_days, dry_run):
+    """Mails a digest of the overdue borrowings to their borrowers, and of these
+    borrowings and the items about to expire to the reufs. Meant to be run daily,
+    by cron for example. Each overdue borrowing is only reminded once."""
+    config = current_app.config
+    today = date.today()
+    if overdue_days is None:
+        overdue_days = config["REMINDER_OVERDUE_DAYS"]
+    digests = collect_digests(
+        today,
+        expiry_days if expiry_days is not None else config["REMINDER_EXPIRY_DAYS"],
+        overdue_days,
+        config["REMINDER_CHUNK_SIZE"],
+    )
+    if dry_run:
+        for email, lines in digests.items():
+            click.echo(f"To {email}:\n" + "\n".join(lines) + "\n")
+        return
+    sent = send_digests(digests)
+    mark_reminded(today, overdue_days)
+    db.session.commit()
+    click.echo(f"{sent} reminders sent")
+
+
+def _file_format(format: str, name: str) -> str:
+    """Returns the given format, or the one of the extension of the file name"""
+    format = format or os.path.splitext(name)[1][1:].lower()
+    if format not in FORMATS:
+        raise click.BadParameter(
+            "cannot tell the format from the file name", param_hint="--format"
+        )
+    return format
+
+
+@bp.cli.command("import-items")
+@click.argument("file", type=click.File("rb"))
+@click.option(
+    "--format",
+    type=click.Choice(FORMATS),
+    default=None,
+    help="The format of the file, given by its extension otherwise.",
+)
+def import_items_command(file, format):
+    """Creates the items of a CSV file with a header or of a JSON Lines file ('-'
+    reads the standard input), by chunks of INVENTORY_CHUNK_SIZE rows. Prints the
+    rows skipped."""
+    report = import_items(
+        read_rows(file, _file_format(format, file.name)),
+        current_app.config["INVENTORY_CHUNK_SIZE"],
+    )
+    for error in report["errors"]:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"{report['imported']} items imported")
+
+
+@bp.cli.command("export-items")
+@click.argument("file", type=click.File("wb"))
+@click.option(
+    "--format",
+    type=click.Choice(FORMATS),
+    default=None,
+    help="The format of the file, given by its extension otherwise.",
+)
+def export_items_command(file, format):
+    """Writes every item to a CSV file with a header or to a JSON Lines file ('-'
+    writes to the standard output)."""
+    for chunk in export_items(
+        _file_format(format, file.name), current_app.config["INVENTORY_CHUNK_SIZE"]
+    ):
+        file.write(chunk)
+
+
+@bp.cli.command("rebuild-analytics")
+def rebuild_analytics():
+    """Recomputes the monthly usage rollups of the items and users from every
+    borrowing. They are kept up to date as borrowings change, this is only needed
+    after modifying the borrowings outside of the application."""
+    count = rebuild_usages()
+    db.session.commit()
+    click.echo(f"analytics rebuilt from {count} borrowings")
@@ -0,0 +1,77 @@
+from datetime import date, timedelta
+
+from sqlalchemy import case, func
+
+from app import dashboard_cache, db
+from app.models import Borrowing, Item
+
+# counters of the dashboard, summed over the items of each box
+COUNTERS = ["items", "value", "needs_cleaning", "damaged", "expiring", "borrowed"]
+
+
+def _counters(today: date, expiry_days: int) -> list:
+    """Returns the aggregates giving the COUNTERS of a group of items"""
+    borrowed = (
+        db.session.query(Borrowing.item_id)
+        .filter(Borrowing.borrowing_date <= today, Borrowing.return_date >= today)
+        .scalar_subquery()
+    )
+
+    def count(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    return [
+        func.count(Item.id),
+        func.coalesce(
+            func.sum(func.coalesce(Item.value, 0) * func.coalesce(Item.quantity, 0)),
+            0,
+        ),
+        count(Item.needs_cleaning.is_(True)),
+        count(Item.condition == "damaged"),
+        count(Item.expiry_date.between(today, today + timedelta(days=expiry_days))),
+        count(Item.id.in_(borrowed)),
+    ]
+
+
+def summary(today: date, expiry_days: int) -> dict:
+    """Returns the value of the inventory (value times quantity of the items) and
+    the number of items that need cleaning, are damaged, expire in expiry_days from
+    today (included) or are borrowed today, in total and for each location and box.
+
+    The counters of every box are computed by a single query grouping the items by
+    location and box name, the locations and the total are summed from them. The
+    result is kept in dashboard_cache until an item or a borrowing changes, see
+    invalidate_dashboard."""
+    if not (isinstance(today, date) and isinstance(expiry_days, int)):
+        raise TypeError("Bad arguments type")
+    cached = dashboard_cache.get((today, expiry_days))
+    if cached is not None:
+        return cached
+    query = (
+        db.session.query(Item.location, Item.box_name, *_counters(today, expiry_days))
+        .group_by(Item.location, Item.box_name)
+        .order_by(Item.location, Item.box_name)
+    )
+    total = dict.fromkeys(COUNTERS, 0)
+    locations = {}
+    boxes = []
+    for location, box_name, *counters in query:
+        box = {"location": location, "box_name": box_name}
+        box.update(zip(COUNTERS, counters))
+        boxes.append(box)
+        if location not in locations:
+            locations[location] = dict(
+                {"location": location}, **dict.fromkeys(COUNTERS, 0)
+            )
+        for counter, value in zip(COUNTERS, counters):
+            locations[location][counter] += value
+            total[counter] += value
+    result = dict(
+        total,
+        date=today.isoformat(),
+        expiry_days=expiry_days,
+        locations=list(locations.values()),
+        boxes=boxes,
+    )
+    dashboard_cache.set((today, expiry_days), result)
+    return result
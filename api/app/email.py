@@ -1,16 +1,6 @@
-from threading import Thread
+from flask_mail import Connection, Message, Attachment
 
-from flask import current_app, Flask
-from flask_mail import Message, Attachment
-
-from app import mail
-
-
-def send_async_email(app: Flask, msg: Message) -> None:
-    # requires to recall app context as mail module is not
-    # necessarily aware and we need flask-mail module and context
-    with app.app_context():
-        mail.send(msg)
+from app import mail, mail_queue
 
 
 def send_email(
@@ -20,8 +10,10 @@ def send_email(
     sender: str = None,
     attachments: list[Attachment] = None,
     sync: bool = False,
+    connection: Connection = None,
 ) -> None:
-    """Sends a mail to the designated recipients. By default, sends asynchronously the mail.
+    """Sends a mail to the designated recipients. By default, sends asynchronously the mail,
+    through the mail queue (see app.mail_queue.MailQueue).
 
     Args:
         - subject: mail subjects
@@ -29,15 +21,19 @@ def send_email(
         - text_body: the body content of the sent mail
         - sender: defines a sender if this one is different from
         app.config['MAIL_DEFAULT_SENDER']
-        - attachments: file to be sent as attachment in mail"""
+        - attachments: file to be sent as attachment in mail
+        - sync: whether to send the mail before returning
+        - connection: an open SMTP session (see mail.connect()) the mail is sent
+        through, before returning. Reusing a session saves connecting to the
+        server for every mail."""
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     if attachments:
         for attachment in attachments:
             msg.attach(*attachment)
-    if sync:
+    if connection is not None:
+        connection.send(msg)
+    elif sync:
         mail.send(msg)
     else:
-        Thread(
-            target=send_async_email, args=(current_app._get_current_object(), msg)
-        ).start()
+        mail_queue.put(msg)
@@ -0,0 +1,70 @@
+import json
+from datetime import date
+from typing import Any, Iterable
+
+from flask import Response, current_app, stream_with_context
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+try:
+    # optional, much faster encoder with native date support
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(o: Any) -> Any:
+    if isinstance(o, date):
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """Encodes obj as compact JSON, with orjson if it is installed. Dates are
+    encoded in ISO 8601 format."""
+    if orjson is not None and current_app.config["JSON_USE_ORJSON"]:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+def runs(values: Iterable) -> list[list]:
+    """Returns a sequence of values run-length encoded, as pairs of the index at
+    which a value starts to repeat and of this value, e.g. [[0, 4], [2, 7]] for
+    [4, 4, 7]"""
+    encoded = []
+    for index, value in enumerate(values):
+        if not encoded or encoded[-1][1] != value:
+            encoded.append([index, value])
+    return encoded
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """Encoder used by jsonify. Encodes dates in ISO 8601 format, like dumps, instead
+    of the HTTP date format of Flask."""
+
+    def default(self, o: Any) -> Any:
+        if isinstance(o, date):
+            return o.isoformat()
+        return super().default(o)
+
+
+def stream_collection(elements: Iterable[dict], batch_size: int = 100) -> Response:
+    """Returns a response streaming the JSON document
+    {"elements": [...], "_meta": {"total_elements": n}} while the elements are
+    being produced, so that the memory used does not depend on their number.
+    Elements are written by batches of batch_size."""
+
+    def generate():
+        yield b'{"elements":['
+        total = 0
+        batch = []
+        for element in elements:
+            batch.append(dumps(element))
+            total += 1
+            if len(batch) == batch_size:
+                yield (b"," if total > batch_size else b"") + b",".join(batch)
+                batch = []
+        if batch:
+            yield (b"," if total > len(batch) else b"") + b",".join(batch)
+        yield b'],"_meta":' + dumps({"total_elements": total}) + b"}\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
@@ -18,3 +18,8 @@ def not_found_error(error):
 def internal_error(error):
     db.session.rollback()
     return api_error_response(500)
+
+
+@bp.app_errorhandler(503)
+def service_unavailable_error(error):
+    return api_error_response(503)
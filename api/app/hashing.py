@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from typing import Any, Callable
+
+from flask import Flask
+
+
+class PoolFull(Exception):
+    """Raised when a task is submitted to a pool which queue is already full"""
+
+
+class HashingPool(object):
+    """Bounded executor for password hashing. PBKDF2 releases the GIL, the pool
+    therefore caps the number of CPUs busy hashing at a time. Tasks beyond the
+    queue depth are refused right away instead of piling up behind the workers."""
+
+    def __init__(self, max_workers: int = 1, queue_depth: int = 0) -> None:
+        self._configure(max_workers, queue_depth)
+
+    def _configure(self, max_workers: int, queue_depth: int) -> None:
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hashing"
+        )
+        # slots for the tasks being run and the ones waiting for a worker
+        self._slots = BoundedSemaphore(max_workers + queue_depth)
+
+    def init_app(self, app: Flask) -> None:
+        """Configures the pool from app.config["HASHING_POOL_SIZE"] and
+        app.config["HASHING_QUEUE_DEPTH"]"""
+        self._executor.shutdown(wait=False)
+        self._configure(
+            app.config["HASHING_POOL_SIZE"], app.config["HASHING_QUEUE_DEPTH"]
+        )
+
+    def run(self, fn: Callable, *args) -> Any:
+        """Runs fn(*args) on the pool and waits for its result. Raises PoolFull if
+        the queue is full."""
+        if not self._slots.acquire(blocking=False):
+            raise PoolFull()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
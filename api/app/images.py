@@ -0,0 +1,114 @@
+import glob
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO
+
+from flask import Flask
+from PIL import Image
+
+# formats of the images accepted, with the extension of their files
+FORMATS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+_EXTENSIONS = {extension: format for format, extension in FORMATS.items()}
+
+
+class ImageStore(object):
+    """Content-addressed store of the item images, on disk. An image is saved once
+    under the SHA-256 of its content, identical uploads therefore share the same
+    files. Its key is the digest followed by the extension of its format, e.g.
+    "3a7b...e1.png".
+
+    Thumbnails fitting in squares of IMAGE_THUMBNAIL_SIZES pixels are made when the
+    image is saved. Files are written under a temporary name then renamed, readers
+    never see a partial file."""
+
+    def __init__(self) -> None:
+        self.root = None
+        self.sizes = []
+        self.max_size = 0
+
+    def init_app(self, app: Flask) -> None:
+        """Configures the store from app.config["IMAGE_STORE"],
+        app.config["IMAGE_THUMBNAIL_SIZES"] and app.config["IMAGE_MAX_SIZE"]"""
+        self.root = app.config["IMAGE_STORE"]
+        self.sizes = app.config["IMAGE_THUMBNAIL_SIZES"]
+        self.max_size = app.config["IMAGE_MAX_SIZE"]
+
+    def path(self, key: str, size: int = None) -> str:
+        """Returns the path of the image with the given key, or of its thumbnail of
+        the given size. Files are spread in directories named after the first two
+        characters of their digest."""
+        digest, extension = key.split(".")
+        name = key if size is None else f"{digest}-{size}.{extension}"
+        return os.path.join(self.root, digest[:2], name)
+
+    def save(self, stream: BinaryIO) -> str:
+        """Stores the image read from stream and its thumbnails, returns its key.
+        Raises ValueError if the stream is not an image in one of FORMATS, or is
+        larger than IMAGE_MAX_SIZE bytes."""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        length = 0
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                while chunk := stream.read(64 * 1024):
+                    length += len(chunk)
+                    if length > self.max_size:
+                        raise ValueError(f"images are limited to {self.max_size} bytes")
+                    digest.update(chunk)
+                    file.write(chunk)
+            key = f"{digest.hexdigest()}.{FORMATS[_image_format(tmp)]}"
+            path = self.path(key)
+            if os.path.exists(path):
+                # the same image is already stored
+                os.remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        for size in self.sizes:
+            self.thumbnail(key, size)
+        return key
+
+    def thumbnail(self, key: str, size: int) -> str:
+        """Returns the path of the thumbnail of the given size of the image with the
+        given key, making it if it does not exist yet (e.g. after a new size was
+        configured)"""
+        path = self.path(key, size)
+        if not os.path.exists(path):
+            with Image.open(self.path(key)) as image:
+                image.thumbnail((size, size))
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as file:
+                        image.save(file, format=_EXTENSIONS[key.split(".")[1]])
+                    os.replace(tmp, path)
+                except BaseException:
+                    os.remove(tmp)
+                    raise
+        return path
+
+    def delete(self, key: str) -> None:
+        """Removes the image with the given key and its thumbnails"""
+        digest, extension = key.split(".")
+        directory = os.path.join(self.root, digest[:2])
+        for path in glob.glob(os.path.join(directory, f"{digest}*.{extension}")):
+            os.remove(path)
+
+
+def _image_format(path: str) -> str:
+    """Returns the format of the image at path. Raises ValueError if it is not an
+    image in one of FORMATS."""
+    try:
+        with Image.open(path) as image:
+            image.verify()
+            format = image.format
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise ValueError("the file is not a valid image")
+    if format not in FORMATS:
+        raise ValueError("images should be in one of " + ", ".join(FORMATS))
+    return format
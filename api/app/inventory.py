@@ -0,0 +1,236 @@
+import csv
+import io
+import json
+from datetime import date
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.encoding import dumps
+from app.models import Item, Role, invalidate_dashboard
+
+# fields of the items imported and exported, in the order of the CSV columns.
+# Dates are in ISO format (2024-01-22), the access control list of a CSV row holds
+# its roles separated by ';'
+FIELDS = [
+    "name",
+    "description",
+    "box_name",
+    "location",
+    "unit",
+    "quantity",
+    "expiry_date",
+    "power",
+    "value",
+    "needs_cleaning",
+    "condition",
+    "remarks",
+    "access_control_list",
+]
+FORMATS = ["csv", "jsonl"]
+MIMETYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+_INTEGERS = ["quantity", "power", "value"]
+
+
+def read_rows(stream: BinaryIO, format: str) -> Iterator[tuple[int, dict]]:
+    """Yields the line number and the fields of each row of an UTF-8 CSV file with a
+    header, or of a JSON Lines file, as they are read from stream. Raises ValueError
+    if the CSV header has unknown columns.
+
+    Reading stops at the first line that is not UTF-8 text, which is yielded last
+    with its UnicodeDecodeError in place of the fields."""
+    if format not in FORMATS:
+        raise ValueError("the format should be one of " + ", ".join(FORMATS))
+    invalid = []
+
+    def decoded():
+        # decoded line by line, the rows before an invalid line can still be imported
+        for number, line in enumerate(stream):
+            try:
+                yield line.decode("utf-8-sig" if number == 0 else "utf-8")
+            except UnicodeDecodeError as e:
+                invalid.append((number + 1, e))
+                return
+
+    text = decoded()
+    if format == "csv":
+        reader = csv.DictReader(text)
+        unknown = set(reader.fieldnames or []) - set(FIELDS) - {"id"}
+        if unknown:
+            raise ValueError("unknown columns: " + ", ".join(sorted(unknown)))
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row
+    yield from invalid
+
+
+def item_values(row: dict) -> dict:
+    """Returns the values of every column of the item described by a row of an
+    import. CSV rows hold strings, empty ones standing for no value. Raises
+    ValueError if the row is not valid."""
+    if not isinstance(row, dict):
+        raise ValueError("the row should be an object")
+    unknown = set(row) - set(FIELDS) - {"id"}
+    if unknown:
+        raise ValueError("unknown fields: " + ", ".join(sorted(unknown)))
+    # every row of a multi-row INSERT sets the same columns
+    values = {f: None for f in FIELDS if f != "access_control_list"}
+    values["acl_mask"] = 0
+    for field in FIELDS:
+        value = row.get(field)
+        if value == "":
+            value = None
+        if value is None:
+            continue
+        if field in _INTEGERS:
+            if isinstance(value, str) and value.lstrip("-").isdigit():
+                value = int(value)
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError(f"{field} should be an integer")
+        elif field == "needs_cleaning":
+            if isinstance(value, str):
+                value = {"true": True, "false": False}.get(value, value)
+            if not isinstance(value, bool):
+                raise ValueError("needs_cleaning should be true or false")
+        elif field == "expiry_date":
+            if not isinstance(value, str):
+                raise ValueError("expiry_date should be an ISO date")
+            try:
+                value = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError("expiry_date should be an ISO date")
+        elif field == "access_control_list":
+            if isinstance(value, str):
+                value = value.split(";")
+            if not isinstance(value, list):
+                raise ValueError("access_control_list should be a list of roles")
+            try:
+                values["acl_mask"] = Role.to_mask([Role(r) for r in value])
+            except ValueError:
+                raise ValueError("access_control_list holds unknown roles")
+            continue
+        else:
+            length = Item.__table__.c[field].type.length
+            if not isinstance(value, str) or len(value) > length:
+                raise ValueError(f"{field} should be a text of {length} characters")
+        values[field] = value
+    if values["name"] is None:
+        raise ValueError("name is required")
+    return values
+
+
+def import_items(rows: Iterable[tuple[int, dict]], chunk_size: int = 500) -> dict:
+    """Creates the items described by the rows of an import (see read_rows), with
+    one multi-row INSERT and one transaction per chunk of chunk_size rows. Rows that
+    are not valid, or which name is already taken, are skipped.
+
+    Returns the report {"imported": n, "errors": [{"line": l, "error": e}, ...]}."""
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise TypeError("Bad arguments type")
+    report = {"imported": 0, "errors": []}
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        valid = {}
+        for line, row in chunk:
+            if isinstance(row, UnicodeDecodeError):
+                report["errors"].append({"line": line, "error": "not UTF-8 text"})
+                continue
+            try:
+                values = item_values(row)
+            except ValueError as e:
+                report["errors"].append({"line": line, "error": str(e)})
+                continue
+            if values["name"] in valid:
+                report["errors"].append(
+                    {"line": line, "error": "the name is repeated in the import"}
+                )
+                continue
+            valid[values["name"]] = (line, values)
+        taken = db.session.query(Item.name).filter(Item.name.in_(list(valid)))
+        for (name,) in taken:
+            line, _ = valid.pop(name)
+            report["errors"].append({"line": line, "error": "the name is taken"})
+        if not valid:
+            continue
+        # the inserted items are not seen by the ORM events
+        invalidate_dashboard(db.session)
+        try:
+            db.session.execute(
+                Item.__table__.insert(), [values for _, values in valid.values()]
+            )
+            db.session.commit()
+        except IntegrityError:
+            # names taken meanwhile, the rows are inserted one by one to find them
+            db.session.rollback()
+            for line, values in list(valid.values()):
+                try:
+                    db.session.execute(Item.__table__.insert(), [values])
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()
+                    valid.pop(values["name"])
+                    report["errors"].append(
+                        {"line": line, "error": "the name is taken"}
+                    )
+        report["imported"] += len(valid)
+    report["errors"].sort(key=lambda e: e["line"])
+    return report
+
+
+def export_items(format: str, chunk_size: int = 500) -> Iterator[bytes]:
+    """Yields every item, by id, as a CSV file with a header or as JSON Lines, a
+    chunk of chunk_size items at a time. Rows are read with a server side cursor on
+    the backends supporting it, the memory used does not depend on the number of
+    items."""
+    if format not in FORMATS:
+        raise ValueError("the format should be one of " + ", ".join(FORMATS))
+    columns = [Item.id] + [
+        Item.acl_mask if f == "access_control_list" else getattr(Item, f)
+        for f in FIELDS
+    ]
+    query = (
+        db.session.query(*columns)
+        .order_by(Item.id)
+        .execution_options(stream_results=True)
+        .yield_per(chunk_size)
+    )
+    fields = ["id"] + FIELDS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if format == "csv":
+        writer.writerow(fields)
+    rows = iter(query)
+    while chunk := list(islice(rows, chunk_size)):
+        for row in chunk:
+            values = dict(zip(fields, row))
+            roles = [r.value for r in Role.from_mask(values["access_control_list"])]
+            values["access_control_list"] = roles
+            if format == "jsonl":
+                buffer.write(dumps(values).decode() + "\n")
+                continue
+            values["access_control_list"] = ";".join(roles)
+            values["expiry_date"] = (
+                values["expiry_date"].isoformat() if values["expiry_date"] else None
+            )
+            if values["needs_cleaning"] is not None:
+                values["needs_cleaning"] = str(values["needs_cleaning"]).lower()
+            writer.writerow(values[f] for f in fields)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # the header of an empty inventory
+        yield buffer.getvalue().encode()
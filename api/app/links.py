@@ -0,0 +1,51 @@
+from flask import current_app, has_request_context, request, url_for
+
+# placeholder id used to build the url templates, never a real id
+_PLACEHOLDER = 9876543210123
+
+
+class LinkBuilder(object):
+    """Builds the same urls as url_for(endpoint, id=id). The url of each endpoint is
+    built once with a placeholder id, then only the id is formatted in it, which is
+    much cheaper than routing through url_for for every element of a collection.
+
+    Urls depend on the context they are built in (absolute outside of requests,
+    relative to the requested host and script root within), a builder should
+    therefore be obtained with link_builder() for the current context."""
+
+    def __init__(self) -> None:
+        self._templates = {}
+
+    def url_for_id(self, endpoint: str, id: int) -> str:
+        template = self._templates.get(endpoint)
+        if template is None:
+            url = url_for(endpoint, id=_PLACEHOLDER)
+            placeholder = str(_PLACEHOLDER)
+            if url.count(placeholder) == 1:
+                template = url.replace("{", "{{").replace("}", "}}")
+                template = template.replace(placeholder, "{}")
+            else:
+                # cannot be templated, url_for is called for every id
+                template = False
+            self._templates[endpoint] = template
+        if template is False or not isinstance(id, int) or isinstance(id, bool):
+            return url_for(endpoint, id=id)
+        return template.format(id)
+
+
+def link_builder() -> LinkBuilder:
+    """Returns the link builder of the current app for the current request, if any"""
+    builders = current_app.extensions.setdefault("link_builders", {})
+    key = request.url_root if has_request_context() else None
+    builder = builders.get(key)
+    if builder is None:
+        if len(builders) >= 64:
+            # the requested host comes from the client, bounds the memory it can use
+            builders.clear()
+        builder = builders[key] = LinkBuilder()
+    return builder
+
+
+def url_for_id(endpoint: str, id: int) -> str:
+    """Returns the same url as url_for(endpoint, id=id), see LinkBuilder"""
+    return link_builder().url_for_id(endpoint, id)
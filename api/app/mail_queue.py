@@ -0,0 +1,138 @@
+import atexit
+import queue
+import smtplib
+from threading import Lock, Thread
+from time import sleep
+
+from flask import Flask
+from flask_mail import Mail, Message
+
+# put in the queue to stop the worker taking it
+_STOP = object()
+
+
+class MailQueue(object):
+    """Bounded queue of mails sent in the background by a few workers. Each worker
+    sends the mails waiting in the queue by batches, over a single SMTP session per
+    batch, instead of connecting to the server for every mail.
+
+    When the queue is full, senders wait for some room (backpressure) up to
+    MAIL_QUEUE_TIMEOUT seconds, after which the mail is dropped. Batches failing to
+    be sent are retried with an exponential backoff. Mails still queued are sent
+    before the process exits, for up to MAIL_QUEUE_DRAIN_TIMEOUT seconds."""
+
+    def __init__(self) -> None:
+        self._app = None
+        self._mail = None
+        self._workers = []
+        self._lock = Lock()
+        self._configure({})
+        atexit.register(lambda: self.shutdown(self.drain_timeout))
+
+    def _configure(self, config: dict) -> None:
+        self.size = config.get("MAIL_QUEUE_SIZE", 256)
+        self.timeout = config.get("MAIL_QUEUE_TIMEOUT", 5)
+        self.drain_timeout = config.get("MAIL_QUEUE_DRAIN_TIMEOUT", 30)
+        self.workers = config.get("MAIL_QUEUE_WORKERS", 1)
+        self.batch_size = config.get("MAIL_QUEUE_BATCH_SIZE", 20)
+        self.retries = config.get("MAIL_RETRIES", 3)
+        self.retry_delay = config.get("MAIL_RETRY_DELAY", 1)
+        self._queue = queue.Queue(maxsize=self.size)
+
+    def init_app(self, app: Flask, mail: Mail) -> None:
+        """Configures the queue from the MAIL_QUEUE_* and MAIL_RETRY* values of
+        app.config. Workers are started with the first mail."""
+        # the workers of the previous app finish its queue on their own
+        self.shutdown(timeout=0)
+        self._app = app
+        self._mail = mail
+        self._configure(app.config)
+
+    def put(self, msg: Message) -> bool:
+        """Queues msg to be sent. Waits for some room if the queue is full, returns
+        False if there is still none after MAIL_QUEUE_TIMEOUT seconds."""
+        with self._lock:
+            if not self._workers:
+                self._start()
+        try:
+            self._queue.put(msg, timeout=self.timeout)
+        except queue.Full:
+            self._app.logger.error(
+                "mail queue full, dropping mail to %s", msg.recipients
+            )
+            return False
+        return True
+
+    def join(self) -> None:
+        """Waits for every queued mail to be handled"""
+        self._queue.join()
+
+    def shutdown(self, timeout: float = None) -> None:
+        """Stops the workers once the mails already queued are handled, waiting for
+        them up to timeout seconds (forever if None)"""
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._queue.put(_STOP)
+        for worker in workers:
+            worker.join(timeout)
+
+    def _start(self) -> None:
+        # the workers keep sending the mails of their app once another is configured
+        args = (self._queue, self._app, self._mail)
+        self._workers = [
+            Thread(target=self._work, args=args, name=f"mail-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _work(self, mail_queue: queue.Queue, app: Flask, mail: Mail) -> None:
+        while True:
+            batch = [mail_queue.get()]
+            # takes the mails already waiting, without waiting for more
+            while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                try:
+                    batch.append(mail_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _STOP
+            messages = batch[:-1] if stop else batch
+            try:
+                if messages:
+                    with app.app_context():
+                        self._send(app, mail, messages)
+            except Exception:
+                app.logger.exception("failed to send %d mails", len(messages))
+            finally:
+                for _ in batch:
+                    mail_queue.task_done()
+            if stop:
+                return
+
+    def _send(self, app: Flask, mail: Mail, messages: list[Message]) -> None:
+        """Sends messages over one SMTP session, retrying from the first message not
+        sent yet with a new session when the connection fails"""
+        pending = list(messages)
+        for attempt in range(self.retries + 1):
+            try:
+                with mail.connect() as connection:
+                    while pending:
+                        try:
+                            connection.send(pending[0])
+                        except (smtplib.SMTPRecipientsRefused, AssertionError) as e:
+                            # retrying would fail again, only this mail is dropped
+                            app.logger.error(
+                                "dropping mail to %s: %s", pending[0].recipients, e
+                            )
+                        pending.pop(0)
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                app.logger.warning(
+                    "sending mails failed (attempt %d): %s", attempt + 1, e
+                )
+                if attempt < self.retries:
+                    sleep(self.retry_delay * 2**attempt)
+        app.logger.error(
+            "dropping %d mails after %d attempts", len(pending), self.retries + 1
+        )
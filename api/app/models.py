@@ -1,15 +1,33 @@
 import base64
+import hashlib
+import json
 import os
+from collections import defaultdict
 from datetime import date, datetime, timedelta
 from enum import Enum
-from typing import Union
+from itertools import accumulate, chain
+from typing import Hashable, Union
 
-from flask import current_app, url_for
-from sqlalchemy.orm import Query
+from flask import Response, current_app, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import (
+    Query,
+    Session,
+    joinedload,
+    make_transient_to_detached,
+    object_session,
+)
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from app import db
+from app import db, dashboard_cache, epoch_cache, power_cache, token_cache
+from app.cache import TTLCache
 from app.email import send_email
+from app.encoding import stream_collection
+from app.links import link_builder
+from app.search import register_search_index, search_query, search_terms
 
 
 class Role(Enum):
@@ -24,10 +42,77 @@ class Role(Enum):
     REUF_ADMIN = "reuf_admin"
     REUF = "reuf"
 
+    @property
+    def bit(self) -> int:
+        """The bit representing this role in a role mask"""
+        return ROLE_BITS[self]
+
+    @staticmethod
+    def to_mask(roles: list["Role"]) -> int:
+        """Returns the role mask holding the given roles"""
+        mask = 0
+        for r in roles:
+            mask |= r.bit
+        return mask
+
+    @staticmethod
+    def from_mask(mask: int) -> list["Role"]:
+        """Returns the roles held in the given role mask, in increasing bit order"""
+        return [r for r, bit in ROLE_BITS.items() if mask & bit]
+
+    @staticmethod
+    def masks_with_one_of(roles: list["Role"]) -> list[int]:
+        """Returns every role mask holding at least one of the given roles. Filtering
+        a mask column with IN on these values can use its index, unlike a bitwise
+        AND."""
+        wanted = Role.to_mask(roles)
+        return [m for m in range(1 << len(ROLE_BITS)) if m & wanted]
+
+    @staticmethod
+    def masks_within(roles: list["Role"]) -> list[int]:
+        """Returns every role mask made only of the given roles, including the
+        empty one"""
+        held = Role.to_mask(roles)
+        return [m for m in range(1 << len(ROLE_BITS)) if m & ~held == 0]
+
+
+# bits are part of the stored data: existing ones must never be changed and new
+# roles must take the next free bit
+ROLE_BITS = {Role.REUF: 1, Role.REUF_ADMIN: 2}
+
 
 class PaginatedAPIMixin(object):
     """Defines a trait for objects from the model. Aims to be inherited by objects to
-    be returned as a jsonified paginated collection."""
+    be returned as a jsonified paginated collection.
+
+    Models inheriting it have an updated_at column, set when a column their to_dict
+    represents changes (see touch_updated_at), from which the validators of the
+    conditional requests are computed.
+
+    - UNREPRESENTED: the columns which changes do not change the representation
+    given by to_dict"""
+
+    UNREPRESENTED = []
+
+    @staticmethod
+    def collection_load_options() -> list:
+        """Returns the loader options to apply when querying a collection of this
+        model, so that to_dict does not lazy load relationships one element at a
+        time. Should be overridden by models which to_dict follows relationships."""
+        return []
+
+    @staticmethod
+    def related_models() -> list:
+        """Returns the models which rows are included in the representation given by
+        to_dict, their changes therefore change the representation of a collection.
+        Should be overridden along with collection_load_options."""
+        return []
+
+    @staticmethod
+    def _with_load_options(query: Query) -> Query:
+        """Applies the collection loader options of the queried model to query"""
+        model = query.column_descriptions[0]["entity"]
+        return query.options(*model.collection_load_options())
 
     @staticmethod
     def to_collection_dict(
@@ -58,6 +143,7 @@ class PaginatedAPIMixin(object):
             and isinstance(endpoint, str)
         ):
             raise TypeError("Bad arguments type")
+        query = PaginatedAPIMixin._with_load_options(query)
         resources = query.paginate(page, per_page, False)
         data = {
             "elements": [element.to_dict(reuf_view) for element in resources.items],
@@ -79,6 +165,224 @@ class PaginatedAPIMixin(object):
         }
         return data
 
+    @staticmethod
+    def to_cursor_collection_dict(
+        query: Query,
+        keys: list,
+        cursor: Union[str, None],
+        per_page: int,
+        endpoint: str,
+        reuf_view: bool = False,
+        descending: bool = False,
+        with_total: bool = False,
+        **kwargs,
+    ) -> dict:
+        """Returns a dict representing a collection of items from the query, paginated
+        with a cursor instead of a page number. Pages are fetched by filtering on the
+        keys of the last element of the previous page, which costs the same whatever
+        the depth of the page when the keys are indexed. No total is counted unless
+        asked.
+
+        Args:
+            - query: the query containing for the items to be paginated. Should query a
+            table inheriting PaginatedAPIMixin, and not be ordered.
+            - keys: the columns defining the order of the items. Their values should
+            uniquely identify an item, ending with the primary key ensures it.
+            - cursor: the opaque cursor of the page to return, None for the first one
+            - per_page: the number of items per page
+            - endpoint: the current route endpoint, where the 'next' link will point to
+            - reuf_view: whether the to_dict called should be made for an admin view
+            or not
+            - descending: whether the items are sorted in decreasing order of the keys
+            - with_total: whether to count the total number of items
+
+        Raises ValueError if the cursor is not valid, or if per_page is not
+        positive."""
+        if not (
+            isinstance(query, Query)
+            and isinstance(keys, list)
+            and len(keys) > 0
+            and (cursor is None or isinstance(cursor, str))
+            and isinstance(per_page, int)
+            and isinstance(reuf_view, bool)
+            and isinstance(descending, bool)
+            and isinstance(with_total, bool)
+            and isinstance(endpoint, str)
+        ):
+            raise TypeError("Bad arguments type")
+        if per_page < 1:
+            raise ValueError("per_page should be positive")
+        page_query = PaginatedAPIMixin._with_load_options(query)
+        if cursor:
+            page_query = page_query.filter(
+                PaginatedAPIMixin._after_cursor(
+                    keys, PaginatedAPIMixin.decode_cursor(cursor, keys), descending
+                )
+            )
+        resources = (
+            page_query.order_by(*[k.desc() if descending else k for k in keys])
+            .limit(per_page + 1)
+            .all()
+        )
+        next_cursor = None
+        if len(resources) > per_page:
+            resources = resources[:per_page]
+            next_cursor = PaginatedAPIMixin.encode_cursor(
+                [getattr(resources[-1], k.key) for k in keys]
+            )
+        data = {
+            "elements": [element.to_dict(reuf_view) for element in resources],
+            "_meta": {
+                "per_page": per_page,
+                "cursor": cursor,
+                "next_cursor": next_cursor,
+            },
+            "_links": {
+                "self": url_for(
+                    endpoint, cursor=cursor or "", per_page=per_page, **kwargs
+                ),
+                "next": url_for(
+                    endpoint, cursor=next_cursor, per_page=per_page, **kwargs
+                )
+                if next_cursor
+                else None,
+            },
+        }
+        if with_total:
+            data["_meta"]["total_elements"] = query.order_by(None).count()
+        return data
+
+    @staticmethod
+    def to_collection_stream(
+        query: Query, reuf_view: bool = False, batch_size: int = 100
+    ) -> Response:
+        """Returns a response streaming every item of the query, see
+        app.encoding.stream_collection. Rows are fetched batch_size at a time, with a
+        server side cursor on the backends supporting it, so that the memory used
+        stays the same whatever the number of items.
+
+        Args:
+            - query: the query containing the items to be streamed. Should query a
+            table inheriting PaginatedAPIMixin.
+            - reuf_view: whether the to_dict called should be made for an admin view
+            or not
+            - batch_size: the number of rows fetched and written at once"""
+        if not (
+            isinstance(query, Query)
+            and isinstance(reuf_view, bool)
+            and isinstance(batch_size, int)
+        ):
+            raise TypeError("Bad arguments type")
+        query = (
+            PaginatedAPIMixin._with_load_options(query)
+            .execution_options(stream_results=True)
+            .yield_per(batch_size)
+        )
+        return stream_collection(
+            (element.to_dict(reuf_view) for element in query), batch_size
+        )
+
+    @staticmethod
+    def encode_cursor(values: list) -> str:
+        """Returns an opaque cursor holding the given key values"""
+        values = [v.isoformat() if isinstance(v, date) else v for v in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str, keys: list) -> list:
+        """Returns the key values held by a cursor, raises ValueError if the cursor
+        was not made for these keys"""
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("Invalid cursor")
+        decoded = []
+        for key, value in zip(keys, values):
+            python_type = key.type.python_type
+            if python_type in (date, datetime) and isinstance(value, str):
+                value = python_type.fromisoformat(value)
+            elif not isinstance(value, python_type):
+                raise ValueError("Invalid cursor")
+            decoded.append(value)
+        return decoded
+
+    @staticmethod
+    def _after_cursor(keys: list, values: list, descending: bool):
+        """Returns the predicate selecting the items strictly after the given key
+        values: (k1 > v1) or (k1 = v1 and k2 > v2) or ..."""
+        clauses = []
+        for i, (key, value) in enumerate(zip(keys, values)):
+            equal = [k == v for k, v in zip(keys[:i], values[:i])]
+            clauses.append(and_(*equal, key < value if descending else key > value))
+        return or_(*clauses)
+
+    @staticmethod
+    def make_etag(*values) -> str:
+        """Returns an ETag identifying the given values"""
+        return hashlib.sha1("|".join(map(str, values)).encode()).hexdigest()
+
+    def last_modified(self) -> Union[datetime, None]:
+        """Returns when the representation of this element was last modified, None
+        if it is unknown. Should be overridden when to_dict includes other rows."""
+        return self.updated_at
+
+    def validators(self, reuf_view: bool = False) -> tuple[str, Union[datetime, None]]:
+        """Returns the ETag and the last modification date of the representation of
+        this element given by to_dict(reuf_view)"""
+        if not isinstance(reuf_view, bool):
+            raise TypeError("Bad arguments type")
+        modified = self.last_modified()
+        etag = PaginatedAPIMixin.make_etag(
+            type(self).__name__, self.id, modified, reuf_view
+        )
+        return etag, modified
+
+    @staticmethod
+    def collection_etag(query: Query, *args) -> str:
+        """Returns an ETag for the elements of the query as represented by to_dict,
+        from a single aggregate query: their number and last modification date, and
+        the last modification date of the related models. An element deleted, added
+        or modified changes one of them. The ETag does not depend on the order or the
+        page of the elements, it is meant to be computed on every element a
+        collection endpoint can return.
+
+        The aggregate reads every element of the query, like counting them: it
+        costs a scan of the collection (or of its updated_at index). Endpoints that
+        do not count their elements, with cursor pages or streams, should only
+        compute it for conditional requests, see
+        app.api.conditional.collection_validator.
+
+        Args:
+            - query: the query containing the elements of the collection. Should query
+            a table inheriting PaginatedAPIMixin.
+            - args: the other values the representation depends on, e.g. the view"""
+        if not isinstance(query, Query):
+            raise TypeError("Bad arguments type")
+        model = query.column_descriptions[0]["entity"]
+        related = [
+            select(func.max(m.updated_at)).scalar_subquery()
+            for m in model.related_models()
+        ]
+        values = (
+            query.order_by(None)
+            .with_entities(func.count(model.id), func.max(model.updated_at), *related)
+            .one()
+        )
+        return PaginatedAPIMixin.make_etag(model.__name__, *values, *args)
+
+
+@db.event.listens_for(PaginatedAPIMixin, "before_update", propagate=True)
+def touch_updated_at(mapper, connection, target: PaginatedAPIMixin) -> None:
+    """Sets the updated_at column of an element when one of its represented columns
+    changes. Bulk updates are not seen, they should set updated_at themselves."""
+    state = db.inspect(target)
+    ignored = set(target.UNREPRESENTED) | {"updated_at"}
+    if any(
+        state.attrs[column.key].history.has_changes()
+        for column in mapper.column_attrs
+        if column.key not in ignored
+    ):
+        target.updated_at = datetime.utcnow()
+
 
 class User(PaginatedAPIMixin, db.Model):
     """Represents a user of the system. This is the actor that can borrow items.
@@ -89,9 +393,15 @@ class User(PaginatedAPIMixin, db.Model):
     - password_hash: the salted hash of their password
     - sciper: their sciper number
     - unit: description of their service at EPFL (student, collaborator, ...)
-    - roles: Python list with the roles held by this user. See Roles class
+    - role_mask: bit mask of the roles held by this user. See Role class
+    - roles: Python list with the roles held by this user, backed by role_mask
     - token: this user's valid token
     - token_expiration: the expiration date time for the current token
+    - token_epoch: incremented on each revocation, signed tokens issued in a previous
+    epoch are no longer valid
+    - token_global_epoch: the global token epoch (see Setting) when the current token
+    was issued
+    - updated_at: when the information shown by to_dict last changed
 
     - borrowings_they_made: relationship query containing the borrowing made
     by this user"""
@@ -102,9 +412,24 @@ class User(PaginatedAPIMixin, db.Model):
     password_hash = db.Column(db.String(102))
     sciper = db.Column(db.Integer, unique=True)
     unit = db.Column(db.String(16))
-    roles = db.Column(db.PickleType, default=[], index=True)
+    role_mask = db.Column(
+        db.Integer, default=0, nullable=False, index=True, server_default="0"
+    )
     token = db.Column(db.String(32), index=True, unique=True)
     token_expiration = db.Column(db.DateTime)
+    token_epoch = db.Column(db.Integer, default=0, nullable=False, server_default="0")
+    token_global_epoch = db.Column(
+        db.Integer, default=0, nullable=False, server_default="0"
+    )
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+    UNREPRESENTED = [
+        "password_hash",
+        "token",
+        "token_expiration",
+        "token_epoch",
+        "token_global_epoch",
+    ]
 
     borrowings_they_made = db.relationship(
         "Borrowing",
@@ -119,7 +444,9 @@ class User(PaginatedAPIMixin, db.Model):
         # https://werkzeug.palletsprojects.com/en/2.0.x/utils/#module-werkzeug.security
         if not isinstance(password, str):
             raise TypeError("Bad argument type")
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(
+            password, method=current_app.config["PASSWORD_HASH_METHOD"]
+        )
 
     def check_password(self, password: str) -> bool:
         """Checks whether the given password matches the one stored in the database"""
@@ -127,6 +454,26 @@ class User(PaginatedAPIMixin, db.Model):
             self.password_hash, password
         )
 
+    def password_needs_rehash(self) -> bool:
+        """Returns whether the password hash was made with another method than the
+        configured one"""
+        method = self.password_hash.split("$", 1)[0] if self.password_hash else None
+        return method != current_app.config["PASSWORD_HASH_METHOD"]
+
+    @property
+    def roles(self) -> list[Role]:
+        return Role.from_mask(self.role_mask or 0)
+
+    @roles.setter
+    def roles(self, roles: list[Role]) -> None:
+        self.role_mask = Role.to_mask(roles)
+
+    @staticmethod
+    def with_one_of_roles(roles: list[Role]) -> Query:
+        """Returns a query for the users holding at least one of the given roles,
+        answered from the role_mask index"""
+        return User.query.filter(User.role_mask.in_(Role.masks_with_one_of(roles)))
+
     def get_roles(self) -> list[Role]:
         """Returns the Roles for this user. Method required by HTTPauth for RBAC"""
         return self.roles
@@ -138,11 +485,7 @@ class User(PaginatedAPIMixin, db.Model):
         ) or len(roles) > len(Role):
             # checking lengths prevents having undesired long for loop
             raise TypeError("Bad arguments type")
-        if self.roles:
-            for r in roles:
-                if r in self.roles:
-                    return True
-        return False
+        return (self.role_mask or 0) & Role.to_mask(roles) != 0
 
     def from_dict(self, data: dict, new_user: bool = False) -> None:
         """Sets attributes for a user from a dict object. Fields to fill are explicitly
@@ -164,21 +507,46 @@ class User(PaginatedAPIMixin, db.Model):
             )
             # Values should have been sanitized beforehand for not raising ValueError
             self.roles = [Role(r) for r in data["roles"]]
+            # signed tokens carry the roles, they must be reissued
+            self.token_epoch = (self.token_epoch or 0) + 1
         if new_user and "password" in data:
             self.set_password(data["password"])
 
     def get_token(self, expires_in: int = 3600) -> str:
         """Retrieves a token for this user. If the current token does not exist or
-        expired, sets a new one. Tokens are by default valid for 1 hour."""
+        expired, sets a new one. Tokens are by default valid for 1 hour.
+
+        With app.config["TOKEN_SIGNED"], a new self-contained signed token is
+        returned instead and nothing is stored."""
         if not isinstance(expires_in, int):
             raise TypeError("Bad arguments type")
-        with current_app.app_context():
-            # we need the app context to access the configuration
-            expires_in *= current_app.config["TOKEN_LIFETIME"]
+        # no new app context is pushed here: popping it would remove the session
+        # this user is attached to
+        expires_in *= current_app.config["TOKEN_LIFETIME"]
+        signed = current_app.config["TOKEN_SIGNED"]
         now = datetime.utcnow()
+        # read from the database, the cached value may be outdated
+        global_epoch = Setting.get_value(Setting.TOKEN_EPOCH)
+        if signed:
+            return User._token_serializer().dumps(
+                {
+                    "id": self.id,
+                    "roles": [r.value for r in self.roles],
+                    "epoch": self.token_epoch or 0,
+                    "global_epoch": global_epoch,
+                    "exp": (now + timedelta(seconds=expires_in)).timestamp(),
+                }
+            )
         # we check if the token expires in more than 60 seconds
-        if self.token and self.token_expiration > now + timedelta(seconds=60):
+        if (
+            self.token
+            and self.token_expiration > now + timedelta(seconds=60)
+            and (self.token_global_epoch or 0) >= global_epoch
+        ):
             return self.token
+        if self.token:
+            # the previous token is being rotated
+            _invalidate(db.session, token_cache, self.token)
         # This test is not necessary. There is a 2^192 bits token but we still make
         # explicitly sure that there is not collision as token should uniquely
         # identify a user
@@ -188,29 +556,125 @@ class User(PaginatedAPIMixin, db.Model):
         # we explicitly make a string copy that way
         self.token = "" + test_token
         self.token_expiration = now + timedelta(seconds=expires_in)
+        self.token_global_epoch = global_epoch
         db.session.add(self)
         return self.token
 
     def revoke_token(self) -> None:
-        """Revokes the token of this user"""
+        """Revokes the token of this user, stored or signed"""
+        if self.token:
+            _invalidate(db.session, token_cache, self.token)
+        _invalidate(db.session, epoch_cache, self.id)
         self.token_expiration = datetime.utcnow() - timedelta(seconds=1)
+        self.token_epoch = (self.token_epoch or 0) + 1
+
+    @staticmethod
+    def revoke_all_tokens() -> None:
+        """Revokes the tokens of every user at once by incrementing the global token
+        epoch. Costs a single statement whatever the number of users."""
+        Setting.increment(Setting.TOKEN_EPOCH)
+        _invalidate(db.session, epoch_cache, Setting.TOKEN_EPOCH)
+        _invalidate(db.session, token_cache)
+
+    @staticmethod
+    def _global_token_epoch() -> int:
+        """Returns the global token epoch, cached in memory (see
+        Config.TOKEN_CACHE_TTL). Tokens issued in a previous epoch are revoked."""
+        epoch = epoch_cache.get(Setting.TOKEN_EPOCH)
+        if epoch is None:
+            epoch = Setting.get_value(Setting.TOKEN_EPOCH)
+            epoch_cache.set(Setting.TOKEN_EPOCH, epoch)
+        return epoch
 
     @staticmethod
     def check_token(token: str) -> Union["User", None]:
         """Verifies if the given token corresponds to any user. If yes, returns the
-        user it actually corresponds to"""
+        user it actually corresponds to. Verified tokens are cached in memory, see
+        Config.TOKEN_CACHE_SIZE"""
         if not isinstance(token, str):
             raise TypeError("Bad arguments type")
+        if current_app.config["TOKEN_SIGNED"]:
+            return User._check_signed_token(token)
+        now = datetime.utcnow()
+        global_epoch = User._global_token_epoch()
+        snapshot = token_cache.get(token)
+        if snapshot is not None:
+            if (
+                snapshot["token_expiration"] < now
+                or snapshot["token_global_epoch"] < global_epoch
+            ):
+                token_cache.invalidate(token)
+                return None
+            return User._from_snapshot(snapshot)
         # we explicitly made sure in token generation that those
         # uniquely identify a user
         user = User.query.filter_by(token=token).first()
-        if user is None or user.token_expiration < datetime.utcnow():
+        if (
+            user is None
+            or user.token_expiration < now
+            or user.token_global_epoch < global_epoch
+        ):
             return None
+        token_cache.set(
+            token,
+            user._snapshot(),
+            ttl=(user.token_expiration - now).total_seconds(),
+        )
         return user
 
+    @staticmethod
+    def _token_serializer() -> URLSafeSerializer:
+        return URLSafeSerializer(current_app.config["SECRET_KEY"], salt="token")
+
+    @staticmethod
+    def _check_signed_token(token: str) -> Union["User", None]:
+        """Verifies a signed token. The only values read from the database are the
+        token epochs of the user and the global one, and they are cached in memory
+        (see Config.TOKEN_CACHE_TTL)"""
+        try:
+            payload = User._token_serializer().loads(token)
+        except BadSignature:
+            return None
+        if payload["exp"] < datetime.utcnow().timestamp():
+            return None
+        if payload["global_epoch"] < User._global_token_epoch():
+            return None
+        epoch = epoch_cache.get(payload["id"])
+        if epoch is None:
+            row = db.session.query(User.token_epoch).filter_by(id=payload["id"]).first()
+            if row is None:
+                # the user has been deleted
+                return None
+            epoch = row.token_epoch
+            epoch_cache.set(payload["id"], epoch)
+        # a cached epoch can only be older than the actual one, tokens from a later
+        # epoch are therefore valid
+        if payload["epoch"] < epoch:
+            return None
+        return User._from_snapshot(
+            {
+                "id": payload["id"],
+                "role_mask": Role.to_mask([Role(r) for r in payload["roles"]]),
+                "token_epoch": epoch,
+            }
+        )
+
+    def _snapshot(self) -> dict:
+        """Returns a copy of the column values of this user, to be cached"""
+        return {c.key: getattr(self, c.key) for c in User.__table__.columns}
+
+    @staticmethod
+    def _from_snapshot(snapshot: dict) -> "User":
+        """Attaches to the current session a user built from a snapshot, without
+        emitting any query. Columns missing from the snapshot are loaded on access."""
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
     def get_borrowed_items(self) -> Query:
         """Returns a query storing the items borrowed by this user, in decreasing
-        order of the borrowings timestamps"""
+        order of the borrowings timestamps. The borrowings are read in order from the
+        (user_id, timestamp) index."""
         return (
             db.session.query(Item)
             .join(Borrowing, Item.id == Borrowing.item_id)
@@ -249,6 +713,10 @@ class User(PaginatedAPIMixin, db.Model):
                 "Error on date: should have return date later than borrow date and"
                 + "borrow date not before today"
             )
+        if item.quantity is not None and borrowed_quantity > item.available_quantity(
+            borrowing_date, return_date
+        ):
+            raise ValueError("Not enough units of the item available on these dates")
         b = Borrowing(
             user_id=self.id,
             item_id=item.id,
@@ -260,6 +728,79 @@ class User(PaginatedAPIMixin, db.Model):
         )
         return b
 
+    def checkout(
+        self,
+        quantities: dict[int, int],
+        borrowing_date: date,
+        return_date: date,
+        borrowing_description: str = "",
+        remarks: str = "",
+    ) -> tuple[list[dict], dict[int, int]]:
+        """Checks a borrowing of several items at once for this user, mapping the ids
+        of the items to the quantities borrowed, with the same checks as borrow.
+
+        The items and their availability are fetched with two queries, whatever the
+        number of items. Returns the rows of the borrowings, ready to be inserted at
+        once in the borrowing table, and the versions of the items read before
+        checking their availability, to be claimed with Item.claim_versions."""
+        if not (
+            isinstance(quantities, dict)
+            and all(
+                [
+                    isinstance(k, int) and isinstance(v, int)
+                    for k, v in quantities.items()
+                ]
+            )
+            and isinstance(borrowing_date, date)
+            and isinstance(return_date, date)
+            and isinstance(borrowing_description, str)
+            and isinstance(remarks, str)
+        ):
+            raise TypeError("Bad argument type")
+        if not quantities:
+            raise ValueError("Cannot borrow no item")
+        if min(quantities.values()) < 1:
+            raise ValueError("Cannot borrow less that one unit of an item")
+        if borrowing_date > return_date or borrowing_date < date.today():
+            raise ValueError(
+                "Error on date: should have return date later than borrow date and"
+                + "borrow date not before today"
+            )
+        ids = list(quantities)
+        items = Item.accessible_query(self.roles).filter(Item.id.in_(ids)).all()
+        if len(items) != len(ids):
+            missing = set(ids) - set(item.id for item in items)
+            raise ValueError(f"Items not in database: {sorted(missing)}")
+        versions = {item.id: item.version for item in items}
+        peaks = Item.peak_usages(ids, borrowing_date, return_date)
+        unavailable = [
+            item.id
+            for item in items
+            if item.quantity is not None
+            and quantities[item.id] > item.quantity - peaks.get(item.id, 0)
+        ]
+        if unavailable:
+            raise ValueError(
+                "Not enough units of the items available on these dates: "
+                + f"{sorted(unavailable)}"
+            )
+        # the borrowings of a checkout share their timestamp
+        timestamp = datetime.utcnow()
+        rows = [
+            {
+                "user_id": self.id,
+                "item_id": item_id,
+                "timestamp": timestamp,
+                "borrowing_date": borrowing_date,
+                "return_date": return_date,
+                "borrowed_quantity": quantity,
+                "borrowing_description": borrowing_description,
+                "remarks": remarks,
+            }
+            for item_id, quantity in quantities.items()
+        ]
+        return rows, versions
+
     def __repr__(self) -> str:
         return "<User {} (id: {})>".format(self.username, self.id)
 
@@ -267,14 +808,15 @@ class User(PaginatedAPIMixin, db.Model):
         """Converts the value to a dictionary ready to be jsonified. We should
         make sure to set the correct view depending on the user status
         with 'reuf view'."""
+        links = link_builder()
         data = {
             "id": self.id,
             "username": self.username,
             "_links": {
-                "self": url_for("api.get_user", id=self.id),
-                "borrowings": url_for("api.get_borrowings_for_user", id=self.id),
-                "update": url_for("api.update_user", id=self.id),
-                "revoke_token": url_for("api.revoke_token", id=self.id),
+                "self": links.url_for_id("api.get_user", self.id),
+                "borrowings": links.url_for_id("api.get_borrowings_for_user", self.id),
+                "update": links.url_for_id("api.update_user", self.id),
+                "revoke_token": links.url_for_id("api.revoke_token", self.id),
             },
         }
         if reuf_view:
@@ -286,10 +828,54 @@ class User(PaginatedAPIMixin, db.Model):
                     "roles": [r.value for r in self.roles],
                 }
             )
-            data["_links"].update({"delete": url_for("api.delete_user", id=self.id)})
+            data["_links"].update(
+                {"delete": links.url_for_id("api.delete_user", self.id)}
+            )
         return data
 
 
+@db.event.listens_for(User, "after_update")
+@db.event.listens_for(User, "after_delete")
+def invalidate_cached_token(mapper, connection, target: User) -> None:
+    """Drops the cached copy of a user as soon as it is modified or deleted"""
+    session = object_session(target)
+    if target.token:
+        _invalidate(session, token_cache, target.token)
+    _invalidate(session, epoch_cache, target.id)
+
+
+class Setting(db.Model):
+    """Application wide integer values, stored as one row per setting.
+
+    - name: the name of the setting
+    - value: its value
+
+    - TOKEN_EPOCH: incremented when every token is revoked at once"""
+
+    TOKEN_EPOCH = "token_epoch"
+
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def get_value(name: str, default: int = 0) -> int:
+        """Returns the value of the given setting, or default if it is not set"""
+        row = db.session.query(Setting.value).filter_by(name=name).first()
+        return default if row is None else row.value
+
+    @staticmethod
+    def increment(name: str) -> None:
+        """Increments the value of the given setting in a single statement"""
+        updated = Setting.query.filter_by(name=name).update(
+            {Setting.value: Setting.value + 1}, synchronize_session=False
+        )
+        if updated == 0:
+            db.session.add(Setting(name=name, value=1))
+
+    def __repr__(self) -> str:
+        return "<Setting {}: {}>".format(self.name, self.value)
+
+
 class Item(PaginatedAPIMixin, db.Model):
     """Represents an item of the database. These are to be borrowed by users eventually.
 
@@ -306,7 +892,18 @@ class Item(PaginatedAPIMixin, db.Model):
     - needs_cleaning: whether this item has to be cleaned or not
     - condition: condition of this item (good, damaged. ...)
     - remarks: any extra remarks on this item
-    - access_control_list: the set of roles that are required to view this item
+    - acl_mask: bit mask of the roles that are required to view this item
+    - access_control_list: the set of roles that are required to view this item,
+    backed by acl_mask
+    - version: incremented by every new borrowing of this item, so that concurrent
+    borrowings can detect each other (see claim_versions)
+    - image_key: the key of the image of this item in the image store, if any (see
+    app.images.ImageStore)
+    - updated_at: when the information shown by to_dict last changed
+
+    - FACETS: the columns items can be filtered on by value, and counted by value
+    (see filter_query and facet_counts)
+    - REUF_FACETS: the facets only shown to reufs
 
     - borrowings_it_s_in: relationship query containing the borrowing in
     which this item is present"""
@@ -324,7 +921,28 @@ class Item(PaginatedAPIMixin, db.Model):
     needs_cleaning = db.Column(db.Boolean)
     condition = db.Column(db.String(16))
     remarks = db.Column(db.String(128))
-    access_control_list = db.Column(db.PickleType, default=[], index=True)
+    acl_mask = db.Column(
+        db.Integer, default=0, nullable=False, index=True, server_default="0"
+    )
+    version = db.Column(db.Integer, default=0, nullable=False, server_default="0")
+    image_key = db.Column(db.String(72), index=True)
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+    __table_args__ = (
+        # answers the filters on the location of items and their box in it, and
+        # counts them per location or box
+        db.Index("ix_item_location_box_name", "location", "box_name"),
+        # answers the filters on the state of items, e.g. the damaged ones that need
+        # cleaning
+        db.Index("ix_item_condition_needs_cleaning", "condition", "needs_cleaning"),
+        db.Index("ix_item_box_name", "box_name"),
+        db.Index("ix_item_expiry_date", "expiry_date"),
+    )
+
+    # the image has validators of its own, the version counts borrowings
+    UNREPRESENTED = ["image_key", "version"]
+    FACETS = ["location", "box_name", "condition", "needs_cleaning"]
+    REUF_FACETS = ["location", "box_name", "needs_cleaning"]
 
     borrowings_it_s_in = db.relationship(
         "Borrowing",
@@ -335,14 +953,255 @@ class Item(PaginatedAPIMixin, db.Model):
 
     def get_borrowers(self) -> Query:
         """Returns a query for users that have a borrowing with this item,
-        in decreasing order of the borrowing timestamp"""
+        in decreasing order of the borrowing timestamp. The borrowings are read in
+        order from the (item_id, timestamp) index."""
         return (
             db.session.query(User)
             .join(Borrowing, User.id == Borrowing.user_id)
-            .filter(Borrowing.user_id == self.id)
+            .filter(Borrowing.item_id == self.id)
             .order_by(Borrowing.timestamp.desc())
         )
 
+    @property
+    def access_control_list(self) -> list[Role]:
+        return Role.from_mask(self.acl_mask or 0)
+
+    @access_control_list.setter
+    def access_control_list(self, roles: list[Role]) -> None:
+        self.acl_mask = Role.to_mask(roles)
+
+    @staticmethod
+    def accessible_query(roles: list[Role], query: Query = None) -> Query:
+        """Restricts the given query (by default all the items) to the items that
+        can be accessed by a user having the given roles. The predicate is evaluated
+        by the database from the acl_mask index, so that paginating the result gives
+        exact pages and totals."""
+        if not (
+            isinstance(roles, list) and all([isinstance(r, Role) for r in roles])
+        ) or len(roles) > len(Role):
+            raise TypeError("Bad arguments type")
+        if query is None:
+            query = Item.query
+        return query.filter(Item.acl_mask.in_(Role.masks_within(roles)))
+
+    @staticmethod
+    def filter_query(query: Query, filters: dict, exclude: str = None) -> Query:
+        """Restricts the given query of items to the ones matching every filter.
+        Filters map facets (see FACETS) to the list of accepted values, and
+        'expires_after' and 'expires_before' to the first and last expiry dates
+        accepted. The filter of the exclude facet is ignored."""
+        if not (
+            isinstance(filters, dict)
+            and all(
+                [
+                    (f in Item.FACETS and isinstance(v, list))
+                    or (
+                        f in ["expires_after", "expires_before"] and isinstance(v, date)
+                    )
+                    for f, v in filters.items()
+                ]
+            )
+        ):
+            raise TypeError("Bad arguments type")
+        for name, value in filters.items():
+            if name == exclude:
+                continue
+            if name == "expires_after":
+                query = query.filter(Item.expiry_date >= value)
+            elif name == "expires_before":
+                query = query.filter(Item.expiry_date <= value)
+            else:
+                query = query.filter(getattr(Item, name).in_(value))
+        return query
+
+    @staticmethod
+    def facet_counts(
+        query: Query, filters: dict, facets: list[str]
+    ) -> dict[str, list[dict]]:
+        """Counts the items of the given query matching the filters (see
+        filter_query) for each value of the given facets, by decreasing count.
+
+        The counts of a facet ignore its own filter, they are the number of items that
+        selecting each value would add. Every facet is counted by a single statement,
+        a union of one grouped aggregate per facet."""
+        if not (isinstance(facets, list) and all([f in Item.FACETS for f in facets])):
+            raise TypeError("Bad arguments type")
+        counts = {facet: [] for facet in facets}
+        if not facets:
+            return counts
+        grouped = []
+        for facet in facets:
+            value = getattr(Item, facet)
+            if facet == "needs_cleaning":
+                # the values of every facet must have the same type in the union.
+                # Literals keep the grouped expression identical to the selected one.
+                value = db.case(
+                    (value.is_(True), db.literal_column("'true'")),
+                    (value.is_(False), db.literal_column("'false'")),
+                )
+            grouped.append(
+                Item.filter_query(query, filters, exclude=facet)
+                .with_entities(
+                    db.literal(facet).label("facet"),
+                    value.label("value"),
+                    db.func.count(Item.id).label("count"),
+                )
+                .group_by(value)
+            )
+        for facet, value, count in grouped[0].union_all(*grouped[1:]):
+            if facet == "needs_cleaning" and value is not None:
+                value = value == "true"
+            counts[facet].append({"value": value, "count": count})
+        for values in counts.values():
+            values.sort(key=lambda v: (-v["count"], str(v["value"])))
+        return counts
+
+    @staticmethod
+    def peak_usages(
+        item_ids: Union[list[int], None], start: date, end: date
+    ) -> dict[int, int]:
+        """Returns, for each of the given items (every item if None), the maximum
+        number of units in use on a single day between start and end included.
+        Items without borrowings in this window are absent from the result.
+
+        Only the borrowings overlapping the window are fetched, in one query answered
+        from the (item_id, return_date) index, or the return_date one for every item.
+        A sweep line over their start and end dates then gives the peak of each
+        item."""
+        if not (
+            (item_ids is None or isinstance(item_ids, list))
+            and isinstance(start, date)
+            and isinstance(end, date)
+        ):
+            raise TypeError("Bad arguments type")
+        query = db.session.query(
+            Borrowing.item_id,
+            Borrowing.borrowing_date,
+            Borrowing.return_date,
+            Borrowing.borrowed_quantity,
+        ).filter(Borrowing.return_date >= start, Borrowing.borrowing_date <= end)
+        if item_ids is not None:
+            query = query.filter(Borrowing.item_id.in_(item_ids))
+        events = defaultdict(list)
+        for item_id, borrowing_date, return_date, quantity in query:
+            # borrowings last from their borrowing to their return date included
+            events[item_id].append((max(borrowing_date, start), quantity or 0))
+            events[item_id].append((return_date + timedelta(days=1), -(quantity or 0)))
+        peaks = {}
+        for item_id, item_events in events.items():
+            # on the same day, returns (negative) are counted before new borrowings
+            item_events.sort()
+            in_use = peak = 0
+            for _, delta in item_events:
+                in_use += delta
+                peak = max(peak, in_use)
+            peaks[item_id] = peak
+        return peaks
+
+    @staticmethod
+    def daily_usages(
+        item_ids: Union[list[int], None], start: date, end: date
+    ) -> dict[int, list[int]]:
+        """Returns, for each of the given items (every item if None), the number of
+        units in use on each day from start to end included. Items without
+        borrowings in this window are absent from the result.
+
+        The borrowings overlapping the window are fetched in one query, as for
+        peak_usages. Each one adds its quantity to a difference array of the item on
+        its first day in the window and removes it the day after its return, a
+        cumulative sum of the array then gives the units in use each day."""
+        if not (
+            (item_ids is None or isinstance(item_ids, list))
+            and isinstance(start, date)
+            and isinstance(end, date)
+        ):
+            raise TypeError("Bad arguments type")
+        query = db.session.query(
+            Borrowing.item_id,
+            Borrowing.borrowing_date,
+            Borrowing.return_date,
+            Borrowing.borrowed_quantity,
+        ).filter(Borrowing.return_date >= start, Borrowing.borrowing_date <= end)
+        if item_ids is not None:
+            query = query.filter(Borrowing.item_id.in_(item_ids))
+        days = (end - start).days + 1
+        # one more day, where borrowings returned on the last day are removed
+        differences = defaultdict(lambda: [0] * (days + 1))
+        for item_id, borrowing_date, return_date, quantity in query:
+            difference = differences[item_id]
+            difference[max((borrowing_date - start).days, 0)] += quantity or 0
+            difference[min((return_date - start).days + 1, days)] -= quantity or 0
+        return {
+            item_id: list(accumulate(difference[:days]))
+            for item_id, difference in differences.items()
+        }
+
+    @staticmethod
+    def claim_versions(versions: dict[int, int]) -> bool:
+        """Increments the version of the given items, mapping their id to the version
+        read before checking their availability, in the current transaction. Returns
+        False if the version of one of them changed meanwhile, in which case the
+        transaction has to be rolled back and the availability checked again.
+
+        The compare and swap is a single conditional UPDATE, which the database
+        serializes with the other writers of the rows: two borrowings of an item read
+        at the same version cannot both be committed."""
+        if not (
+            isinstance(versions, dict)
+            and all(
+                [isinstance(k, int) and isinstance(v, int) for k, v in versions.items()]
+            )
+        ):
+            raise TypeError("Bad arguments type")
+        if not versions:
+            return True
+        claimed = Item.query.filter(
+            db.or_(
+                *[
+                    db.and_(Item.id == item_id, Item.version == version)
+                    for item_id, version in versions.items()
+                ]
+            )
+        ).update({Item.version: Item.version + 1}, synchronize_session=False)
+        return claimed == len(versions)
+
+    @staticmethod
+    def search(q: str, roles: list[Role]) -> Query:
+        """Returns a query for the items that can be accessed by a user having the
+        given roles and contain every word of q in their name, description, box name
+        or remarks, as a word or a prefix, by decreasing relevance. Matches in the
+        name weigh the most. Raises ValueError if q holds no word."""
+        terms = search_terms(q)
+        if not terms:
+            raise ValueError("Nothing to search")
+        return search_query(Item.accessible_query(roles), Item.__table__, terms)
+
+    @staticmethod
+    def image_in_use(key: str) -> bool:
+        """Returns whether an item still has the image with the given key. Identical
+        images share their key, see app.images.ImageStore."""
+        if not isinstance(key, str):
+            raise TypeError("Bad arguments type")
+        return db.session.query(Item.query.filter_by(image_key=key).exists()).scalar()
+
+    def available_quantity(self, start: date, end: date) -> int:
+        """Returns the number of units of this item that can be borrowed for the whole
+        window between start and end included"""
+        peak = Item.peak_usages([self.id], start, end).get(self.id, 0)
+        return (self.quantity or 0) - peak
+
+    def availability_dict(self, start: date, end: date, in_use: int) -> dict:
+        """Converts the availability of this item over a window to a dictionary ready
+        to be jsonified"""
+        return {
+            "id": self.id,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "quantity": self.quantity,
+            "in_use": in_use,
+            "available": (self.quantity or 0) - in_use,
+        }
+
     def accessible_by_roles(self, roles: list[Role]) -> bool:
         """Returns whether this item can be accessed by a user having
         the given roles."""
@@ -351,13 +1210,8 @@ class Item(PaginatedAPIMixin, db.Model):
         ) or len(roles) > len(Role):
             # checking lengths prevents having undesired long for loop
             raise TypeError("Bad arguments type")
-        if not self.access_control_list or len(self.access_control_list) == 0:
-            # no role is required to access this item
-            return True
-        for required_role in self.access_control_list:
-            if required_role not in roles:
-                return False
-        return True
+        # every required role should be held, no role required gives access to all
+        return (self.acl_mask or 0) & ~Role.to_mask(roles) == 0
 
     def from_dict(
         self,
@@ -397,6 +1251,7 @@ class Item(PaginatedAPIMixin, db.Model):
         return "<Item {} (id: {})>".format(self.name, self.id)
 
     def to_dict(self, reuf_view: bool = False) -> dict:
+        links = link_builder()
         data = {
             "id": self.id,
             "name": self.name,
@@ -407,10 +1262,9 @@ class Item(PaginatedAPIMixin, db.Model):
             "condition": self.condition,
             "remarks": self.remarks,
             "_links": {
-                "self": url_for("api.get_item", id=self.id),
-                "borrowings": url_for("api.get_borrowings_with_item", id=self.id),
-                "image": url_for("api.get_item_image", id=self.id),
-                "borrow": url_for("api.borrow_item", id=self.id),
+                "self": links.url_for_id("api.get_item", self.id),
+                "borrowings": links.url_for_id("api.get_borrowings_with_item", self.id),
+                "image": links.url_for_id("api.get_item_image", self.id),
             },
         }
         if reuf_view:
@@ -425,25 +1279,79 @@ class Item(PaginatedAPIMixin, db.Model):
             )
             data["_links"].update(
                 {
-                    "update": url_for("api.edit_item", id=self.id),
-                    "update_item": url_for("api.modify_item", id=self.id),
-                    "update_item_image": url_for("api.modify_item_image", id=self.id),
-                    "delete_item": url_for("api.delete_item", id=self.id),
+                    "update_item": links.url_for_id("api.update_item", self.id),
+                    "update_item_image": links.url_for_id(
+                        "api.update_item_image", self.id
+                    ),
+                    "delete_item": links.url_for_id("api.delete_item", self.id),
                 }
             )
         return data
 
 
+register_search_index(Item.__table__)
+
+
 class Borrowing(PaginatedAPIMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     item_id = db.Column(db.Integer, db.ForeignKey("item.id"))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     borrowing_date = db.Column(db.Date)
-    return_date = db.Column(db.Date)
+    return_date = db.Column(db.Date, index=True)
     borrowed_quantity = db.Column(db.Integer)
     borrowing_description = db.Column(db.String(64))
     remarks = db.Column(db.String(128))
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    # when the borrower was reminded that the borrowing is overdue, see
+    # app.reminders
+    reminded_on = db.Column(db.Date)
+
+    __table_args__ = (
+        # answers the borrowings of an item overlapping a window, see
+        # Item.peak_usages
+        db.Index("ix_borrowing_item_id_return_date", "item_id", "return_date"),
+        # answer the history of a user or an item, most recent first, in the order
+        # of the index
+        db.Index("ix_borrowing_user_id_timestamp", "user_id", "timestamp"),
+        db.Index("ix_borrowing_item_id_timestamp", "item_id", "timestamp"),
+    )
+
+    UNREPRESENTED = ["reminded_on"]
+
+    @staticmethod
+    def collection_load_options() -> list:
+        # to_dict includes the borrower and the borrowed item
+        return [joinedload(Borrowing.borrower), joinedload(Borrowing.borrowed_item)]
+
+    @staticmethod
+    def related_models() -> list:
+        return [User, Item]
+
+    @staticmethod
+    def insert_rows(rows: list[dict]) -> None:
+        """Inserts borrowings given as dicts of column values with a single
+        statement, in the current transaction. Unlike the borrowings added to the
+        session, these are not seen by the ORM events: the usage rollups, the power
+        cache and the dashboard are updated here."""
+        if not (isinstance(rows, list) and all([isinstance(r, dict) for r in rows])):
+            raise TypeError("Bad arguments type")
+        db.session.execute(Borrowing.__table__.insert(), rows)
+        update_usages(
+            db.session.connection(),
+            [tuple(row.get(c) for c in USAGE_COLUMNS) for row in rows],
+            1,
+        )
+        invalidate_power(db.session)
+        invalidate_dashboard(db.session)
+
+    def last_modified(self) -> Union[datetime, None]:
+        dates = [
+            row.updated_at
+            for row in [self, self.borrower, self.borrowed_item]
+            if row is not None and row.updated_at is not None
+        ]
+        return max(dates, default=None)
 
     def __repr__(self) -> str:
         return "<Borrowing of {} by {} (id: {})>".format(
@@ -451,10 +1359,14 @@ class Borrowing(PaginatedAPIMixin, db.Model):
         )
 
     def to_dict(self, reuf_view: bool = False) -> dict:
+        links = link_builder()
         data = {
             "id": self.id,
-            "user": self.borrower.to_dict(reuf_view),  # uses backref
-            "item": self.borrowed_item.to_dict(reuf_view),  # uses backref
+            # uses backrefs, users and items can have been deleted
+            "user": self.borrower.to_dict(reuf_view) if self.borrower else None,
+            "item": self.borrowed_item.to_dict(reuf_view)
+            if self.borrowed_item
+            else None,
             "timestamp": self.timestamp.isoformat()
             + "Z",  # uses timezoned date format. See https://blog.miguelgrinberg.com
             # /post/the-flask-mega-tutorial-part-xxiii-application-programming-interfaces-apis
@@ -464,7 +1376,228 @@ class Borrowing(PaginatedAPIMixin, db.Model):
             "borrowing_description": self.borrowing_description,
             "remarks": self.remarks,
             "_links": {
-                "self": url_for("api.get_borrowing", id=self.id),
+                "self": links.url_for_id("api.get_borrowing", self.id),
             },
         }
         return data
+
+
+class ItemUsage(db.Model):
+    """Monthly rollup of the borrowings of an item, kept up to date incrementally
+    as borrowings are inserted, modified or deleted (see update_usages).
+
+    - item_id: the id of the item, 0 for the items that were deleted
+    - month: the first day of the month
+    - borrowings: the number of borrowings starting in this month
+    - borrowed_quantity: the number of units borrowed by these borrowings
+    - unit_days: the number of units in use summed over the days of this month,
+    counting every borrowing overlapping it"""
+
+    item_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Date, primary_key=True, index=True)
+    borrowings = db.Column(db.Integer, nullable=False, default=0)
+    borrowed_quantity = db.Column(db.Integer, nullable=False, default=0)
+    unit_days = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return "<ItemUsage of item {} in {}>".format(self.item_id, self.month)
+
+
+class UserUsage(db.Model):
+    """Monthly rollup of the borrowings made by a user, see ItemUsage.
+
+    - user_id: the id of the borrower, 0 for the users that were deleted"""
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Date, primary_key=True, index=True)
+    borrowings = db.Column(db.Integer, nullable=False, default=0)
+    borrowed_quantity = db.Column(db.Integer, nullable=False, default=0)
+    unit_days = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return "<UserUsage of user {} in {}>".format(self.user_id, self.month)
+
+
+# columns of a borrowing the usage rollups depend on, in the order of the rows given
+# to usage_deltas
+USAGE_COLUMNS = [
+    "user_id",
+    "item_id",
+    "borrowing_date",
+    "return_date",
+    "borrowed_quantity",
+]
+
+
+def month_days(start: date, end: date) -> list[tuple[date, int]]:
+    """Returns the first day of each month between start and end included, with the
+    number of days of the window in this month"""
+    days = []
+    month = start.replace(day=1)
+    while month <= end:
+        following = (month + timedelta(days=32)).replace(day=1)
+        last = min(end, following - timedelta(days=1))
+        days.append((month, (last - max(start, month)).days + 1))
+        month = following
+    return days
+
+
+def usage_deltas(rows: list[tuple], sign: int) -> tuple[dict, dict]:
+    """Returns the changes of the item and user usage rollups caused by adding
+    (sign 1) or removing (sign -1) borrowings, given by the values of their
+    USAGE_COLUMNS. Both map (id, month) to [borrowings, quantity, unit days]."""
+    items = defaultdict(lambda: [0, 0, 0])
+    users = defaultdict(lambda: [0, 0, 0])
+    for user_id, item_id, borrowing_date, return_date, quantity in rows:
+        if borrowing_date is None:
+            continue
+        quantity = quantity or 0
+        keys = [(items, item_id or 0), (users, user_id or 0)]
+        month = borrowing_date.replace(day=1)
+        for usages, key in keys:
+            usages[key, month][0] += sign
+            usages[key, month][1] += sign * quantity
+        if return_date is None:
+            continue
+        # borrowings last from their borrowing to their return date included
+        for month, days in month_days(borrowing_date, return_date):
+            for usages, key in keys:
+                usages[key, month][2] += sign * quantity * days
+    return items, users
+
+
+def _add_usages(connection: Connection, model, key: str, deltas: dict) -> None:
+    """Adds the deltas (see usage_deltas) to the rows of a usage rollup, creating
+    the missing ones, with a single upsert statement on SQLite and PostgreSQL"""
+    table = model.__table__
+    values = [
+        {
+            key: id,
+            "month": month,
+            "borrowings": borrowings,
+            "borrowed_quantity": quantity,
+            "unit_days": unit_days,
+        }
+        for (id, month), (borrowings, quantity, unit_days) in deltas.items()
+        if borrowings or quantity or unit_days
+    ]
+    if not values:
+        return
+    counters = ["borrowings", "borrowed_quantity", "unit_days"]
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        statement = insert.on_conflict_do_update(
+            index_elements=[key, "month"],
+            set_={c: table.c[c] + insert.excluded[c] for c in counters},
+        )
+        connection.execute(statement, values)
+        return
+    for row in values:
+        updated = connection.execute(
+            table.update()
+            .where(table.c[key] == row[key], table.c.month == row["month"])
+            .values({c: table.c[c] + row[c] for c in counters})
+        )
+        if updated.rowcount == 0:
+            connection.execute(table.insert(), [row])
+
+
+def update_usages(connection: Connection, rows: list[tuple], sign: int) -> None:
+    """Updates the usage rollups for borrowings added (sign 1) or removed (sign -1),
+    given by the values of their USAGE_COLUMNS, on the connection of the current
+    transaction"""
+    items, users = usage_deltas(rows, sign)
+    _add_usages(connection, ItemUsage, "item_id", items)
+    _add_usages(connection, UserUsage, "user_id", users)
+
+
+def _usage_values(target: Borrowing, previous: bool) -> tuple:
+    """Returns the values of the USAGE_COLUMNS of a borrowing, as stored before the
+    current flush if previous"""
+    state = db.inspect(target)
+    values = []
+    for column in USAGE_COLUMNS:
+        history = state.attrs[column].history
+        if previous and history.deleted:
+            values.append(history.deleted[0])
+        else:
+            values.append(getattr(target, column))
+    return tuple(values)
+
+
+@db.event.listens_for(Borrowing, "after_insert")
+def count_inserted_borrowing(mapper, connection, target: Borrowing) -> None:
+    update_usages(connection, [_usage_values(target, False)], 1)
+
+
+@db.event.listens_for(Borrowing, "after_update")
+def count_updated_borrowing(mapper, connection, target: Borrowing) -> None:
+    previous = _usage_values(target, True)
+    current = _usage_values(target, False)
+    if previous != current:
+        update_usages(connection, [previous], -1)
+        update_usages(connection, [current], 1)
+
+
+@db.event.listens_for(Borrowing, "after_delete")
+def count_deleted_borrowing(mapper, connection, target: Borrowing) -> None:
+    update_usages(connection, [_usage_values(target, True)], -1)
+
+
+@db.event.listens_for(Borrowing, "after_insert")
+@db.event.listens_for(Borrowing, "after_update")
+@db.event.listens_for(Borrowing, "after_delete")
+def invalidate_power_cache(mapper, connection, target: Borrowing) -> None:
+    """Drops the power drawn by the borrowed items as soon as a borrowing is
+    modified"""
+    invalidate_power(object_session(target))
+
+
+@db.event.listens_for(Item, "after_update")
+def invalidate_power_of_item(mapper, connection, target: Item) -> None:
+    """Drops the power drawn by the borrowed items when the power of one changes"""
+    if db.inspect(target).attrs.power.history.has_changes():
+        invalidate_power(object_session(target))
+
+
+def _invalidate(session: Session, cache: TTLCache, key: Hashable = None) -> None:
+    """Clears the cache, or only its entry for key if given, and does it again when
+    the session commits: a value computed meanwhile by another request, from the
+    rows as they were before the commit, would otherwise be kept"""
+    if key is None:
+        cache.clear()
+    else:
+        cache.invalidate(key)
+    session.info.setdefault("invalidated_caches", set()).add((cache, key))
+
+
+def invalidate_power(session: Session) -> None:
+    """Drops the power drawn by the borrowed items, see app.power"""
+    _invalidate(session, power_cache)
+
+
+def invalidate_dashboard(session: Session) -> None:
+    """Drops the cached dashboard, see app.dashboard"""
+    _invalidate(session, dashboard_cache)
+
+
+@db.event.listens_for(db.session, "after_flush")
+def invalidate_flushed_dashboard(session: Session, flush_context) -> None:
+    """Drops the cached dashboard when items or borrowings are flushed"""
+    if any(
+        [
+            isinstance(instance, (Item, Borrowing))
+            for instance in chain(session.new, session.dirty, session.deleted)
+        ]
+    ):
+        invalidate_dashboard(session)
+
+
+@db.event.listens_for(db.session, "after_commit")
+def clear_invalidated_caches(session: Session) -> None:
+    for cache, key in session.info.pop("invalidated_caches", set()):
+        if key is None:
+            cache.clear()
+        else:
+            cache.invalidate(key)
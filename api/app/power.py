@@ -0,0 +1,99 @@
+from datetime import date, timedelta
+from itertools import accumulate
+
+from app import db, power_cache
+from app.encoding import runs
+from app.models import Borrowing, Item
+
+# the draw of a borrowing is its quantity times the power of the item, from its
+# borrowing to its return date included
+
+
+def _add_draw(
+    differences: list[int], start: date, borrowing_date: date, return_date: date, watts
+) -> None:
+    """Adds the draw of a borrowing to the difference array of a window starting on
+    start, which has one more cell than the window has days"""
+    days = len(differences) - 1
+    first = max((borrowing_date - start).days, 0)
+    last = min((return_date - start).days + 1, days)
+    if first < last:
+        differences[first] += watts
+        differences[last] -= watts
+
+
+def borrowed_draw(start: date, end: date) -> tuple[int, ...]:
+    """Returns the power drawn (in Watts) on each day from start to end included by
+    the items borrowed on this day.
+
+    The borrowings of items with a power overlapping the window are fetched in one
+    query, then summed in a difference array. The result is kept in power_cache
+    until a borrowing or the power of an item changes, see
+    invalidate_power_cache."""
+    if not (isinstance(start, date) and isinstance(end, date)):
+        raise TypeError("Bad arguments type")
+    draw = power_cache.get((start, end))
+    if draw is not None:
+        return draw
+    query = (
+        db.session.query(
+            Borrowing.borrowing_date,
+            Borrowing.return_date,
+            Borrowing.borrowed_quantity * Item.power,
+        )
+        .join(Item, Item.id == Borrowing.item_id)
+        .filter(Borrowing.return_date >= start, Borrowing.borrowing_date <= end)
+        .filter(Item.power > 0, Borrowing.borrowed_quantity > 0)
+    )
+    differences = [0] * ((end - start).days + 2)
+    for borrowing_date, return_date, watts in query:
+        _add_draw(differences, start, borrowing_date, return_date, watts)
+    draw = tuple(accumulate(differences[:-1]))
+    power_cache.set((start, end), draw)
+    return draw
+
+
+def planned_draw(borrowings: list[dict], start: date, end: date) -> list[int]:
+    """Returns the power drawn (in Watts) on each day from start to end included by
+    planned borrowings, given as {"id": item id, "quantity": number of units,
+    "borrowing_date": date, "return_date": date}. The power of the items is read
+    with a single query. Raises ValueError if one of the items does not exist."""
+    if not (
+        isinstance(borrowings, list)
+        and all([isinstance(b, dict) for b in borrowings])
+        and isinstance(start, date)
+        and isinstance(end, date)
+    ):
+        raise TypeError("Bad arguments type")
+    ids = {b["id"] for b in borrowings}
+    powers = dict(db.session.query(Item.id, Item.power).filter(Item.id.in_(list(ids))))
+    if len(powers) != len(ids):
+        raise ValueError("some of the items do not exist")
+    differences = [0] * ((end - start).days + 2)
+    for borrowing in borrowings:
+        _add_draw(
+            differences,
+            start,
+            borrowing["borrowing_date"],
+            borrowing["return_date"],
+            borrowing["quantity"] * (powers[borrowing["id"]] or 0),
+        )
+    return list(accumulate(differences[:-1]))
+
+
+def power_report(start: date, end: date, planned: list[dict] = None) -> dict:
+    """Returns the power drawn over the days from start to end included by the
+    borrowed items, and by the planned borrowings if given (see planned_draw), as a
+    dictionary ready to be jsonified"""
+    draw = borrowed_draw(start, end)
+    if planned:
+        draw = [a + b for a, b in zip(draw, planned_draw(planned, start, end))]
+    peak = max(draw)
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "peak": peak,
+        "peak_date": (start + timedelta(days=draw.index(peak))).isoformat(),
+        "watt_days": sum(draw),
+        "draw": runs(draw),
+    }
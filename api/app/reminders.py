@@ -0,0 +1,128 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+from app import db, mail
+from app.email import send_email
+from app.models import Borrowing, Item, Role, User
+
+
+def expiring_items(today: date, days: int, chunk_size: int = 500):
+    """Yields the (id, name, box name, expiry date) of the items expiring in the
+    given number of days from today (included), by expiry date. The range is
+    answered from the expiry_date index, rows are fetched chunk_size at a time."""
+    query = (
+        db.session.query(Item.id, Item.name, Item.box_name, Item.expiry_date)
+        .filter(
+            Item.expiry_date >= today, Item.expiry_date <= today + timedelta(days=days)
+        )
+        .order_by(Item.expiry_date, Item.id)
+    )
+    return query.execution_options(stream_results=True).yield_per(chunk_size)
+
+
+def _overdue(today: date, days: int) -> list:
+    """Returns the filters of the borrowings which return date passed in the given
+    number of days before today, and which borrower was not reminded yet"""
+    return [
+        Borrowing.return_date >= today - timedelta(days=days),
+        Borrowing.return_date < today,
+        Borrowing.reminded_on.is_(None),
+    ]
+
+
+def overdue_borrowings(today: date, days: int, chunk_size: int = 500):
+    """Yields the (id, return date, quantity, borrower email, borrower username,
+    item name) of the borrowings which return date passed in the given number of
+    days before today, by return date. Borrowings already reminded (see
+    mark_reminded) are left out.
+
+    Borrowings do not record their actual return, only the borrowings that ended
+    recently are reported so that the scan does not grow with the history: the days
+    are the ones a missed digest can be caught up within. The range is answered
+    from the return_date index, rows are fetched chunk_size at a time."""
+    query = (
+        db.session.query(
+            Borrowing.id,
+            Borrowing.return_date,
+            Borrowing.borrowed_quantity,
+            User.email,
+            User.username,
+            Item.name,
+        )
+        .join(User, User.id == Borrowing.user_id)
+        .join(Item, Item.id == Borrowing.item_id)
+        .filter(*_overdue(today, days))
+        .order_by(Borrowing.return_date, Borrowing.id)
+    )
+    return query.execution_options(stream_results=True).yield_per(chunk_size)
+
+
+def mark_reminded(today: date, days: int) -> int:
+    """Records that the borrowings yielded by overdue_borrowings were reminded
+    today, with a single UPDATE in the current transaction, so that the next digests
+    do not repeat them. Returns the number of borrowings marked."""
+    if not (isinstance(today, date) and isinstance(days, int)):
+        raise TypeError("Bad arguments type")
+    return Borrowing.query.filter(*_overdue(today, days)).update(
+        {Borrowing.reminded_on: today}, synchronize_session=False
+    )
+
+
+def collect_digests(
+    today: date, expiry_days: int, overdue_days: int, chunk_size: int = 500
+) -> dict[str, list[str]]:
+    """Returns the lines of the digest of each recipient: borrowers get their overdue
+    borrowings, reufs every overdue borrowing and the expiring items."""
+    if not (
+        isinstance(today, date)
+        and isinstance(expiry_days, int)
+        and isinstance(overdue_days, int)
+        and isinstance(chunk_size, int)
+    ):
+        raise TypeError("Bad arguments type")
+    digests = defaultdict(list)
+    reuf_lines = []
+    for id, return_date, quantity, email, username, name in overdue_borrowings(
+        today, overdue_days, chunk_size
+    ):
+        line = f"- {quantity} x {name}, to be returned on {return_date.isoformat()}"
+        if email:
+            digests[email].append(line)
+        reuf_lines.append(f"{line} by {username} (borrowing {id})")
+    items = [
+        f"- {name} (item {id}, box {box_name}) expires on {expiry_date.isoformat()}"
+        for id, name, box_name, expiry_date in expiring_items(
+            today, expiry_days, chunk_size
+        )
+    ]
+    for email in digests:
+        digests[email].insert(0, "Your borrowings to be returned:")
+    reuf_digest = []
+    if reuf_lines:
+        reuf_digest += ["Borrowings to be returned:"] + reuf_lines
+    if items:
+        reuf_digest += [f"Items expiring in the next {expiry_days} days:"] + items
+    if reuf_digest:
+        reufs = User.with_one_of_roles([Role.REUF, Role.REUF_ADMIN])
+        for (email,) in reufs.with_entities(User.email):
+            if email:
+                # reufs borrowing items get both digests in the same mail
+                own = digests.get(email, [])
+                digests[email] = own + ([""] if own else []) + reuf_digest
+    return dict(digests)
+
+
+def send_digests(digests: dict[str, list[str]]) -> int:
+    """Sends one mail per recipient of the digests, all of them over a single SMTP
+    session. Returns the number of mails sent."""
+    if not digests:
+        return 0
+    with mail.connect() as connection:
+        for email, lines in digests.items():
+            send_email(
+                subject="Treuf reminders",
+                recipients=[email],
+                text_body="Hello\n\n" + "\n".join(lines) + "\n",
+                connection=connection,
+            )
+    return len(digests)
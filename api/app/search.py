@@ -0,0 +1,116 @@
+import re
+
+from sqlalchemy import DDL, Table, and_, event, func, literal_column, or_, select
+from sqlalchemy.orm import Query
+from sqlalchemy.sql import column, table
+
+# columns of the item table that are searched, with their weight in the ranking
+SEARCH_COLUMNS = {"name": 10.0, "description": 4.0, "box_name": 2.0, "remarks": 1.0}
+# words of a search beyond this number are ignored
+MAX_SEARCH_TERMS = 8
+
+_COLUMNS = ", ".join(SEARCH_COLUMNS)
+
+# SQLite: an external content FTS5 table indexing the item rows, kept in sync by
+# triggers. The update trigger only fires for the indexed columns, bumping the
+# version of an item on every borrowing does not reindex it. Prefixes of 2 and 3
+# characters are indexed to answer short prefix searches without a scan.
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+    + f"{_COLUMNS}, content='item', content_rowid='id', "
+    + "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_ai AFTER INSERT ON item BEGIN "
+    + f"INSERT INTO item_fts(rowid, {_COLUMNS}) "
+    + "VALUES (new.id, new.name, new.description, new.box_name, new.remarks); END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_ad AFTER DELETE ON item BEGIN "
+    + f"INSERT INTO item_fts(item_fts, rowid, {_COLUMNS}) VALUES "
+    + "('delete', old.id, old.name, old.description, old.box_name, old.remarks); "
+    + "END",
+    f"CREATE TRIGGER IF NOT EXISTS item_fts_au AFTER UPDATE OF {_COLUMNS} ON item "
+    + f"BEGIN INSERT INTO item_fts(item_fts, rowid, {_COLUMNS}) VALUES "
+    + "('delete', old.id, old.name, old.description, old.box_name, old.remarks); "
+    + f"INSERT INTO item_fts(rowid, {_COLUMNS}) "
+    + "VALUES (new.id, new.name, new.description, new.box_name, new.remarks); END",
+]
+SQLITE_DROP = ["DROP TABLE IF EXISTS item_fts"]
+
+# PostgreSQL: a GIN index on the weighted document of each item. Being an
+# expression index, it is kept in sync by the database itself.
+POSTGRESQL_DOCUMENT = " || ".join(
+    f"setweight(to_tsvector('simple', coalesce({name}, '')), '{weight}')"
+    for name, weight in zip(SEARCH_COLUMNS, "ABCD")
+)
+POSTGRESQL_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_item_search ON item "
+    + f"USING gin (({POSTGRESQL_DOCUMENT}))"
+]
+POSTGRESQL_DROP = ["DROP INDEX IF EXISTS ix_item_search"]
+
+
+def register_search_index(item_table: Table) -> None:
+    """Creates and drops the full-text index along with the item table, for the
+    databases created with db.create_all()"""
+    for dialect, statements, drops in [
+        ("sqlite", SQLITE_DDL, SQLITE_DROP),
+        ("postgresql", POSTGRESQL_DDL, POSTGRESQL_DROP),
+    ]:
+        for statement in statements:
+            event.listen(
+                item_table, "after_create", DDL(statement).execute_if(dialect=dialect)
+            )
+        for statement in drops:
+            event.listen(
+                item_table, "before_drop", DDL(statement).execute_if(dialect=dialect)
+            )
+
+
+def search_terms(q: str) -> list[str]:
+    """Returns the lower case words of a search"""
+    if not isinstance(q, str):
+        raise TypeError("Bad arguments type")
+    return re.findall(r"\w+", q.lower())[:MAX_SEARCH_TERMS]
+
+
+def search_query(query: Query, item_table: Table, terms: list[str]) -> Query:
+    """Restricts the given query of items to the ones containing every term, as a
+    word or as the prefix of a word, by decreasing relevance. Uses the full-text
+    index of the database, or falls back to a scan of the items on backends
+    without one."""
+    bind = query.session.get_bind()
+    dialect = bind.dialect.name
+    if dialect == "sqlite":
+        fts = table("item_fts", column("rowid"))
+        match = " ".join(f'"{term}"*' for term in terms)
+        rank = func.bm25(literal_column("item_fts"), *SEARCH_COLUMNS.values())
+        # materialized, the matches are looked up once before joining the items.
+        # Otherwise SQLite can prefer filtering the items by acl_mask first and run
+        # the full-text query for each of them.
+        matches = (
+            select(fts.c.rowid.label("id"), rank.label("rank"))
+            .where(literal_column("item_fts").op("MATCH")(match))
+            .cte("item_matches")
+        )
+        if bind.dialect.dbapi.sqlite_version_info >= (3, 35):
+            matches = matches.prefix_with("MATERIALIZED")
+        return query.join(matches, matches.c.id == item_table.c.id).order_by(
+            matches.c.rank, item_table.c.id
+        )
+    if dialect == "postgresql":
+        document = literal_column(f"({POSTGRESQL_DOCUMENT})")
+        tsquery = func.to_tsquery("simple", " & ".join(f"{t}:*" for t in terms))
+        return query.filter(document.op("@@")(tsquery)).order_by(
+            func.ts_rank(document, tsquery).desc(), item_table.c.id
+        )
+    return query.filter(
+        and_(
+            *[
+                or_(
+                    *[
+                        func.lower(item_table.c[name]).contains(term, autoescape=True)
+                        for name in SEARCH_COLUMNS
+                    ]
+                )
+                for term in terms
+            ]
+        )
+    ).order_by(item_table.c.id)
@@ -0,0 +1,292 @@
+"""Micro-benchmarks of the API hot paths. Run with
+
+    python benchmarks.py [name ...]
+
+where names are the benchmarks to run (all of them by default). Each benchmark
+prints its throughput so that configurations can be compared side by side."""
+import base64
+import os
+import sys
+import tempfile
+import random
+from datetime import date, timedelta
+from time import perf_counter
+from unittest import mock
+
+from flask import url_for
+
+from app import create_app, db, login_cache, token_cache
+from app.links import LinkBuilder
+from app.models import Borrowing, Item, User
+from tests import TestConfig
+
+
+class BenchConfig(TestConfig):
+    """Uses an on disk database so that queries have a realistic cost"""
+
+    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(
+        tempfile.gettempdir(), "treuf-bench.db"
+    )
+
+
+def run(config_class, setup, bench, n: int) -> float:
+    """Builds an app from config_class, fills it with setup(client) and returns the
+    number of calls to bench(client, context) made per second"""
+    app = create_app(config_class)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        client = app.test_client()
+        context = setup(client)
+        bench(client, context)  # warm up
+        start = perf_counter()
+        for _ in range(n):
+            bench(client, context)
+        elapsed = perf_counter() - start
+        db.session.remove()
+        db.drop_all()
+    return n / elapsed
+
+
+def bench_token_auth(n: int = 2000) -> None:
+    """Requests/sec of a token authenticated route with and without the token
+    cache, and with signed tokens"""
+
+    def setup(client):
+        u = User()
+        u.from_dict(
+            {
+                "username": "robb",
+                "email": "robb@example.com",
+                "sciper": 123456,
+                "unit": "student",
+                "password": "1234",
+            },
+            new_user=True,
+        )
+        db.session.add(u)
+        db.session.commit()
+        creds = base64.b64encode(b"robb:1234").decode("utf-8")
+        response = client.post(
+            "/api/tokens", headers={"Authorization": "Basic " + creds}
+        )
+        return {"Authorization": "Bearer " + response.get_json()["token"]}
+
+    def bench(client, headers):
+        assert client.get("/api/users/1", headers=headers).status_code == 200
+
+    class NoCacheConfig(BenchConfig):
+        TOKEN_CACHE_SIZE = 0
+
+    class SignedConfig(BenchConfig):
+        TOKEN_SIGNED = True
+
+    without_cache = run(NoCacheConfig, setup, bench, n)
+    with_cache = run(BenchConfig, setup, bench, n)
+    print(f"token_auth without cache: {without_cache:8.0f} req/s")
+    print(
+        f"token_auth with cache:    {with_cache:8.0f} req/s "
+        + f"({token_cache.hits} hits, {token_cache.misses} misses)"
+    )
+    signed = run(SignedConfig, setup, bench, n)
+    print(f"token_auth signed:        {signed:8.0f} req/s")
+
+
+def bench_login(n: int = 200) -> None:
+    """Logins/sec on the basic auth route with and without the verified
+    credentials cache"""
+
+    def setup(client):
+        u = User(username="robb", email="robb@example.com")
+        u.set_password("1234")
+        db.session.add(u)
+        db.session.commit()
+        creds = base64.b64encode(b"robb:1234").decode("utf-8")
+        return {"Authorization": "Basic " + creds}
+
+    def bench(client, headers):
+        assert client.post("/api/tokens", headers=headers).status_code == 200
+
+    class NoCacheConfig(BenchConfig):
+        LOGIN_CACHE_SIZE = 0
+
+    without_cache = run(NoCacheConfig, setup, bench, n)
+    with_cache = run(BenchConfig, setup, bench, n)
+    print(f"login without cache: {without_cache:8.0f} logins/s")
+    print(
+        f"login with cache:    {with_cache:8.0f} logins/s "
+        + f"({login_cache.hits} hits, {login_cache.misses} misses)"
+    )
+
+
+def bench_serialization(n: int = 200) -> None:
+    """Pages/sec of the serialization of 100 borrowings, with url_for and with the
+    precompiled link builder"""
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for i in range(100):
+            u = User(username=f"user {i}", email=f"user{i}@example.com", sciper=i)
+            item = Item(name=f"item {i}", quantity=10)
+            db.session.add_all([u, item])
+            db.session.flush()
+            db.session.add(
+                Borrowing(
+                    user_id=u.id,
+                    item_id=item.id,
+                    borrowing_date=date.today(),
+                    return_date=date.today(),
+                    borrowed_quantity=1,
+                )
+            )
+        db.session.commit()
+        borrowings = Borrowing.query.options(*Borrowing.collection_load_options())
+        borrowings = borrowings.all()
+        with app.test_request_context("/api/borrowings/"):
+
+            def serialize():
+                start = perf_counter()
+                for _ in range(n):
+                    [b.to_dict(True) for b in borrowings]
+                return n / (perf_counter() - start)
+
+            with mock.patch.object(
+                LinkBuilder, "url_for_id", lambda self, e, id: url_for(e, id=id)
+            ):
+                with_url_for = serialize()
+            precompiled = serialize()
+        db.session.remove()
+        db.drop_all()
+    print(f"serialization with url_for:     {with_url_for:8.0f} pages/s")
+    print(f"serialization with precompiled: {precompiled:8.0f} pages/s")
+
+
+def fill_borrowings(n_items: int, n_borrowings: int, first_day: date, days: int):
+    """Inserts n_items items and n_borrowings random borrowings of them, lasting up
+    to a week and starting in the given number of days from first_day"""
+    random.seed(0)
+    db.session.execute(
+        Item.__table__.insert(),
+        [{"name": f"item {i}", "quantity": 50} for i in range(n_items)],
+    )
+    rows = []
+    for _ in range(n_borrowings):
+        start = first_day + timedelta(days=random.randrange(days))
+        rows.append(
+            {
+                "item_id": random.randint(1, n_items),
+                "user_id": 1,
+                "borrowing_date": start,
+                "return_date": start + timedelta(days=random.randrange(7)),
+                "borrowed_quantity": random.randint(1, 3),
+            }
+        )
+    db.session.execute(Borrowing.__table__.insert(), rows)
+    db.session.commit()
+
+
+def bench_availability(n: int = 200) -> None:
+    """Availability queries/sec over a week among 100k borrowings of 1000 items over
+    6 years, with the engine and with a scan of the borrowings in Python"""
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        fill_borrowings(1000, 100000, date(2020, 1, 1), 6 * 365)
+        start, end = date(2025, 6, 1), date(2025, 6, 7)
+
+        def scan(item_id):
+            # loads every borrowing of the item and counts the units day by day
+            borrowings = Borrowing.query.filter_by(item_id=item_id).all()
+            peak, day = 0, start
+            while day <= end:
+                in_use = sum(
+                    b.borrowed_quantity
+                    for b in borrowings
+                    if b.borrowing_date <= day <= b.return_date
+                )
+                peak, day = max(peak, in_use), day + timedelta(days=1)
+            return peak
+
+        def timed(fn, runs):
+            begin = perf_counter()
+            for i in range(runs):
+                fn(i % 1000 + 1)
+            return runs / (perf_counter() - begin)
+
+        for i in range(1, 50):
+            assert scan(i) == Item.peak_usages([i], start, end).get(i, 0)
+        scanned = timed(scan, n)
+        engine = timed(lambda i: Item.peak_usages([i], start, end), n)
+        every_item = timed(lambda i: Item.peak_usages(None, start, end), n // 10)
+        db.session.remove()
+        db.drop_all()
+    print(f"availability with a scan:   {scanned:8.0f} items/s")
+    print(f"availability with engine:   {engine:8.0f} items/s")
+    print(f"availability of 1000 items: {every_item:8.0f} batches/s")
+
+
+def bench_search(n: int = 20) -> None:
+    """Searches/sec among 50k items with the full-text index and with a LIKE scan of
+    the searched columns, counting the matches to paginate them like the search
+    route"""
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        random.seed(0)
+        words = [f"w{i:04d}x" for i in range(5000)]
+        db.session.execute(
+            Item.__table__.insert(),
+            [
+                {
+                    "name": f"item {i}",
+                    "description": " ".join(random.sample(words, 8)),
+                    "remarks": " ".join(random.sample(words, 4)),
+                }
+                for i in range(50000)
+            ],
+        )
+        db.session.commit()
+
+        def scan(term):
+            return (
+                Item.query.filter(
+                    db.or_(
+                        Item.name.contains(term),
+                        Item.description.contains(term),
+                        Item.box_name.contains(term),
+                        Item.remarks.contains(term),
+                    )
+                )
+                .order_by(Item.id)
+                .paginate(1, 10, False)
+            )
+
+        def timed(fn):
+            begin = perf_counter()
+            for i in range(n):
+                fn(words[i * 7 % len(words)])
+            return n / (perf_counter() - begin)
+
+        scanned = timed(scan)
+        indexed = timed(lambda term: Item.search(term, []).paginate(1, 10, False))
+        db.session.remove()
+        db.drop_all()
+    print(f"search with a LIKE scan:  {scanned:8.0f} searches/s")
+    print(f"search with the index:    {indexed:8.0f} searches/s")
+
+
+BENCHMARKS = {
+    "token_auth": bench_token_auth,
+    "login": bench_login,
+    "serialization": bench_serialization,
+    "availability": bench_availability,
+    "search": bench_search,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
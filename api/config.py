@@ -18,6 +18,8 @@ class Config(object):
         "DATABASE_URL"
     ) or "sqlite:///" + os.path.join(basedir, "app.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # encodes streamed collections with orjson when it is installed
+    JSON_USE_ORJSON = os.environ.get("JSON_USE_ORJSON", "1") != "0"
 
     """
     ###################
@@ -32,6 +34,19 @@ class Config(object):
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
     ADMIN = [os.environ.get("ADMIN")]
     MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER")
+    # mails are queued and sent by MAIL_QUEUE_WORKERS threads, by batches of up to
+    # MAIL_QUEUE_BATCH_SIZE mails over one SMTP session. Senders wait up to
+    # MAIL_QUEUE_TIMEOUT seconds when MAIL_QUEUE_SIZE mails are already queued.
+    MAIL_QUEUE_SIZE = int(os.environ.get("MAIL_QUEUE_SIZE") or 256)
+    MAIL_QUEUE_TIMEOUT = float(os.environ.get("MAIL_QUEUE_TIMEOUT") or 5)
+    MAIL_QUEUE_WORKERS = int(os.environ.get("MAIL_QUEUE_WORKERS") or 1)
+    MAIL_QUEUE_BATCH_SIZE = int(os.environ.get("MAIL_QUEUE_BATCH_SIZE") or 20)
+    # queued mails are sent for up to this number of seconds when stopping
+    MAIL_QUEUE_DRAIN_TIMEOUT = float(os.environ.get("MAIL_QUEUE_DRAIN_TIMEOUT") or 30)
+    # failed batches are retried MAIL_RETRIES times, after MAIL_RETRY_DELAY seconds
+    # doubled at each retry
+    MAIL_RETRIES = int(os.environ.get("MAIL_RETRIES") or 3)
+    MAIL_RETRY_DELAY = float(os.environ.get("MAIL_RETRY_DELAY") or 1)
 
     """
     ###################
@@ -42,3 +57,56 @@ class Config(object):
     USER_CREATION_TOKEN = os.environ.get(
         "USER_CREATION_TOKEN"
     )  # token required for creating a new account
+    # issues self-contained tokens signed with SECRET_KEY instead of storing them in
+    # the database. Only the token epoch of the user is read to check revocation.
+    TOKEN_SIGNED = os.environ.get("TOKEN_SIGNED") is not None
+    # verified tokens (or token epochs in signed mode) are kept in memory to spare a
+    # database read on each request.
+    # The cache is per process: revocations are immediate in the process handling
+    # them and visible to the other workers after at most TOKEN_CACHE_TTL seconds.
+    # A size of 0 disables the cache.
+    TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE") or 1024)
+    TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL") or 30)  # in seconds
+    # hashing method of passwords, see werkzeug.security.generate_password_hash.
+    # Hashes made with another method are upgraded when their user logs in.
+    PASSWORD_HASH_METHOD = (
+        os.environ.get("PASSWORD_HASH_METHOD") or "pbkdf2:sha256:260000"
+    )
+    # passwords are hashed by a pool of HASHING_POOL_SIZE threads. Logins arriving
+    # while HASHING_QUEUE_DEPTH others are already waiting are answered with a 503.
+    HASHING_POOL_SIZE = int(os.environ.get("HASHING_POOL_SIZE") or 4)
+    HASHING_QUEUE_DEPTH = int(os.environ.get("HASHING_QUEUE_DEPTH") or 32)
+    # recently verified credentials are remembered to skip hashing them again
+    LOGIN_CACHE_SIZE = int(os.environ.get("LOGIN_CACHE_SIZE") or 1024)
+    LOGIN_CACHE_TTL = int(os.environ.get("LOGIN_CACHE_TTL") or 60)  # in seconds
+    # number of times a borrowing is retried when the item is concurrently borrowed
+    BORROWING_ATTEMPTS = int(os.environ.get("BORROWING_ATTEMPTS") or 10)
+    # flask send-reminders reports the items expiring within REMINDER_EXPIRY_DAYS
+    # and the borrowings which return date passed within REMINDER_OVERDUE_DAYS and
+    # which were not reminded yet, fetching REMINDER_CHUNK_SIZE rows at a time
+    REMINDER_EXPIRY_DAYS = int(os.environ.get("REMINDER_EXPIRY_DAYS") or 30)
+    REMINDER_OVERDUE_DAYS = int(os.environ.get("REMINDER_OVERDUE_DAYS") or 7)
+    REMINDER_CHUNK_SIZE = int(os.environ.get("REMINDER_CHUNK_SIZE") or 500)
+    # directory of the item images, stored by the hash of their content
+    IMAGE_STORE = os.environ.get("IMAGE_STORE") or os.path.join(basedir, "images")
+    # images are made thumbnails fitting in squares of these sizes (in pixels)
+    IMAGE_THUMBNAIL_SIZES = [
+        int(size)
+        for size in (os.environ.get("IMAGE_THUMBNAIL_SIZES") or "64,256").split(",")
+    ]
+    IMAGE_MAX_SIZE = int(os.environ.get("IMAGE_MAX_SIZE") or 5 * 1024 * 1024)  # bytes
+    # items are imported and exported by chunks of this number of rows, each chunk
+    # imported in its own transaction
+    INVENTORY_CHUNK_SIZE = int(os.environ.get("INVENTORY_CHUNK_SIZE") or 500)
+    # longest window of dates of a calendar, in days
+    CALENDAR_MAX_DAYS = int(os.environ.get("CALENDAR_MAX_DAYS") or 366)
+    # the power drawn by the borrowed items over a window of dates is kept in
+    # memory until a borrowing changes. The cache is per process, the changes made
+    # in the other workers are seen after at most POWER_CACHE_TTL seconds.
+    POWER_CACHE_SIZE = int(os.environ.get("POWER_CACHE_SIZE") or 64)
+    POWER_CACHE_TTL = int(os.environ.get("POWER_CACHE_TTL") or 60)  # in seconds
+    # the dashboard is kept in memory until an item or a borrowing changes. The
+    # cache is per process, the changes made in the other workers are seen after at
+    # most DASHBOARD_CACHE_TTL seconds.
+    DASHBOARD_CACHE_SIZE = int(os.environ.get("DASHBOARD_CACHE_SIZE") or 4)
+    DASHBOARD_CACHE_TTL = int(os.environ.get("DASHBOARD_CACHE_TTL") or 300)  # seconds
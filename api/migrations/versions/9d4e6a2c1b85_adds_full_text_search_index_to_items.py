@@ -0,0 +1,76 @@
+"""adds full text search index to items
+
+Revision ID: 9d4e6a2c1b85
+Revises: 653852d67e89
+Create Date: 2026-10-17 09:12:40.517382
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4e6a2c1b85'
+down_revision = '653852d67e89'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'name, description, box_name, remarks'
+NEW_ROW = 'new.id, new.name, new.description, new.box_name, new.remarks'
+OLD_ROW = 'old.id, old.name, old.description, old.box_name, old.remarks'
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE item_fts USING fts5("
+    f"{COLUMNS}, content='item', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER item_fts_ai AFTER INSERT ON item BEGIN "
+    f"INSERT INTO item_fts(rowid, {COLUMNS}) VALUES ({NEW_ROW}); END",
+    "CREATE TRIGGER item_fts_ad AFTER DELETE ON item BEGIN "
+    f"INSERT INTO item_fts(item_fts, rowid, {COLUMNS}) VALUES ('delete', {OLD_ROW}); "
+    "END",
+    f"CREATE TRIGGER item_fts_au AFTER UPDATE OF {COLUMNS} ON item BEGIN "
+    f"INSERT INTO item_fts(item_fts, rowid, {COLUMNS}) VALUES ('delete', {OLD_ROW}); "
+    f"INSERT INTO item_fts(rowid, {COLUMNS}) VALUES ({NEW_ROW}); END",
+    # indexes the existing items
+    "INSERT INTO item_fts(item_fts) VALUES ('rebuild')",
+]
+SQLITE_DOWNGRADE = [
+    'DROP TRIGGER item_fts_au',
+    'DROP TRIGGER item_fts_ad',
+    'DROP TRIGGER item_fts_ai',
+    'DROP TABLE item_fts',
+]
+
+POSTGRESQL_DOCUMENT = ' || '.join(
+    f"setweight(to_tsvector('simple', coalesce({name}, '')), '{weight}')"
+    for name, weight in zip(['name', 'description', 'box_name', 'remarks'], 'ABCD')
+)
+POSTGRESQL_UPGRADE = [
+    f'CREATE INDEX ix_item_search ON item USING gin (({POSTGRESQL_DOCUMENT}))'
+]
+POSTGRESQL_DOWNGRADE = ['DROP INDEX ix_item_search']
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        statements = SQLITE_UPGRADE
+    elif dialect == 'postgresql':
+        statements = POSTGRESQL_UPGRADE
+    else:
+        # searches scan the items on other backends
+        statements = []
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        statements = SQLITE_DOWNGRADE
+    elif dialect == 'postgresql':
+        statements = POSTGRESQL_DOWNGRADE
+    else:
+        statements = []
+    for statement in statements:
+        op.execute(statement)
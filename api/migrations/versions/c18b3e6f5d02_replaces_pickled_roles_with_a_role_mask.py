@@ -0,0 +1,97 @@
+"""replaces pickled roles with a role mask
+
+Revision ID: c18b3e6f5d02
+Revises: a7d25e90c4f1
+Create Date: 2026-10-17 11:48:05.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c18b3e6f5d02'
+down_revision = 'a7d25e90c4f1'
+branch_labels = None
+depends_on = None
+
+# copy of app.models.ROLE_BITS at the time of this revision, keyed by role value
+ROLE_BITS = {'reuf': 1, 'reuf_admin': 2}
+CHUNK_SIZE = 500
+
+user = sa.table(
+    'user',
+    sa.column('id', sa.Integer),
+    sa.column('roles', sa.PickleType),
+    sa.column('role_mask', sa.Integer),
+)
+
+
+def chunks(connection, columns):
+    """Yields the rows of the user table in chunks of CHUNK_SIZE, in id order"""
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(*columns)
+            .where(user.c.id > last_id)
+            .order_by(user.c.id)
+            .limit(CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def upgrade():
+    op.add_column('user', sa.Column('role_mask', sa.Integer(), server_default='0', nullable=False))
+    op.create_index(op.f('ix_user_role_mask'), 'user', ['role_mask'], unique=False)
+
+    connection = op.get_bind()
+    for rows in chunks(connection, [user.c.id, user.c.roles]):
+        updates = []
+        for row in rows:
+            mask = 0
+            for role in row.roles or []:
+                mask |= ROLE_BITS[role.value]
+            if mask:
+                updates.append({'_id': row.id, '_mask': mask})
+        if updates:
+            connection.execute(
+                user.update()
+                .where(user.c.id == sa.bindparam('_id'))
+                .values(role_mask=sa.bindparam('_mask')),
+                updates,
+            )
+
+    op.drop_index(op.f('ix_user_roles'), table_name='user')
+    op.drop_column('user', 'roles')
+
+
+def downgrade():
+    from app.models import Role
+
+    op.add_column('user', sa.Column('roles', sa.PickleType(), nullable=True))
+    op.create_index(op.f('ix_user_roles'), 'user', ['roles'], unique=False)
+
+    connection = op.get_bind()
+    for rows in chunks(connection, [user.c.id, user.c.role_mask]):
+        connection.execute(
+            user.update()
+            .where(user.c.id == sa.bindparam('_id'))
+            .values(roles=sa.bindparam('_roles', type_=sa.PickleType)),
+            [
+                {
+                    '_id': row.id,
+                    '_roles': [
+                        Role(value)
+                        for value, bit in ROLE_BITS.items()
+                        if row.role_mask & bit
+                    ],
+                }
+                for row in rows
+            ],
+        )
+
+    op.drop_index(op.f('ix_user_role_mask'), table_name='user')
+    op.drop_column('user', 'role_mask')
@@ -0,0 +1,97 @@
+"""replaces pickled item acl with an acl mask
+
+Revision ID: f2e84b1a9c37
+Revises: c18b3e6f5d02
+Create Date: 2026-10-17 13:20:44.672310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2e84b1a9c37'
+down_revision = 'c18b3e6f5d02'
+branch_labels = None
+depends_on = None
+
+# copy of app.models.ROLE_BITS at the time of this revision, keyed by role value
+ROLE_BITS = {'reuf': 1, 'reuf_admin': 2}
+CHUNK_SIZE = 500
+
+item = sa.table(
+    'item',
+    sa.column('id', sa.Integer),
+    sa.column('access_control_list', sa.PickleType),
+    sa.column('acl_mask', sa.Integer),
+)
+
+
+def chunks(connection, columns):
+    """Yields the rows of the item table in chunks of CHUNK_SIZE, in id order"""
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(*columns)
+            .where(item.c.id > last_id)
+            .order_by(item.c.id)
+            .limit(CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def upgrade():
+    op.add_column('item', sa.Column('acl_mask', sa.Integer(), server_default='0', nullable=False))
+    op.create_index(op.f('ix_item_acl_mask'), 'item', ['acl_mask'], unique=False)
+
+    connection = op.get_bind()
+    for rows in chunks(connection, [item.c.id, item.c.access_control_list]):
+        updates = []
+        for row in rows:
+            mask = 0
+            for role in row.access_control_list or []:
+                mask |= ROLE_BITS[role.value]
+            if mask:
+                updates.append({'_id': row.id, '_mask': mask})
+        if updates:
+            connection.execute(
+                item.update()
+                .where(item.c.id == sa.bindparam('_id'))
+                .values(acl_mask=sa.bindparam('_mask')),
+                updates,
+            )
+
+    op.drop_index(op.f('ix_item_access_control_list'), table_name='item')
+    op.drop_column('item', 'access_control_list')
+
+
+def downgrade():
+    from app.models import Role
+
+    op.add_column('item', sa.Column('access_control_list', sa.PickleType(), nullable=True))
+    op.create_index(op.f('ix_item_access_control_list'), 'item', ['access_control_list'], unique=False)
+
+    connection = op.get_bind()
+    for rows in chunks(connection, [item.c.id, item.c.acl_mask]):
+        connection.execute(
+            item.update()
+            .where(item.c.id == sa.bindparam('_id'))
+            .values(access_control_list=sa.bindparam('_acl', type_=sa.PickleType)),
+            [
+                {
+                    '_id': row.id,
+                    '_acl': [
+                        Role(value)
+                        for value, bit in ROLE_BITS.items()
+                        if row.acl_mask & bit
+                    ],
+                }
+                for row in rows
+            ],
+        )
+
+    op.drop_index(op.f('ix_item_acl_mask'), table_name='item')
+    op.drop_column('item', 'acl_mask')
@@ -1,13 +1,51 @@
 import json
+import re
 import unittest
 from datetime import date
 
-from app import create_app, db
+from app import (
+    create_app,
+    db,
+    epoch_cache,
+    hash_pool,
+    image_store,
+    login_cache,
+    mail,
+    mail_queue,
+    token_cache,
+)
 from app.models import User, Role, Borrowing, Item
 from datetime import datetime, timedelta
 import base64
 import os
 from config import Config
+from werkzeug.security import generate_password_hash
+from sqlalchemy import event
+from flask import url_for
+from app.links import url_for_id
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+from unittest import mock
+from app.reminders import (
+    collect_digests,
+    expiring_items,
+    mark_reminded,
+    overdue_borrowings,
+)
+from app.analytics import rebuild_usages
+from app.models import ItemUsage, UserUsage
+from app import dashboard_cache, power_cache
+from app.inventory import import_items
+from app.email import send_email
+import socketserver
+import threading
+from flask_mail import Message
+from PIL import Image
+import io
+import shutil
+import glob
+import hashlib
+import random
 
 
 class TestConfig(Config):
@@ -22,8 +60,10 @@ class TestConfig(Config):
 class AppCase(unittest.TestCase):
     """Test case to be used by all classes testing Flask app module"""
 
+    config_class = TestConfig
+
     def setUp(self):
-        self.app = create_app(TestConfig)
+        self.app = create_app(self.config_class)
         self.app_context = self.app.app_context()
         self.app_context.push()
         self.client = self.app.test_client()
@@ -35,6 +75,23 @@ class AppCase(unittest.TestCase):
         self.app_context.pop()
 
 
+class QueryCounter(object):
+    """Context manager counting the SQL statements executed by the database engine"""
+
+    def __init__(self):
+        self.count = 0
+
+    def _increment(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, "before_cursor_execute", self._increment)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(db.engine, "before_cursor_execute", self._increment)
+
+
 class UserModelCase(AppCase):
     def test_password_hashing(self):
         u = User(username="robb", email="robb@example.com", sciper=123456)
@@ -61,6 +118,8 @@ class UserModelCase(AppCase):
         self.assertEqual(u.get_roles(), [Role.REUF_ADMIN])
         self.assertTrue(u.has_one_of_roles([Role.REUF_ADMIN, Role.REUF]))
         self.assertFalse(u.has_one_of_roles([Role.REUF]))
+        self.assertEqual(Role.from_mask(Role.to_mask([Role.REUF_ADMIN])), u.roles)
+        self.assertEqual(Role.masks_with_one_of([Role.REUF]), [1, 3])
         self.assertRaises(TypeError, u.has_one_of_roles, ["reuf"])
         self.assertRaises(
             TypeError, u.has_one_of_roles, [Role.REUF_ADMIN, Role.REUF, Role.REUF]
@@ -132,6 +191,40 @@ class UserModelCase(AppCase):
         u.revoke_token()
         self.assertIsNone(u.check_token(t))
 
+    def test_token_cache(self):
+        u = User(username="robb", email="tom.demont+example@epfl.ch")
+        db.session.add(u)
+        t = u.get_token()
+        db.session.commit()
+        # first verification goes to the database, the next ones hit the cache
+        self.assertEqual(User.check_token(t), u)
+        self.assertEqual(token_cache.stats()["misses"], 1)
+        user_id = u.id
+        db.session.remove()
+        cached = User.check_token(t)
+        self.assertEqual(cached.id, user_id)
+        self.assertEqual(cached.username, "robb")
+        self.assertEqual(token_cache.stats()["hits"], 1)
+        # revoking drops the entry immediately, even before committing
+        snapshot = token_cache.get(t)
+        cached.revoke_token()
+        self.assertIsNone(User.check_token(t))
+        # and again on commit, in case another request cached the token meanwhile
+        token_cache.set(t, snapshot)
+        db.session.commit()
+        self.assertIsNone(token_cache.get(t))
+        # rotating invalidates the previous token
+        u = User.query.get(user_id)
+        t2 = u.get_token()
+        db.session.commit()
+        self.assertEqual(User.check_token(t2), u)
+        self.assertIsNone(User.check_token(t))
+        # modifying the user drops its cached copy
+        u.username = "robby"
+        db.session.commit()
+        self.assertEqual(len(token_cache), 0)
+        self.assertEqual(User.check_token(t2).username, "robby")
+
     def test_borrowing(self):
         u = User(username="john", email="reuf@example.com")
 
@@ -324,7 +417,108 @@ class UserModelCase(AppCase):
         )
 
 
-class UserRoutesCase(AppCase):
+class LinksCase(AppCase):
+    ENDPOINTS = [
+        "api.get_user",
+        "api.update_user",
+        "api.delete_user",
+        "api.revoke_token",
+        "api.get_borrowings_for_user",
+        "api.get_borrowings_with_item",
+        "api.get_borrowing",
+        "api.get_item",
+        "api.get_item_image",
+        "api.update_item",
+        "api.update_item_image",
+        "api.delete_item",
+    ]
+
+    def assert_same_urls(self):
+        for endpoint in self.ENDPOINTS:
+            for id in [1, 42, 123456789]:
+                self.assertEqual(url_for_id(endpoint, id), url_for(endpoint, id=id))
+
+    def test_url_for_id(self):
+        # absolute urls outside of requests
+        self.assert_same_urls()
+        # relative urls within requests, also when served under a script root
+        with self.app.test_request_context("/api/users"):
+            self.assert_same_urls()
+        for base_url in ["http://localhost.local/treuf", "http://other/treuf"]:
+            with self.app.test_request_context("/api/users", base_url=base_url):
+                self.assert_same_urls()
+        with self.app.test_request_context(
+            "/api/users", base_url="http://localhost.local/treuf"
+        ):
+            self.assertEqual(url_for_id("api.get_user", 3), "/treuf/api/users/3")
+
+
+class SignedTokenConfig(TestConfig):
+    TOKEN_SIGNED = True
+
+
+class SignedTokenCase(AppCase):
+    config_class = SignedTokenConfig
+
+    def test_signed_tokens(self):
+        u = User(username="robb", email="tom.demont+example@epfl.ch")
+        db.session.add(u)
+        db.session.commit()
+        u.from_dict({"roles": ["reuf"]})
+        db.session.commit()
+        t = u.get_token()
+        self.assertIsNone(u.token)
+        user_id = u.id
+        db.session.remove()
+        # the first check reads the epochs, the next ones do not
+        checked = User.check_token(t)
+        self.assertEqual(checked.id, user_id)
+        self.assertEqual(checked.get_roles(), [Role.REUF])
+        self.assertEqual(checked.username, "robb")
+        db.session.remove()
+        User.check_token(t)
+        # user and global epochs
+        self.assertEqual(epoch_cache.stats()["hits"], 2)
+        # tampered tokens are refused
+        self.assertIsNone(User.check_token(t[:-2] + "xx"))
+        self.assertIsNone(User.check_token("abc"))
+        # expired tokens are refused
+        u = User.query.get(user_id)
+        self.assertIsNone(User.check_token(u.get_token(expires_in=-1)))
+        # changing the roles invalidates the token
+        u.from_dict({"roles": ["reuf_admin"]})
+        db.session.commit()
+        self.assertIsNone(User.check_token(t))
+        u = User.query.get(user_id)
+        t = u.get_token()
+        self.assertEqual(User.check_token(t).get_roles(), [Role.REUF_ADMIN])
+        # revoking invalidates the token, even before committing
+        u.revoke_token()
+        self.assertIsNone(User.check_token(t))
+        # the epoch read by another request before the commit is dropped too
+        epoch_cache.set(user_id, u.token_epoch - 1)
+        db.session.commit()
+        self.assertIsNone(epoch_cache.get(user_id))
+        self.assertIsNone(User.check_token(t))
+        # revoking every token at once
+        u = User.query.get(user_id)
+        t = u.get_token()
+        self.assertIsNotNone(User.check_token(t))
+        User.revoke_all_tokens()
+        db.session.commit()
+        self.assertIsNone(User.check_token(t))
+        self.assertIsNotNone(User.check_token(User.query.get(user_id).get_token()))
+        # deleted users cannot use their tokens anymore
+        u = User.query.get(user_id)
+        t = u.get_token()
+        db.session.delete(u)
+        db.session.commit()
+        self.assertIsNone(User.check_token(t))
+
+
+class RoutesCase(AppCase):
+    """Test case with an admin user robb:1234 and a simple user john:4567"""
+
     def setUp(self):
         super().setUp()
         # adds test users
@@ -368,6 +562,8 @@ class UserRoutesCase(AppCase):
             return response["token"]
         raise ValueError("invalid credentials")
 
+
+class UserRoutesCase(RoutesCase):
     def test_basic_auth(self):
         creds = base64.b64encode(b"robb:1234").decode("utf-8")
         self.assertTrue(
@@ -384,6 +580,49 @@ class UserRoutesCase(AppCase):
         )
         self.assertEqual(response.status_code, 401)
 
+    def test_login_cache(self):
+        creds = {"Authorization": "Basic " + base64.b64encode(b"robb:1234").decode()}
+        self.assertEqual(
+            self.client.post("/api/tokens", headers=creds).status_code, 200
+        )
+        self.assertEqual(login_cache.stats()["misses"], 1)
+        self.assertEqual(
+            self.client.post("/api/tokens", headers=creds).status_code, 200
+        )
+        self.assertEqual(login_cache.stats()["hits"], 1)
+        # a password change invalidates the cached credentials
+        u = User.query.filter_by(username="robb").first()
+        u.set_password("5678")
+        db.session.commit()
+        self.assertEqual(
+            self.client.post("/api/tokens", headers=creds).status_code, 401
+        )
+
+    def test_password_rehash(self):
+        u = User.query.filter_by(username="john").first()
+        u.password_hash = generate_password_hash("4567", method="pbkdf2:sha256:1000")
+        db.session.commit()
+        self.assertTrue(u.password_needs_rehash())
+        self.get_token("john:4567")
+        u = User.query.filter_by(username="john").first()
+        self.assertFalse(u.password_needs_rehash())
+        self.assertTrue(u.check_password("4567"))
+
+    def test_hashing_pool_full(self):
+        # takes every slot of the pool, as if it were busy with other logins
+        slots = hash_pool.max_workers + hash_pool.queue_depth
+        for _ in range(slots):
+            hash_pool._slots.acquire()
+        creds = {"Authorization": "Basic " + base64.b64encode(b"robb:1234").decode()}
+        self.assertEqual(
+            self.client.post("/api/tokens", headers=creds).status_code, 503
+        )
+        for _ in range(slots):
+            hash_pool._slots.release()
+        self.assertEqual(
+            self.client.post("/api/tokens", headers=creds).status_code, 200
+        )
+
     def test_delete_token(self):
         token = self.get_token()
         response = self.client.delete(
@@ -403,6 +642,10 @@ class UserRoutesCase(AppCase):
         )
         self.assertEqual(response.status_code, 204)
         self.assertTrue(all([User.check_token(t) is None for t in tokens]))
+        # a new token is issued after a global revocation
+        token = self.get_token()
+        self.assertNotIn(token, tokens)
+        self.assertIsNotNone(User.check_token(token))
 
     def test_create_user(self):
         response = self.client.post(
@@ -466,6 +709,33 @@ class UserRoutesCase(AppCase):
         )
         self.assertEqual(User.query.get(2).roles, [Role.REUF])
 
+    def test_get_users_by_role(self):
+        token = self.get_token()
+        response = self.client.get(
+            "/api/users?role=reuf_admin", headers={"Authorization": "Bearer " + token}
+        )
+        data = json.loads(response.data.decode())
+        self.assertEqual([e["username"] for e in data["elements"]], ["robb"])
+        self.assertEqual(data["_meta"]["total_elements"], 1)
+        self.assertTrue(data["_links"]["self"].endswith("role=reuf_admin"))
+        response = self.client.get(
+            "/api/users?role=reuf", headers={"Authorization": "Bearer " + token}
+        )
+        self.assertEqual(json.loads(response.data.decode())["elements"], [])
+        response = self.client.get(
+            "/api/users?role=reuf&role=reuf_admin",
+            headers={"Authorization": "Bearer " + token},
+        )
+        self.assertEqual(len(json.loads(response.data.decode())["elements"]), 1)
+        response = self.client.get(
+            "/api/users?role=king", headers={"Authorization": "Bearer " + token}
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            "/api/users", headers={"Authorization": "Bearer " + token}
+        )
+        self.assertEqual(len(json.loads(response.data.decode())["elements"]), 2)
+
     def test_delete_user(self):
         self.client.post(
             "/api/users",
@@ -487,5 +757,2032 @@ class UserRoutesCase(AppCase):
         self.assertIsNone(User.query.filter_by(username="bobby").first())
 
 
+class ItemRoutesCase(RoutesCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(10):
+            item = Item(name=f"item {i}", quantity=i)
+            # one item in two requires being a reuf_admin, the last one also a reuf
+            if i % 2:
+                item.access_control_list = [Role.REUF_ADMIN]
+            if i == 9:
+                item.access_control_list = [Role.REUF_ADMIN, Role.REUF]
+            db.session.add(item)
+        db.session.commit()
+
+    def test_accessible_query(self):
+        for roles in [[], [Role.REUF], [Role.REUF_ADMIN], [Role.REUF, Role.REUF_ADMIN]]:
+            self.assertEqual(
+                Item.accessible_query(roles).order_by(Item.id).all(),
+                [
+                    i
+                    for i in Item.query.order_by(Item.id)
+                    if i.accessible_by_roles(roles)
+                ],
+            )
+        self.assertEqual(Item.accessible_query([Role.REUF_ADMIN]).count(), 9)
+
+    def test_get_items(self):
+        admin = {"Authorization": "Bearer " + self.get_token()}
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        data = self.client.get("/api/items/?per_page=4", headers=user).get_json()
+        self.assertEqual(
+            [e["name"] for e in data["elements"]],
+            ["item 0", "item 2", "item 4", "item 6"],
+        )
+        self.assertEqual(data["_meta"]["total_elements"], 5)
+        self.assertEqual(data["_meta"]["total_pages"], 2)
+        self.assertNotIn("value", data["elements"][0])
+        data = self.client.get("/api/items/?page=3&per_page=4", headers=admin)
+        data = data.get_json()
+        self.assertEqual([e["name"] for e in data["elements"]], ["item 8"])
+        self.assertEqual(data["_meta"]["total_elements"], 9)
+        self.assertEqual(data["elements"][0]["access_control_list"], [])
+        self.assertEqual(self.client.get("/api/items/1", headers=user).status_code, 200)
+        self.assertEqual(self.client.get("/api/items/2", headers=user).status_code, 404)
+        self.assertEqual(
+            self.client.get("/api/items/2", headers=admin).status_code, 200
+        )
+
+    def test_filters_and_facets(self):
+        for i, item in enumerate(Item.query.order_by(Item.id)):
+            item.location = "A1" if i < 5 else "B2"
+            item.condition = "damaged" if i % 3 == 0 else "good"
+            item.needs_cleaning = i % 2 == 0
+            item.expiry_date = date(2030, 1, 1 + i)
+        db.session.commit()
+        admin = {"Authorization": "Bearer " + self.get_token()}
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+
+        def names(data):
+            return [e["name"] for e in data["elements"]]
+
+        url = "/api/items/?location=A1&per_page=3&facets=1"
+        self.client.get(url, headers=admin)  # caches the token
+        with QueryCounter() as with_facets:
+            data = self.client.get(url, headers=admin).get_json()
+        with QueryCounter() as without_facets:
+            self.client.get(url[:-9], headers=admin)
+        # every facet is counted by one statement
+        self.assertEqual(with_facets.count, without_facets.count + 1)
+        self.assertEqual(names(data), ["item 0", "item 1", "item 2"])
+        self.assertEqual(data["_meta"]["total_elements"], 5)
+        self.assertIn("location=A1", data["_links"]["next"])
+        facets = data["_facets"]
+        # the location facet ignores the location filter, item 9 is not accessible
+        self.assertEqual(
+            facets["location"],
+            [{"value": "A1", "count": 5}, {"value": "B2", "count": 4}],
+        )
+        self.assertEqual(
+            facets["condition"],
+            [{"value": "good", "count": 3}, {"value": "damaged", "count": 2}],
+        )
+        self.assertEqual(
+            facets["needs_cleaning"],
+            [{"value": True, "count": 3}, {"value": False, "count": 2}],
+        )
+        self.assertEqual(facets["box_name"], [{"value": None, "count": 5}])
+        # filters compose, repeated facets accept several values
+        url = "/api/items/?location=A1&condition=damaged&condition=good"
+        url += "&needs_cleaning=false"
+        data = self.client.get(url, headers=admin).get_json()
+        self.assertEqual(names(data), ["item 1", "item 3"])
+        url = "/api/items/?expires_after=2030-01-03&expires_before=2030-01-05"
+        data = self.client.get(url, headers=admin).get_json()
+        self.assertEqual(names(data), ["item 2", "item 3", "item 4"])
+        # users only see and filter the facets of the fields they can see
+        url = "/api/items/?condition=damaged&facets=1"
+        data = self.client.get(url, headers=user).get_json()
+        self.assertEqual(names(data), ["item 0", "item 6"])
+        self.assertEqual(list(data["_facets"]), ["condition"])
+        for url in [
+            "/api/items/?location=A1",
+            "/api/items/?needs_cleaning=yes",
+            "/api/items/?expires_after=tomorrow",
+        ]:
+            headers = user if "location" in url else admin
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_search(self):
+        item = Item.query.get(1)
+        item.description = "XLR cable for microphones"
+        item = Item.query.get(2)
+        item.remarks = "cable missing"
+        db.session.add(Item(name="xlr adapter", description="3 pin Éclair"))
+        db.session.commit()
+        admin = {"Authorization": "Bearer " + self.get_token()}
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+
+        def search(q, headers=admin):
+            response = self.client.get(f"/api/items/search?q={q}", headers=headers)
+            return [e["name"] for e in response.get_json()["elements"]]
+
+        # matches in the name rank first, then the description, then the remarks.
+        # Prefixes and accents are matched.
+        self.assertEqual(search("xlr"), ["xlr adapter", "item 0"])
+        self.assertEqual(search("cab"), ["item 0", "item 1"])
+        self.assertEqual(search("micro XLR"), ["item 0"])
+        self.assertEqual(search("eclair"), ["xlr adapter"])
+        # items requiring other roles are not found
+        self.assertEqual(search("cab", user), ["item 0"])
+        data = self.client.get("/api/items/search?q=item&per_page=2", headers=user)
+        data = data.get_json()
+        self.assertEqual(data["_meta"]["total_elements"], 5)
+        self.assertIn("q=item", data["_links"]["next"])
+        # the index follows the modifications of the items
+        item = Item.query.get(1)
+        item.description = "jack cable"
+        db.session.commit()
+        self.assertEqual(search("xlr"), ["xlr adapter"])
+        self.assertEqual(search("jack"), ["item 0"])
+        db.session.delete(item)
+        db.session.commit()
+        self.assertEqual(search("cable"), ["item 1"])
+        response = self.client.get("/api/items/search?q=%20-", headers=admin)
+        self.assertEqual(response.status_code, 400)
+
+    def test_availability(self):
+        item = Item.query.filter_by(name="item 8").first()
+        item.quantity = 10
+        d = date(2030, 1, 1)
+        for start, end, quantity in [(0, 3, 4), (2, 5, 3), (4, 9, 5), (6, 6, 2)]:
+            db.session.add(
+                Borrowing(
+                    user_id=1,
+                    item_id=item.id,
+                    borrowing_date=d + timedelta(days=start),
+                    return_date=d + timedelta(days=end),
+                    borrowed_quantity=quantity,
+                )
+            )
+        db.session.commit()
+        # day 2 and 3: 4 + 3, day 4 and 5: 3 + 5, day 6: 5 + 2
+        self.assertEqual(Item.peak_usages(None, d, d + timedelta(days=9)), {9: 8})
+        self.assertEqual(Item.peak_usages([9], d, d + timedelta(days=1)), {9: 4})
+        self.assertEqual(
+            Item.peak_usages([9], d + timedelta(days=6), d + timedelta(days=6)), {9: 7}
+        )
+        self.assertEqual(Item.peak_usages([9], d - timedelta(days=9), d), {9: 4})
+        self.assertEqual(Item.peak_usages([9, 1], d + timedelta(days=10), d), {})
+        self.assertEqual(item.available_quantity(d, d + timedelta(days=3)), 3)
+        # borrowing checks the availability
+        u = User.query.get(2)
+        u.borrow(item, d + timedelta(days=2), d + timedelta(days=2), 3)
+        self.assertRaises(
+            ValueError, u.borrow, item, d + timedelta(days=2), d + timedelta(days=2), 4
+        )
+        u.borrow(item, d + timedelta(days=10), d + timedelta(days=12), 10)
+
+        admin = {"Authorization": "Bearer " + self.get_token()}
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        response = self.client.get(
+            "/api/items/9/availability?from=2030-01-05&to=2030-01-07", headers=admin
+        )
+        self.assertEqual(
+            response.get_json(),
+            {
+                "id": 9,
+                "from": "2030-01-05",
+                "to": "2030-01-07",
+                "quantity": 10,
+                "in_use": 8,
+                "available": 2,
+            },
+        )
+        response = self.client.get(
+            "/api/items/10/availability?from=2030-01-05&to=2030-01-07", headers=user
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            "/api/items/9/availability?from=2030-01-07&to=2030-01-05", headers=admin
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            "/api/items/availability?from=2030-01-01&to=2030-01-03&id=9&id=1",
+            headers=admin,
+        )
+        self.assertEqual(
+            [(e["id"], e["in_use"]) for e in response.get_json()["elements"]],
+            [(1, 0), (9, 7)],
+        )
+        response = self.client.get(
+            "/api/items/availability?from=2030-01-01&to=2030-01-03", headers=user
+        )
+        self.assertEqual(len(response.get_json()["elements"]), 5)
+
+    def test_calendar(self):
+        d = date(2030, 1, 1)
+        for item_id, start, end, quantity in [
+            (9, 0, 3, 4),
+            (9, 2, 5, 3),
+            (9, 4, 9, 5),
+            (9, 6, 6, 2),
+            (1, -5, 1, 1),
+            (2, 9, 12, 2),
+        ]:
+            db.session.add(
+                Borrowing(
+                    user_id=1,
+                    item_id=item_id,
+                    borrowing_date=d + timedelta(days=start),
+                    return_date=d + timedelta(days=end),
+                    borrowed_quantity=quantity,
+                )
+            )
+        db.session.commit()
+        self.assertEqual(
+            Item.daily_usages(None, d, d + timedelta(days=9)),
+            {
+                1: [1, 1, 0, 0, 0, 0, 0, 0, 0, 0],
+                2: [0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
+                9: [4, 4, 7, 7, 8, 8, 7, 5, 5, 5],
+            },
+        )
+        self.assertEqual(
+            Item.daily_usages([9], d + timedelta(days=8), d + timedelta(days=11)),
+            {9: [5, 5, 0, 0]},
+        )
+        # the peaks of the calendar are the ones of the availability
+        usages = Item.daily_usages(None, d - timedelta(days=9), d + timedelta(days=20))
+        self.assertEqual(
+            {id: max(days) for id, days in usages.items()},
+            Item.peak_usages(None, d - timedelta(days=9), d + timedelta(days=20)),
+        )
+
+        admin = {"Authorization": "Bearer " + self.get_token()}
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        response = self.client.get(
+            "/api/calendar?from=2030-01-01&to=2030-01-10", headers=admin
+        )
+        self.assertEqual(
+            response.get_json(),
+            {
+                "from": "2030-01-01",
+                "to": "2030-01-10",
+                "elements": [
+                    {
+                        "id": 1,
+                        "name": "item 0",
+                        "quantity": 0,
+                        "in_use": [[0, 1], [2, 0]],
+                    },
+                    {
+                        "id": 2,
+                        "name": "item 1",
+                        "quantity": 1,
+                        "in_use": [[0, 0], [9, 2]],
+                    },
+                    {
+                        "id": 9,
+                        "name": "item 8",
+                        "quantity": 8,
+                        "in_use": [[0, 4], [2, 7], [4, 8], [6, 7], [7, 5]],
+                    },
+                ],
+            },
+        )
+        # item 1 requires being a reuf_admin
+        response = self.client.get(
+            "/api/calendar?from=2030-01-01&to=2030-01-10", headers=user
+        )
+        self.assertEqual([e["id"] for e in response.get_json()["elements"]], [1, 9])
+        response = self.client.get(
+            "/api/calendar?from=2030-01-01&to=2030-01-10&id=9&id=3", headers=admin
+        )
+        self.assertEqual([e["id"] for e in response.get_json()["elements"]], [9])
+        for window in ["from=2030-01-10&to=2030-01-01", "from=2030-01-01"]:
+            response = self.client.get("/api/calendar?" + window, headers=admin)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            "/api/calendar?from=2030-01-01&to=2031-01-02", headers=admin
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            "/api/calendar?from=2030-01-01&to=2030-12-31", headers=admin
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_calendar_of_a_semester(self):
+        # a whole inventory borrowed all along a semester
+        random.seed(0)
+        d = date(2031, 2, 17)
+        db.session.execute(
+            Item.__table__.insert(),
+            [{"name": f"gear {i}", "quantity": 50} for i in range(2000)],
+        )
+        rows = []
+        for _ in range(30000):
+            start = d + timedelta(days=random.randrange(-10, 130))
+            rows.append(
+                {
+                    "user_id": 2,
+                    "item_id": random.randrange(11, 2011),
+                    "borrowing_date": start,
+                    "return_date": start + timedelta(days=random.randrange(7)),
+                    "borrowed_quantity": random.randrange(1, 4),
+                }
+            )
+        db.session.execute(Borrowing.__table__.insert(), rows)
+        db.session.commit()
+        admin = {"Authorization": "Bearer " + self.get_token()}
+        # the statements do not depend on the window or the number of borrowings,
+        # once the token is cached
+        self.client.get("/api/calendar?from=2031-01-01&to=2031-01-01", headers=admin)
+        counts = []
+        for window in [
+            "from=2031-02-17&to=2031-02-17",
+            "from=2031-02-17&to=2031-06-15",
+        ]:
+            with QueryCounter() as counter:
+                response = self.client.get("/api/calendar?" + window, headers=admin)
+            counts.append(counter.count)
+        # one for the borrowings, one for the items
+        self.assertEqual(counts, [2, 2])
+        # every item, checked day by day against the seeded rows
+        expected = {}
+        for r in rows:
+            days = expected.setdefault(r["item_id"], [0] * 119)
+            for offset in range(
+                max((r["borrowing_date"] - d).days, 0),
+                min((r["return_date"] - d).days + 1, 119),
+            ):
+                days[offset] += r["borrowed_quantity"]
+        elements = response.get_json()["elements"]
+        self.assertEqual(
+            [e["id"] for e in elements], sorted(i for i in expected if any(expected[i]))
+        )
+        for element in elements:
+            days = [0] * 119
+            for day, in_use in element["in_use"]:
+                days[day:] = [in_use] * (119 - day)
+            self.assertEqual(days, expected[element["id"]])
+
+
+class BorrowingRoutesCase(RoutesCase):
+    def setUp(self):
+        super().setUp()
+        item = Item(name="treuficelle", quantity=100)
+        db.session.add(item)
+        db.session.commit()
+        # a few borrowings share their timestamp, the id breaks the ties
+        now = datetime.utcnow()
+        for i in range(25):
+            db.session.add(
+                Borrowing(
+                    user_id=2,
+                    item_id=item.id,
+                    timestamp=now - timedelta(minutes=i // 3),
+                    borrowing_date=date.today(),
+                    return_date=date.today(),
+                    borrowed_quantity=1,
+                )
+            )
+        db.session.commit()
+
+    def test_borrowing_histories(self):
+        admin = {"Authorization": "Bearer " + self.get_token()}
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        expected = [
+            b.id
+            for b in Borrowing.query.order_by(
+                Borrowing.timestamp.desc(), Borrowing.id.desc()
+            )
+        ]
+        for url, headers in [
+            ("/api/borrowings/for_user/2?per_page=10", admin),
+            ("/api/borrowings/for_user/2?per_page=10", user),
+            ("/api/borrowings/with_item/1?per_page=10", admin),
+            ("/api/borrowings/with_item/1?per_page=10", user),
+        ]:
+            ids = []
+            while url:
+                data = self.client.get(url, headers=headers).get_json()
+                ids += [e["id"] for e in data["elements"]]
+                url = data["_links"]["next"]
+            self.assertEqual(ids, expected)
+        self.assertEqual(
+            self.client.get("/api/borrowings/for_user/1", headers=user).status_code,
+            401,
+        )
+        for url in ["/api/borrowings/for_user/1000", "/api/borrowings/with_item/1000"]:
+            self.assertEqual(self.client.get(url, headers=admin).status_code, 404)
+        data = self.client.get(
+            "/api/borrowings/for_user/1?with_total=1", headers=admin
+        ).get_json()
+        self.assertEqual((data["elements"], data["_meta"]["total_elements"]), ([], 0))
+        response = self.client.get(
+            "/api/borrowings/for_user/2?cursor=invalid", headers=admin
+        )
+        self.assertEqual(response.status_code, 400)
+        # pages hold at least one borrowing
+        for url in [
+            "/api/borrowings/for_user/2?per_page=0",
+            "/api/borrowings/with_item/1?per_page=-1",
+        ]:
+            data = self.client.get(url, headers=admin).get_json()
+            self.assertEqual([e["id"] for e in data["elements"]], expected[:1])
+        # users only see their own borrowings of an item
+        db.session.add(
+            Borrowing(
+                user_id=1,
+                item_id=1,
+                borrowing_date=date.today(),
+                return_date=date.today(),
+                borrowed_quantity=1,
+            )
+        )
+        db.session.commit()
+        for headers, total in [(admin, 26), (user, 25)]:
+            data = self.client.get(
+                "/api/borrowings/with_item/1?with_total=1", headers=headers
+            ).get_json()
+            self.assertEqual(data["_meta"]["total_elements"], total)
+        item = db.session.get(Item, 1)
+        self.assertEqual(
+            [u.username for u in item.get_borrowers()][:2], ["robb", "john"]
+        )
+
+    def test_history_plans(self):
+        admin = {"Authorization": "Bearer " + self.get_token()}
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, many):
+            if re.search(r"FROM borrowing\b", statement):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        for url in ["/api/borrowings/for_user/2", "/api/borrowings/with_item/1"]:
+            data = self.client.get(url + "?per_page=5", headers=admin).get_json()
+            self.client.get(data["_links"]["next"], headers=admin)
+        event.remove(db.engine, "before_cursor_execute", record)
+
+        def plan(statement, parameters):
+            rows = db.session.connection().exec_driver_sql(
+                "EXPLAIN QUERY PLAN " + statement, parameters
+            )
+            return " ".join(r[-1] for r in rows)
+
+        pages = [s for s in statements if "LIMIT" in s[0]]
+        self.assertEqual(len(pages), 4)
+        for (statement, parameters), index in zip(
+            pages, ["user_id", "user_id", "item_id", "item_id"]
+        ):
+            details = plan(statement, parameters)
+            # read in the order of the index, without scanning or sorting
+            self.assertIn(f"USING INDEX ix_borrowing_{index}_timestamp", details)
+            self.assertNotIn("TEMP B-TREE", details)
+        # no statement reading the borrowings scans the whole table
+        for statement, parameters in statements:
+            details = plan(statement, parameters)
+            self.assertNotRegex(details, r"SCAN borrowing\b(?! USING)", statement)
+
+    def test_cursor_pagination(self):
+        headers = {"Authorization": "Bearer " + self.get_token()}
+        expected = [
+            b.id
+            for b in Borrowing.query.order_by(
+                Borrowing.timestamp.desc(), Borrowing.id.desc()
+            )
+        ]
+        ids = []
+        url = "/api/borrowings/?cursor=&per_page=10"
+        while url:
+            data = self.client.get(url, headers=headers).get_json()
+            self.assertNotIn("total_elements", data["_meta"])
+            ids += [e["id"] for e in data["elements"]]
+            url = data["_links"]["next"]
+        self.assertEqual(ids, expected)
+        data = self.client.get(
+            "/api/borrowings/?cursor=&with_total=1", headers=headers
+        ).get_json()
+        self.assertEqual(data["_meta"]["total_elements"], 25)
+        # the page number mode is still available
+        data = self.client.get(
+            "/api/borrowings/?page=3&per_page=10", headers=headers
+        ).get_json()
+        self.assertEqual([e["id"] for e in data["elements"]], expected[20:])
+        response = self.client.get("/api/borrowings/?cursor=abc", headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            "/api/borrowings/?cursor=",
+            headers={"Authorization": "Bearer " + self.get_token("john:4567")},
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_collection_query_count(self):
+        query = Borrowing.query.order_by(Borrowing.timestamp.desc(), Borrowing.id)
+        for per_page in [1, 5, 25]:
+            db.session.expunge_all()
+            with QueryCounter() as counter:
+                data = Borrowing.to_collection_dict(
+                    query, 1, per_page, "api.get_borrowings", True
+                )
+            self.assertEqual(len(data["elements"]), per_page)
+            # one query for the page and one for the total
+            self.assertEqual(counter.count, 2)
+            db.session.expunge_all()
+            with QueryCounter() as counter:
+                Borrowing.to_cursor_collection_dict(
+                    Borrowing.query,
+                    [Borrowing.timestamp, Borrowing.id],
+                    None,
+                    per_page,
+                    "api.get_borrowings",
+                    True,
+                )
+            self.assertEqual(counter.count, 1)
+
+    def test_stream(self):
+        headers = {"Authorization": "Bearer " + self.get_token()}
+        expected = self.client.get(
+            "/api/borrowings/?per_page=100", headers=headers
+        ).get_json()["elements"]
+        response = self.client.get("/api/borrowings/?stream=1", headers=headers)
+        self.assertTrue(response.is_streamed)
+        data = json.loads(response.data)
+        self.assertEqual(data["elements"], expected)
+        self.assertEqual(data["_meta"]["total_elements"], 25)
+        # elements are written in several batches
+        with self.app.test_request_context():
+            query = Borrowing.query.order_by(
+                Borrowing.timestamp.desc(), Borrowing.id.desc()
+            )
+            response = Borrowing.to_collection_stream(query, True, batch_size=10)
+            data = json.loads(b"".join(response.response))
+        self.assertEqual(
+            [e["id"] for e in data["elements"]], [e["id"] for e in expected]
+        )
+        # dates are encoded in ISO format in both modes
+        item = data["elements"][0]["item"]
+        self.assertEqual(item["expiry_date"], None)
+        Item.query.first().expiry_date = date(2024, 1, 22)
+        db.session.commit()
+        response = self.client.get("/api/items/?stream=1", headers=headers)
+        self.assertEqual(
+            json.loads(response.data)["elements"][0]["expiry_date"], "2024-01-22"
+        )
+        response = self.client.get("/api/items/1", headers=headers)
+        self.assertEqual(response.get_json()["expiry_date"], "2024-01-22")
+        # an empty collection is still a valid document
+        response = self.client.get("/api/users?stream=1&role=reuf", headers=headers)
+        self.assertEqual(
+            json.loads(response.data), {"elements": [], "_meta": {"total_elements": 0}}
+        )
+
+    def test_users_cursor_pagination(self):
+        headers = {"Authorization": "Bearer " + self.get_token()}
+        data = self.client.get(
+            "/api/users?cursor=&per_page=1", headers=headers
+        ).get_json()
+        self.assertEqual([e["id"] for e in data["elements"]], [1])
+        data = self.client.get(data["_links"]["next"], headers=headers).get_json()
+        self.assertEqual([e["id"] for e in data["elements"]], [2])
+        self.assertIsNone(data["_links"]["next"])
+
+    def test_non_positive_per_page(self):
+        headers = {"Authorization": "Bearer " + self.get_token()}
+        # pages hold at least one element
+        for url in [
+            "/api/users?cursor=&per_page=0",
+            "/api/users?cursor=&per_page=-1",
+            "/api/borrowings/?cursor=&per_page=0",
+            "/api/borrowings/?page=1&per_page=-1",
+            "/api/items/?per_page=0",
+        ]:
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            self.assertEqual(data["_meta"]["per_page"], 1)
+            self.assertEqual(len(data["elements"]), 1)
+        with self.app.test_request_context():
+            for per_page in [0, -1]:
+                self.assertRaises(
+                    ValueError,
+                    User.to_cursor_collection_dict,
+                    User.query,
+                    [User.id],
+                    None,
+                    per_page,
+                    "api.get_users",
+                )
+
+    def test_borrow_item(self):
+        headers = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        tomorrow = date.today() + timedelta(days=1)
+        data = {
+            "borrowing_date": tomorrow.isoformat(),
+            "return_date": (tomorrow + timedelta(days=2)).isoformat(),
+            "borrowed_quantity": 60,
+        }
+        count = Borrowing.query.count()
+        for quantity in [True, 0, -1, "1", 1.5]:
+            response = self.client.post(
+                "/api/borrowings/borrow/1/2",
+                headers=headers,
+                json=dict(data, borrowed_quantity=quantity),
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Borrowing.query.count(), count)
+        response = self.client.post(
+            "/api/borrowings/borrow/1/2", headers=headers, json=data
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()["borrowed_quantity"], 60)
+        self.assertEqual(Item.query.get(1).version, 1)
+        # 40 units are left
+        response = self.client.post(
+            "/api/borrowings/borrow/1/2", headers=headers, json=data
+        )
+        self.assertEqual(response.status_code, 400)
+        data["borrowed_quantity"] = 40
+        response = self.client.post(
+            "/api/borrowings/borrow/1/2", headers=headers, json=data
+        )
+        self.assertEqual(response.status_code, 201)
+        # users cannot borrow for others
+        response = self.client.post(
+            "/api/borrowings/borrow/1/1", headers=headers, json=data
+        )
+        self.assertEqual(response.status_code, 401)
+        del data["return_date"]
+        response = self.client.post(
+            "/api/borrowings/borrow/1/2", headers=headers, json=data
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_claim_versions(self):
+        self.assertTrue(Item.claim_versions({1: 0}))
+        # the version read is outdated
+        self.assertFalse(Item.claim_versions({1: 0}))
+        self.assertTrue(Item.claim_versions({1: 1}))
+        db.session.commit()
+        self.assertEqual(Item.query.get(1).version, 2)
+
+    def test_checkout(self):
+        for i in range(20):
+            db.session.add(Item(name=f"cable {i}", quantity=5))
+        secret = Item(name="secret", quantity=5)
+        secret.access_control_list = [Role.REUF_ADMIN]
+        db.session.add(secret)
+        db.session.commit()
+        headers = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        tomorrow = date.today() + timedelta(days=1)
+        data = {
+            "borrowing_date": tomorrow.isoformat(),
+            "return_date": tomorrow.isoformat(),
+            "items": [{"id": 2, "quantity": 2}, {"id": 3}, {"id": 2, "quantity": 1}],
+        }
+        response = self.client.post(
+            "/api/borrowings/checkout/2", headers=headers, json=data
+        )
+        self.assertEqual(response.status_code, 201)
+        elements = response.get_json()["elements"]
+        self.assertEqual([e["item"]["id"] for e in elements], [2, 3])
+        self.assertEqual([e["borrowed_quantity"] for e in elements], [3, 1])
+        self.assertEqual(Item.query.get(2).version, 1)
+        # either every borrowing is created, or none
+        count = Borrowing.query.count()
+        for items in [
+            [{"id": 4}, {"id": 2, "quantity": 3}],  # only 2 units of item 2 left
+            [{"id": 4}, {"id": 1000}],
+            [{"id": 4}, {"id": secret.id}],
+            [{"id": 4, "quantity": 0}],
+            [{"id": 4, "quantity": True}],
+            [{"id": 4, "quantity": -1}, {"id": 4, "quantity": 2}],
+            [{"id": True}],
+            [{"id": "4"}],
+            [],
+        ]:
+            data["items"] = items
+            response = self.client.post(
+                "/api/borrowings/checkout/2", headers=headers, json=data
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Borrowing.query.count(), count)
+        # the number of queries does not depend on the number of items
+        counts = []
+        for ids in [range(4, 6), range(6, 22)]:
+            data["items"] = [{"id": i} for i in ids]
+            with QueryCounter() as counter:
+                response = self.client.post(
+                    "/api/borrowings/checkout/2", headers=headers, json=data
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.get_json()["elements"]), len(ids))
+            counts.append(counter.count)
+        self.assertEqual(counts[0], counts[1])
+
+
+class MailConfig(TestConfig):
+    MAIL_DEFAULT_SENDER = "treuf@example.com"
+
+
+class RemindersCase(RoutesCase):
+    config_class = MailConfig
+
+    def setUp(self):
+        super().setUp()
+        today = date.today()
+        tent = Item(name="tent", expiry_date=today + timedelta(days=3))
+        old_tent = Item(name="old tent", expiry_date=today + timedelta(days=60))
+        expired = Item(name="expired tent", expiry_date=today - timedelta(days=1))
+        db.session.add_all([tent, old_tent, expired])
+        db.session.commit()
+        for user_id, return_days in [(2, -1), (2, -30), (2, 1), (1, -2)]:
+            db.session.add(
+                Borrowing(
+                    user_id=user_id,
+                    item_id=tent.id,
+                    borrowing_date=today - timedelta(days=40),
+                    return_date=today + timedelta(days=return_days),
+                    borrowed_quantity=1,
+                )
+            )
+        db.session.commit()
+
+    def test_send_reminders(self):
+        runner = self.app.test_cli_runner()
+        with mail.record_messages() as outbox:
+            with mock.patch.object(mail, "connect", wraps=mail.connect) as connect:
+                result = runner.invoke(args=["send-reminders"])
+        self.assertEqual(result.output, "2 reminders sent\n")
+        # every mail is sent over the same SMTP session
+        self.assertEqual(connect.call_count, 1)
+        mails = {m.recipients[0]: m.body for m in outbox}
+        self.assertEqual(
+            sorted(mails), ["tom.demont+admin@epfl.ch", "tom.demont+john@epfl.ch"]
+        )
+        john = mails["tom.demont+john@epfl.ch"]
+        self.assertEqual(john.count("1 x tent"), 1)
+        self.assertNotIn("expires", john)
+        admin = mails["tom.demont+admin@epfl.ch"]
+        # their own borrowing, then both borrowings and the expiring item
+        self.assertEqual(admin.count("1 x tent"), 3)
+        self.assertIn("- tent (item 1, box None) expires on", admin)
+        self.assertNotIn("old tent", admin)
+        self.assertNotIn("expired tent", admin)
+        result = runner.invoke(args=["send-reminders", "--dry-run", "--expiry-days=90"])
+        self.assertIn("old tent", result.output)
+        result = runner.invoke(
+            args=["send-reminders", "--overdue-days=0", "--expiry-days=0"]
+        )
+        self.assertEqual(result.output, "0 reminders sent\n")
+
+    def test_reminders_are_not_repeated(self):
+        today = date.today()
+        # due today, overdue from tomorrow on
+        db.session.add(
+            Borrowing(
+                user_id=2,
+                item_id=2,
+                borrowing_date=today - timedelta(days=3),
+                return_date=today,
+                borrowed_quantity=2,
+            )
+        )
+        db.session.commit()
+        runner = self.app.test_cli_runner()
+        runner.invoke(args=["send-reminders", "--dry-run"])
+        self.assertEqual(Borrowing.query.filter_by(reminded_on=today).count(), 0)
+        with mail.record_messages() as outbox:
+            result = runner.invoke(args=["send-reminders"])
+        self.assertEqual(result.output, "2 reminders sent\n")
+        self.assertEqual(len(outbox), 2)
+        self.assertEqual(Borrowing.query.filter_by(reminded_on=today).count(), 2)
+        # the same day, only the expiring items are left for the reufs
+        digests = collect_digests(today, 30, 7)
+        self.assertEqual(list(digests), ["tom.demont+admin@epfl.ch"])
+        self.assertNotIn("to be returned", digests["tom.demont+admin@epfl.ch"][0])
+        # the next day, only the borrowing that became overdue
+        tomorrow = today + timedelta(days=1)
+        digests = collect_digests(tomorrow, 0, 7)
+        self.assertEqual(
+            digests["tom.demont+john@epfl.ch"],
+            [
+                "Your borrowings to be returned:",
+                f"- 2 x old tent, to be returned on {today.isoformat()}",
+            ],
+        )
+        self.assertEqual(
+            sum(
+                [
+                    "to be returned on" in line
+                    for line in digests["tom.demont+admin@epfl.ch"]
+                ]
+            ),
+            1,
+        )
+        self.assertEqual(mark_reminded(tomorrow, 7), 1)
+        self.assertEqual(collect_digests(tomorrow, 0, 7), {})
+
+    def test_reminders_use_indexes(self):
+        # the scans are ranges of indexes, they do not grow with the history
+        for query, index in [
+            (expiring_items(date.today(), 30), "ix_item_expiry_date"),
+            (overdue_borrowings(date.today(), 7), "ix_borrowing_return_date"),
+        ]:
+            sql = str(query.statement.compile(compile_kwargs={"literal_binds": True}))
+            plan = db.session.execute(db.text("EXPLAIN QUERY PLAN " + sql)).all()
+            self.assertIn(f"USING INDEX {index}", " ".join(r[-1] for r in plan))
+
+
+class AnalyticsCase(RoutesCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add_all(
+            [Item(name="tent", quantity=4), Item(name="stove"), Item(name="lamp")]
+        )
+        db.session.commit()
+        self.headers = {"Authorization": "Bearer " + self.get_token()}
+        # spans February, a leap one, and March
+        response = self.client.post(
+            "/api/borrowings/checkout/2",
+            json={
+                "borrowing_date": "2032-02-28",
+                "return_date": "2032-03-02",
+                "items": [{"id": 1, "quantity": 2}, {"id": 2}],
+            },
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            "/api/borrowings/borrow/1/1",
+            json={
+                "borrowing_date": "2032-03-10",
+                "return_date": "2032-03-10",
+                "borrowed_quantity": 1,
+            },
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def usages(self):
+        """Returns the non empty rows of the rollups"""
+        return [
+            (model.__name__, *row)
+            for model, key in [(ItemUsage, "item_id"), (UserUsage, "user_id")]
+            for row in db.session.query(
+                getattr(model, key),
+                model.month,
+                model.borrowings,
+                model.borrowed_quantity,
+                model.unit_days,
+            )
+            .order_by(getattr(model, key), model.month)
+            .all()
+            if any(row[2:])
+        ]
+
+    def assertRebuilt(self):
+        """Checks the rollups kept up to date are the ones of a rebuild"""
+        usages = self.usages()
+        rebuild_usages(chunk_size=2)
+        db.session.commit()
+        self.assertEqual(usages, self.usages())
+        return usages
+
+    def test_incremental_rollups(self):
+        self.assertEqual(
+            self.assertRebuilt(),
+            [
+                ("ItemUsage", 1, date(2032, 2, 1), 1, 2, 4),
+                ("ItemUsage", 1, date(2032, 3, 1), 1, 1, 5),
+                ("ItemUsage", 2, date(2032, 2, 1), 1, 1, 2),
+                ("ItemUsage", 2, date(2032, 3, 1), 0, 0, 2),
+                ("UserUsage", 1, date(2032, 3, 1), 1, 1, 1),
+                ("UserUsage", 2, date(2032, 2, 1), 2, 3, 6),
+                ("UserUsage", 2, date(2032, 3, 1), 0, 0, 6),
+            ],
+        )
+        borrowing = Borrowing.query.filter_by(item_id=2).one()
+        borrowing.borrowing_date = date(2032, 1, 31)
+        borrowing.borrowed_quantity = 3
+        db.session.commit()
+        self.assertRebuilt()
+        borrowing.remarks = "no change of the rollups"
+        db.session.commit()
+        self.assertRebuilt()
+        db.session.delete(Borrowing.query.filter_by(item_id=1, user_id=1).one())
+        db.session.commit()
+        self.assertRebuilt()
+        # the borrowings of deleted users and items are kept under the id 0
+        db.session.delete(db.session.get(User, 2))
+        db.session.delete(db.session.get(Item, 1))
+        db.session.commit()
+        usages = self.assertRebuilt()
+        self.assertIn(("ItemUsage", 0, date(2032, 2, 1), 1, 2, 4), usages)
+        self.assertIn(("UserUsage", 0, date(2032, 1, 1), 1, 3, 3), usages)
+
+    def test_analytics_routes(self):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, many):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        responses = [
+            self.client.get(
+                f"/api/analytics/{name}?from=2032-02&to=2032-03", headers=self.headers
+            )
+            for name in ["items", "borrowers", "monthly"]
+        ]
+        event.remove(db.engine, "before_cursor_execute", record)
+        # the analytics only read the rollups
+        self.assertFalse(
+            [s for s in statements if re.search(r"\bborrowing\b", s)], statements
+        )
+        items, borrowers, monthly = [r.get_json()["elements"] for r in responses]
+        self.assertEqual(
+            items,
+            [
+                {
+                    "id": 1,
+                    "name": "tent",
+                    "quantity": 4,
+                    "borrowings": 2,
+                    "borrowed_quantity": 3,
+                    "unit_days": 9,
+                    # 9 units used over 4 units during the 60 days of the window
+                    "utilization": round(9 / 240, 4),
+                },
+                {
+                    "id": 2,
+                    "name": "stove",
+                    "quantity": None,
+                    "borrowings": 1,
+                    "borrowed_quantity": 1,
+                    "unit_days": 4,
+                    "utilization": None,
+                },
+            ],
+        )
+        self.assertEqual(
+            [(b["username"], b["borrowings"]) for b in borrowers],
+            [("john", 2), ("robb", 1)],
+        )
+        self.assertEqual(
+            monthly,
+            [
+                {
+                    "month": "2032-02",
+                    "borrowings": 2,
+                    "borrowed_quantity": 3,
+                    "unit_days": 6,
+                },
+                {
+                    "month": "2032-03",
+                    "borrowings": 1,
+                    "borrowed_quantity": 1,
+                    "unit_days": 7,
+                },
+            ],
+        )
+        # limits are bounded to 1..100, -1 would not limit SQLite
+        for limit in [1, 0, -1]:
+            response = self.client.get(
+                f"/api/analytics/items?from=2032-02&to=2032-03&limit={limit}",
+                headers=self.headers,
+            )
+            self.assertEqual(len(response.get_json()["elements"]), 1)
+        for query in [
+            "from=2032-03&to=2032-02",
+            "from=2032-02",
+            "from=2032-13&to=2033-01",
+        ]:
+            response = self.client.get(
+                f"/api/analytics/monthly?{query}", headers=self.headers
+            )
+            self.assertEqual(response.status_code, 400)
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        response = self.client.get(
+            "/api/analytics/monthly?from=2032-02&to=2032-03", headers=user
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_rebuild_command(self):
+        db.session.query(ItemUsage).delete()
+        db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=["rebuild-analytics"])
+        self.assertIn("analytics rebuilt from 3 borrowings", result.output)
+        self.assertEqual(db.session.query(ItemUsage).count(), 4)
+
+
+class PowerCase(RoutesCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add_all(
+            [
+                Item(name="heater", quantity=3, power=2000),
+                Item(name="lamp", quantity=10, power=60),
+                Item(name="tent", quantity=4),
+            ]
+        )
+        db.session.commit()
+        self.headers = {"Authorization": "Bearer " + self.get_token()}
+        response = self.client.post(
+            "/api/borrowings/checkout/2",
+            json={
+                "borrowing_date": "2032-07-01",
+                "return_date": "2032-07-03",
+                "items": [
+                    {"id": 1, "quantity": 2},
+                    {"id": 2, "quantity": 5},
+                    {"id": 3, "quantity": 4},
+                ],
+            },
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        db.session.add(
+            Borrowing(
+                user_id=1,
+                item_id=2,
+                borrowing_date=date(2032, 7, 3),
+                return_date=date(2032, 7, 5),
+                borrowed_quantity=2,
+            )
+        )
+        db.session.commit()
+
+    def power(self, window: str = "from=2032-07-01&to=2032-07-06") -> dict:
+        response = self.client.get("/api/power?" + window, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_power_report(self):
+        self.assertEqual(
+            self.power(),
+            {
+                "from": "2032-07-01",
+                "to": "2032-07-06",
+                "peak": 4420,
+                "peak_date": "2032-07-03",
+                "watt_days": 4300 * 2 + 4420 + 120 * 2,
+                "draw": [[0, 4300], [2, 4420], [3, 120], [5, 0]],
+            },
+        )
+        self.assertEqual(
+            self.power("from=2032-07-05&to=2032-07-05")["draw"], [[0, 120]]
+        )
+        self.assertEqual(self.power("from=2032-08-01&to=2032-08-31")["draw"], [[0, 0]])
+        response = self.client.get(
+            "/api/power?from=2032-07-01&to=2032-07-06",
+            headers={"Authorization": "Bearer " + self.get_token("john:4567")},
+        )
+        self.assertEqual(response.status_code, 403)
+        for window in [
+            "from=2032-07-06&to=2032-07-01",
+            "from=2032-07-01",
+            "from=2032-01-01&to=2033-01-02",
+        ]:
+            response = self.client.get("/api/power?" + window, headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_planned_borrowings(self):
+        planned = {
+            "id": 1,
+            "quantity": 1,
+            "borrowing_date": "2032-07-06",
+            "return_date": "2032-07-08",
+        }
+        response = self.client.post(
+            "/api/power", json={"borrowings": [planned]}, headers=self.headers
+        )
+        self.assertEqual(
+            response.get_json(),
+            {
+                "from": "2032-07-06",
+                "to": "2032-07-08",
+                "peak": 2000,
+                "peak_date": "2032-07-06",
+                "watt_days": 6000,
+                "draw": [[0, 2000]],
+            },
+        )
+        response = self.client.post(
+            "/api/power",
+            json={
+                "from": "2032-07-01",
+                "to": "2032-07-06",
+                "borrowings": [
+                    planned,
+                    dict(planned, id=2, borrowing_date="2032-06-01"),
+                ],
+            },
+            headers=self.headers,
+        )
+        self.assertEqual(
+            response.get_json()["draw"],
+            [[0, 4360], [2, 4480], [3, 180], [5, 2060]],
+        )
+        # the planned borrowings are not cached with the borrowed items
+        self.assertEqual(self.power()["peak"], 4420)
+        for borrowings in [
+            [dict(planned, id=99)],
+            [dict(planned, return_date="2032-07-05")],
+            [dict(planned, quantity="1")],
+            [dict(planned, quantity=-3)],
+            [dict(planned, quantity=0)],
+            [dict(planned, quantity=True)],
+            [dict(planned, id=True)],
+            [],
+        ]:
+            response = self.client.post(
+                "/api/power", json={"borrowings": borrowings}, headers=self.headers
+            )
+            self.assertEqual(response.status_code, 400)
+        for data in [[planned], "borrowings", 3]:
+            response = self.client.post("/api/power", json=data, headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_power_cache(self):
+        power_cache.clear()
+        self.power()
+        self.assertEqual(len(power_cache), 1)
+        with QueryCounter() as counter:
+            self.assertEqual(self.power()["peak"], 4420)
+        # the token is cached too
+        self.assertEqual(counter.count, 0)
+        # changing the power of an item or a borrowing drops the cache
+        item = Item.query.get(1)
+        item.power = 1000
+        db.session.commit()
+        self.assertEqual(len(power_cache), 0)
+        self.assertEqual(self.power()["draw"][0], [0, 2300])
+        item.remarks = "bring an extension cord"
+        db.session.commit()
+        self.assertEqual(len(power_cache), 1)
+        borrowing = Borrowing.query.filter_by(user_id=1).first()
+        borrowing.borrowed_quantity = 3
+        db.session.commit()
+        self.assertEqual(len(power_cache), 0)
+        self.assertEqual(self.power()["peak"], 2480)
+        db.session.delete(borrowing)
+        db.session.commit()
+        self.assertEqual(self.power()["peak"], 2300)
+        # a draw computed from the rows before they are committed is dropped
+        borrowing = Borrowing(
+            user_id=1,
+            item_id=2,
+            borrowing_date=date(2032, 7, 4),
+            return_date=date(2032, 7, 4),
+            borrowed_quantity=1,
+        )
+        db.session.add(borrowing)
+        db.session.flush()
+        power_cache.set((date(2032, 7, 1), date(2032, 7, 6)), "stale")
+        db.session.commit()
+        self.assertEqual(len(power_cache), 0)
+        self.assertEqual(self.power()["draw"][1], [3, 60])
+        db.session.delete(borrowing)
+        db.session.commit()
+        # borrowings inserted by a checkout
+        response = self.client.post(
+            "/api/borrowings/checkout/1",
+            json={
+                "borrowing_date": "2032-07-06",
+                "return_date": "2032-07-06",
+                "items": [{"id": 1, "quantity": 3}],
+            },
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.power()["peak_date"], "2032-07-06")
+
+
+class DashboardCase(RoutesCase):
+    def setUp(self):
+        super().setUp()
+        today = date.today()
+        db.session.add_all(
+            [
+                Item(
+                    name="tent",
+                    location="A1",
+                    box_name="T1",
+                    quantity=4,
+                    value=100,
+                    condition="damaged",
+                    needs_cleaning=True,
+                ),
+                Item(
+                    name="stove",
+                    location="A1",
+                    box_name="K1",
+                    quantity=2,
+                    value=50,
+                    expiry_date=today + timedelta(days=10),
+                ),
+                Item(
+                    name="lamp",
+                    location="B2",
+                    box_name="L1",
+                    quantity=10,
+                    needs_cleaning=False,
+                    expiry_date=today + timedelta(days=60),
+                ),
+                Item(name="rope", quantity=3, value=10),
+            ]
+        )
+        db.session.add_all(
+            [
+                Borrowing(
+                    user_id=2,
+                    item_id=2,
+                    borrowing_date=today,
+                    return_date=today + timedelta(days=2),
+                    borrowed_quantity=1,
+                ),
+                Borrowing(
+                    user_id=2,
+                    item_id=3,
+                    borrowing_date=today - timedelta(days=5),
+                    return_date=today - timedelta(days=1),
+                    borrowed_quantity=1,
+                ),
+            ]
+        )
+        db.session.commit()
+        dashboard_cache.clear()
+        self.headers = {"Authorization": "Bearer " + self.get_token()}
+
+    def dashboard(self) -> dict:
+        response = self.client.get("/api/dashboard", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_dashboard(self):
+        data = self.dashboard()
+        self.assertEqual(
+            {k: v for k, v in data.items() if k not in ["locations", "boxes"]},
+            {
+                "date": date.today().isoformat(),
+                "expiry_days": 30,
+                "items": 4,
+                "value": 530,
+                "needs_cleaning": 1,
+                "damaged": 1,
+                "expiring": 1,
+                "borrowed": 1,
+            },
+        )
+        self.assertEqual(
+            [(e["location"], e["items"], e["value"]) for e in data["locations"]],
+            [(None, 1, 30), ("A1", 2, 500), ("B2", 1, 0)],
+        )
+        self.assertEqual(
+            data["boxes"][1],
+            {
+                "location": "A1",
+                "box_name": "K1",
+                "items": 1,
+                "value": 100,
+                "needs_cleaning": 0,
+                "damaged": 0,
+                "expiring": 1,
+                "borrowed": 1,
+            },
+        )
+        self.assertEqual(
+            [(e["box_name"], e["damaged"]) for e in data["boxes"]],
+            [(None, 0), ("K1", 0), ("T1", 1), ("L1", 0)],
+        )
+        response = self.client.get(
+            "/api/dashboard",
+            headers={"Authorization": "Bearer " + self.get_token("john:4567")},
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_dashboard_cache(self):
+        self.dashboard()
+        with QueryCounter() as counter:
+            self.assertEqual(self.dashboard()["value"], 530)
+        self.assertEqual(counter.count, 0)
+        # changes of other models keep the cache
+        User.query.get(2).unit = "staff"
+        db.session.commit()
+        self.assertEqual(len(dashboard_cache), 1)
+        item = Item.query.filter_by(name="rope").first()
+        item.value = 20
+        db.session.commit()
+        self.assertEqual(len(dashboard_cache), 0)
+        self.assertEqual(self.dashboard()["value"], 560)
+        for borrowing in Borrowing.query.all():
+            db.session.delete(borrowing)
+        db.session.commit()
+        self.assertEqual(self.dashboard()["borrowed"], 0)
+        # a dashboard computed from the rows before they are committed is dropped
+        item.condition = "damaged"
+        db.session.flush()
+        dashboard_cache.set((date.today(), 30), "stale")
+        db.session.commit()
+        self.assertEqual(len(dashboard_cache), 0)
+        self.assertEqual(self.dashboard()["damaged"], 2)
+        # borrowings and items inserted in bulk
+        response = self.client.post(
+            "/api/borrowings/checkout/2",
+            json={
+                "borrowing_date": date.today().isoformat(),
+                "return_date": date.today().isoformat(),
+                "items": [{"id": 1}, {"id": 3}],
+            },
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.dashboard()["borrowed"], 2)
+        import_items([(2, {"name": "chair", "location": "B2", "value": "5"})])
+        self.assertEqual(self.dashboard()["items"], 5)
+
+
+class InventoryCase(RoutesCase):
+    CSV = (
+        "name,quantity,expiry_date,needs_cleaning,access_control_list,location\n"
+        "tent,4,2030-01-02,true,,A1\n"
+        "stove,many,,,,\n"
+        "lamp,1,,false,reuf_admin;reuf,B2\n"
+        "tent,2,,,,\n"
+        "chair,10,,,,\n"
+        "rope,,22.01.30,,,\n"
+        ",3,,,,\n"
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.app.config["INVENTORY_CHUNK_SIZE"] = 2
+        db.session.add(Item(name="chair"))
+        db.session.commit()
+        self.headers = {"Authorization": "Bearer " + self.get_token()}
+
+    def test_import_csv(self):
+        inserts = []
+
+        def count_inserts(conn, cursor, statement, parameters, context, many):
+            if statement.startswith("INSERT INTO item "):
+                inserts.append(len(parameters) if many else 1)
+
+        event.listen(db.engine, "before_cursor_execute", count_inserts)
+        response = self.client.post(
+            "/api/items/import",
+            data=self.CSV,
+            headers={"Content-Type": "text/csv", **self.headers},
+        )
+        event.remove(db.engine, "before_cursor_execute", count_inserts)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.get_json(),
+            {
+                "imported": 2,
+                "errors": [
+                    {"line": 3, "error": "quantity should be an integer"},
+                    {"line": 5, "error": "the name is taken"},
+                    {"line": 6, "error": "the name is taken"},
+                    {"line": 7, "error": "expiry_date should be an ISO date"},
+                    {"line": 8, "error": "name is required"},
+                ],
+            },
+        )
+        # one INSERT of the valid rows per chunk
+        self.assertEqual(inserts, [1, 1])
+        tent = Item.query.filter_by(name="tent").one()
+        self.assertEqual(tent.quantity, 4)
+        self.assertEqual(tent.expiry_date, date(2030, 1, 2))
+        self.assertTrue(tent.needs_cleaning)
+        self.assertEqual(tent.access_control_list, [])
+        self.assertIsNotNone(tent.updated_at)
+        lamp = Item.query.filter_by(name="lamp").one()
+        self.assertEqual(lamp.access_control_list, [Role.REUF, Role.REUF_ADMIN])
+        self.assertFalse(lamp.needs_cleaning)
+        # imported items are indexed for the search
+        self.assertEqual(
+            [i.name for i in Item.search("lam", [Role.REUF, Role.REUF_ADMIN])], ["lamp"]
+        )
+
+    def test_import_errors(self):
+        url = "/api/items/import"
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        self.assertEqual(self.client.post(url, data="", headers=user).status_code, 403)
+        response = self.client.post(url, data=self.CSV, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            url + "?format=csv", data="name,colour\ntent,red\n", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+        # the rows before a line that is not UTF-8 text are imported, even in its
+        # chunk, and the reading stops there
+        response = self.client.post(
+            url + "?format=jsonl",
+            data=b'{"name": "item 0"}\n["not an object"]\n{"name": "item 1"}\n'
+            + b'{"name": "\xff"}\n{"name": "item 2"}\n',
+            headers=self.headers,
+        )
+        self.assertEqual(
+            response.get_json(),
+            {
+                "imported": 2,
+                "errors": [
+                    {"line": 2, "error": "the row should be an object"},
+                    {"line": 4, "error": "not UTF-8 text"},
+                ],
+            },
+        )
+        response = self.client.post(
+            url + "?format=csv",
+            data=b"name,location\nmat,A1\nbag,\xff\n",
+            headers=self.headers,
+        )
+        self.assertEqual(
+            response.get_json(),
+            {"imported": 1, "errors": [{"line": 3, "error": "not UTF-8 text"}]},
+        )
+        self.assertEqual(
+            [i.name for i in Item.query.order_by(Item.id)][-3:],
+            ["item 0", "item 1", "mat"],
+        )
+        response = self.client.post(
+            url + "?format=jsonl",
+            data='{"name": "mat", "needs_cleaning": [1]}\n',
+            headers=self.headers,
+        )
+        self.assertEqual(
+            response.get_json(),
+            {
+                "imported": 0,
+                "errors": [
+                    {"line": 1, "error": "needs_cleaning should be true or false"}
+                ],
+            },
+        )
+
+    def test_export_and_import(self):
+        self.client.post(
+            "/api/items/import?format=csv", data=self.CSV, headers=self.headers
+        )
+        response = self.client.get("/api/items/export", headers=self.headers)
+        self.assertEqual(response.mimetype, "text/csv")
+        csv = response.data.decode()
+        self.assertEqual(
+            csv.splitlines()[:3],
+            [
+                "id,name,description,box_name,location,unit,quantity,expiry_date,"
+                + "power,value,needs_cleaning,condition,remarks,access_control_list",
+                "1,chair,,,,,,,,,,,,",
+                "2,tent,,,A1,,4,2030-01-02,,,true,,,",
+            ],
+        )
+        response = self.client.get(
+            "/api/items/export?format=jsonl", headers=self.headers
+        )
+        lines = response.data.decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(
+            json.loads(lines[2])["access_control_list"], ["reuf", "reuf_admin"]
+        )
+        # the exports can be imported again, as a form
+        exported = [i.to_dict(True) for i in Item.query.order_by(Item.id)]
+        for format, data in [("csv", csv), ("jsonl", response.data)]:
+            Item.query.delete()
+            db.session.commit()
+            file = (io.BytesIO(data.encode() if format == "csv" else data), "items")
+            response = self.client.post(
+                f"/api/items/import?format={format}",
+                data={"file": file},
+                headers=self.headers,
+            )
+            self.assertEqual(response.get_json(), {"imported": 3, "errors": []})
+            self.assertEqual(
+                [
+                    {
+                        k: v
+                        for k, v in i.to_dict(True).items()
+                        if k not in ("id", "_links")
+                    }
+                    for i in Item.query.order_by(Item.id)
+                ],
+                [
+                    {k: v for k, v in i.items() if k not in ("id", "_links")}
+                    for i in exported
+                ],
+            )
+
+    def test_cli(self):
+        runner = self.app.test_cli_runner()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "items.csv")
+            with open(path, "w") as file:
+                file.write(self.CSV)
+            result = runner.invoke(args=["import-items", path])
+            self.assertIn("2 items imported", result.output)
+            self.assertIn("line 3: quantity should be an integer", result.output)
+            exported = os.path.join(directory, "export.txt")
+            result = runner.invoke(args=["export-items", exported])
+            self.assertNotEqual(result.exit_code, 0)
+            result = runner.invoke(args=["export-items", "--format", "jsonl", exported])
+            self.assertEqual(result.exit_code, 0)
+            with open(exported) as file:
+                self.assertEqual(
+                    [json.loads(line)["name"] for line in file],
+                    ["chair", "tent", "lamp"],
+                )
+
+
+class ConditionalRequestsCase(RoutesCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add_all([Item(name="tent", quantity=2), Item(name="stove")])
+        db.session.commit()
+        self.admin = {"Authorization": "Bearer " + self.get_token()}
+        self.user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+
+    def revalidate(self, url, headers, etag):
+        return self.client.get(url, headers={"If-None-Match": etag, **headers})
+
+    def test_item(self):
+        response = self.client.get("/api/items/1", headers=self.user)
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+        self.assertIn("Authorization", response.headers["Vary"])
+        self.assertIn("no-cache", response.headers["Cache-Control"])
+        with mock.patch.object(Item, "to_dict") as to_dict:
+            response = self.revalidate("/api/items/1", self.user, etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b"")
+            self.assertEqual(response.headers["ETag"], etag)
+            response = self.client.get(
+                "/api/items/1",
+                headers={
+                    "If-Modified-Since": last_modified,
+                    **self.user,
+                },
+            )
+            self.assertEqual(response.status_code, 304)
+            to_dict.assert_not_called()
+        # the reuf view is another representation
+        response = self.revalidate("/api/items/1", self.admin, etag)
+        self.assertEqual(response.status_code, 200)
+        # borrowings and images do not change the item
+        self.assertTrue(Item.claim_versions({1: 0}))
+        db.session.get(Item, 1).image_key = "0" * 64 + ".png"
+        db.session.commit()
+        response = self.revalidate("/api/items/1", self.user, etag)
+        self.assertEqual(response.status_code, 304)
+        db.session.get(Item, 1).remarks = "a hole in it"
+        db.session.commit()
+        response = self.revalidate("/api/items/1", self.user, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["remarks"], "a hole in it")
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_borrowing(self):
+        today = date.today()
+        db.session.add_all(
+            [
+                Borrowing(
+                    user_id=user_id,
+                    item_id=1,
+                    borrowing_date=today,
+                    return_date=today,
+                    borrowed_quantity=1,
+                )
+                for user_id in [2, 1]
+            ]
+        )
+        db.session.commit()
+        response = self.client.get("/api/borrowings/1", headers=self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["id"], 1)
+        etag = response.headers["ETag"]
+        with mock.patch.object(Borrowing, "to_dict") as to_dict:
+            response = self.revalidate("/api/borrowings/1", self.user, etag)
+            self.assertEqual(response.status_code, 304)
+            to_dict.assert_not_called()
+        # users only see their borrowings, reufs see every borrowing
+        self.assertEqual(
+            self.client.get("/api/borrowings/2", headers=self.user).status_code, 404
+        )
+        self.assertEqual(
+            self.client.get("/api/borrowings/2", headers=self.admin).status_code, 200
+        )
+        self.assertEqual(
+            self.client.get("/api/borrowings/3", headers=self.admin).status_code, 404
+        )
+        # the borrowed item is part of the borrowing
+        db.session.get(Item, 1).remarks = "a hole in it"
+        db.session.commit()
+        response = self.revalidate("/api/borrowings/1", self.user, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_items(self):
+        url = "/api/items/?per_page=1"
+        etag = self.client.get(url, headers=self.user).headers["ETag"]
+        with mock.patch.object(Item, "to_dict") as to_dict:
+            self.assertEqual(self.revalidate(url, self.user, etag).status_code, 304)
+            to_dict.assert_not_called()
+        self.assertEqual(self.revalidate(url, self.admin, etag).status_code, 200)
+        # a new item, a modified one or a deleted one change the collection
+        db.session.add(Item(name="lamp"))
+        db.session.commit()
+        response = self.revalidate(url, self.user, etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        db.session.get(Item, 2).name = "big stove"
+        db.session.commit()
+        response = self.revalidate(url, self.user, etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        db.session.delete(db.session.get(Item, 1))
+        db.session.commit()
+        response = self.revalidate(url, self.user, etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        # items the user cannot see are not in their collection
+        item = Item(name="drill")
+        item.access_control_list = [Role.REUF_ADMIN]
+        db.session.add(item)
+        db.session.commit()
+        self.assertEqual(self.revalidate(url, self.user, etag).status_code, 304)
+        self.assertEqual(
+            self.revalidate(url + "&stream=1", self.user, etag).status_code, 304
+        )
+
+    def test_users_and_borrowings(self):
+        url = "/api/users?per_page=1"
+        user_etag = self.client.get(url, headers=self.admin).headers["ETag"]
+        response = self.client.get("/api/users/2", headers=self.user)
+        self.assertEqual(response.status_code, 200)
+        john_etag = response.headers["ETag"]
+        borrowings = "/api/borrowings/?per_page=1"
+        self.client.post(
+            "/api/borrowings/borrow/1/2",
+            json={"borrowing_date": "2030-01-01", "return_date": "2030-01-02"},
+            headers=self.admin,
+        )
+        etag = self.client.get(borrowings, headers=self.admin).headers["ETag"]
+        # logging in does not change the representation of users
+        self.get_token("john:4567")
+        self.assertEqual(self.revalidate(url, self.admin, user_etag).status_code, 304)
+        response = self.revalidate("/api/users/2", self.user, john_etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.revalidate(borrowings, self.admin, etag).status_code, 304)
+        # borrowings include their borrower and item
+        db.session.get(User, 2).unit = "collaborator"
+        db.session.commit()
+        self.assertEqual(self.revalidate(url, self.admin, user_etag).status_code, 200)
+        self.assertEqual(self.revalidate(borrowings, self.admin, etag).status_code, 200)
+
+    def test_uncounted_collections(self):
+        etag = self.client.get("/api/users", headers=self.admin).headers["ETag"]
+        self.client.get("/api/users?cursor=", headers=self.admin)
+        for url in [
+            "/api/users?cursor=",
+            "/api/users?stream=1",
+            "/api/items/?stream=1",
+        ]:
+            # the page alone, without aggregating the collection
+            with QueryCounter() as counter:
+                response = self.client.get(url, headers=self.admin)
+                response.get_data()
+            self.assertNotIn("ETag", response.headers)
+            self.assertEqual(counter.count, 1)
+        # the ETag of a page by number checks the other modes
+        for url in ["/api/users?cursor=", "/api/users?stream=1"]:
+            response = self.revalidate(url, self.admin, etag)
+            self.assertEqual(response.status_code, 304)
+        response = self.revalidate("/api/users?cursor=", self.admin, '"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["ETag"], etag)
+        # searches only check the items for conditional requests
+        url = "/api/items/search?q=tent"
+        self.assertNotIn("ETag", self.client.get(url, headers=self.user).headers)
+        etag = self.revalidate(url, self.user, '"other"').headers["ETag"]
+        self.assertEqual(self.revalidate(url, self.user, etag).status_code, 304)
+
+
+def image_bytes(color: str, format: str = "PNG", size=(300, 200)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class ItemImageCase(RoutesCase):
+    def setUp(self):
+        self.store = tempfile.mkdtemp()
+
+        class ImageConfig(TestConfig):
+            IMAGE_STORE = self.store
+            IMAGE_THUMBNAIL_SIZES = [64, 128]
+
+        self.config_class = ImageConfig
+        super().setUp()
+        db.session.add_all([Item(name="tent"), Item(name="stove")])
+        db.session.commit()
+        self.headers = {"Authorization": "Bearer " + self.get_token()}
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.store)
+
+    def files(self):
+        return sorted(
+            os.path.basename(f) for f in glob.glob(os.path.join(self.store, "*", "*"))
+        )
+
+    def test_update_item_image(self):
+        red = image_bytes("red")
+        response = self.client.put("/api/items/image/1", data=red, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        key = hashlib.sha256(red).hexdigest() + ".png"
+        self.assertEqual(db.session.get(Item, 1).image_key, key)
+        digest = key.split(".")[0]
+        self.assertEqual(self.files(), [f"{digest}-128.png", f"{digest}-64.png", key])
+        # identical images are stored once, also when sent as a form
+        response = self.client.put(
+            "/api/items/image/2",
+            data={"image": (io.BytesIO(red), "red.png")},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db.session.get(Item, 2).image_key, key)
+        self.assertEqual(len(self.files()), 3)
+        # the previous image is removed once no item has it anymore
+        blue = image_bytes("blue", "JPEG")
+        self.client.put("/api/items/image/1", data=blue, headers=self.headers)
+        self.assertEqual(len(self.files()), 6)
+        self.client.put("/api/items/image/2", data=blue, headers=self.headers)
+        self.assertEqual(len(self.files()), 3)
+        self.assertTrue(all(f.endswith(".jpg") for f in self.files()))
+
+    def test_update_item_image_errors(self):
+        for data in [b"not an image", image_bytes("red", "BMP")]:
+            response = self.client.put(
+                "/api/items/image/1", data=data, headers=self.headers
+            )
+            self.assertEqual(response.status_code, 400)
+        self.app.config["IMAGE_MAX_SIZE"] = 100
+        image_store.init_app(self.app)
+        response = self.client.put(
+            "/api/items/image/1", data=image_bytes("red"), headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+        # no temporary file is left behind
+        self.assertEqual(os.listdir(self.store), [])
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        response = self.client.put(
+            "/api/items/image/1", data=image_bytes("red"), headers=user
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_item_image(self):
+        red = image_bytes("red")
+        url = "/api/items/image/1"
+        self.assertEqual(self.client.get(url, headers=self.headers).status_code, 404)
+        self.client.put(url, data=red, headers=self.headers)
+        response = self.client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, red)
+        self.assertEqual(response.mimetype, "image/png")
+        etag = response.headers["ETag"]
+        response.close()
+        response = self.client.get(url, headers={"If-None-Match": etag, **self.headers})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        response = self.client.get(url, headers={"Range": "bytes=0-9", **self.headers})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, red[:10])
+        self.assertEqual(response.headers["Content-Range"], f"bytes 0-9/{len(red)}")
+        response.close()
+        response = self.client.get(url + "?size=64", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(Image.open(io.BytesIO(response.data)).size, (64, 43))
+        response.close()
+        response = self.client.get(url + "?size=65", headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        # thumbnails of newly configured sizes are made when first requested
+        self.app.config["IMAGE_THUMBNAIL_SIZES"].append(32)
+        response = self.client.get(url + "?size=32", headers=self.headers)
+        self.assertEqual(Image.open(io.BytesIO(response.data)).size, (32, 21))
+        response.close()
+        item = db.session.get(Item, 2)
+        item.access_control_list = [Role.REUF_ADMIN]
+        item.image_key = db.session.get(Item, 1).image_key
+        db.session.commit()
+        user = {"Authorization": "Bearer " + self.get_token("john:4567")}
+        self.assertEqual(self.client.get(url, headers=user).status_code, 200)
+        response = self.client.get("/api/items/image/2", headers=user)
+        self.assertEqual(response.status_code, 404)
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    """Answers the SMTP commands sent by smtplib and records the mails received"""
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            refuse = server.refused > 0
+            server.refused -= 1 if refuse else 0
+        if refuse:
+            self.wfile.write(b"421 busy\r\n")
+            return
+        # holds the session until the test opens the gate
+        server.gate.wait()
+        self.wfile.write(b"220 stub\r\n")
+        recipients = []
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command == b"RCPT":
+                recipients.append(line.split(b":", 1)[1].strip().decode().strip("<>"))
+            elif command == b"DATA":
+                self.wfile.write(b"354 go on\r\n")
+                for data in self.rfile:
+                    if data == b".\r\n":
+                        break
+                with server.lock:
+                    server.mails.append(recipients)
+                recipients = []
+            elif command == b"QUIT":
+                self.wfile.write(b"221 bye\r\n")
+                return
+            if command != b"DATA":
+                self.wfile.write(b"250 ok\r\n")
+            else:
+                self.wfile.write(b"250 queued\r\n")
+
+
+class MailQueueCase(AppCase):
+    def setUp(self):
+        self.smtp = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPStubHandler)
+        self.smtp.daemon_threads = True
+        self.smtp.lock = threading.Lock()
+        self.smtp.connections = 0
+        self.smtp.refused = 0
+        self.smtp.mails = []
+        self.smtp.gate = threading.Event()
+        self.smtp.gate.set()
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+
+        class SMTPStubConfig(MailConfig):
+            MAIL_SERVER = "127.0.0.1"
+            MAIL_PORT = self.smtp.server_address[1]
+            MAIL_SUPPRESS_SEND = False
+            MAIL_QUEUE_SIZE = 100
+            MAIL_QUEUE_TIMEOUT = 0.05
+            MAIL_QUEUE_BATCH_SIZE = 100
+            MAIL_RETRY_DELAY = 0.01
+
+        self.config_class = SMTPStubConfig
+        super().setUp()
+
+    def tearDown(self):
+        self.smtp.gate.set()
+        mail_queue.shutdown()
+        self.smtp.shutdown()
+        self.smtp.server_close()
+        super().tearDown()
+
+    def send(self, n):
+        for i in range(n):
+            send_email("hello", [f"user{i}@example.com"], "hello")
+
+    def test_batches(self):
+        # the first mail waits for the server while the next ones are queued
+        self.smtp.gate.clear()
+        self.send(50)
+        self.smtp.gate.set()
+        mail_queue.join()
+        self.assertEqual(len(self.smtp.mails), 50)
+        self.assertEqual(
+            sorted(r[0] for r in self.smtp.mails),
+            sorted(f"user{i}@example.com" for i in range(50)),
+        )
+        self.assertLessEqual(self.smtp.connections, 2)
+
+    def test_retries(self):
+        self.smtp.refused = 2
+        self.send(3)
+        mail_queue.join()
+        self.assertEqual(len(self.smtp.mails), 3)
+        self.assertEqual(self.smtp.connections, 3)
+        # mails are dropped after the last retry, the queue keeps working
+        self.smtp.refused = 10
+        self.send(1)
+        mail_queue.join()
+        self.assertEqual(len(self.smtp.mails), 3)
+        self.smtp.refused = 0
+        self.send(1)
+        mail_queue.join()
+        self.assertEqual(len(self.smtp.mails), 4)
+
+    def test_backpressure(self):
+        mail_queue.shutdown()
+        self.app.config["MAIL_QUEUE_SIZE"] = 2
+        mail_queue.init_app(self.app, mail)
+        self.smtp.gate.clear()
+        self.assertTrue(mail_queue.put(self.message()))
+        # waits for the worker to take the first mail
+        while mail_queue._queue.qsize():
+            pass
+        self.assertTrue(mail_queue.put(self.message()))
+        self.assertTrue(mail_queue.put(self.message()))
+        # the queue is full, the mail is dropped after the timeout
+        self.assertFalse(mail_queue.put(self.message()))
+        self.smtp.gate.set()
+        mail_queue.join()
+        self.assertEqual(len(self.smtp.mails), 3)
+
+    def test_drain_on_shutdown(self):
+        self.smtp.gate.clear()
+        self.send(5)
+        threading.Timer(0.1, self.smtp.gate.set).start()
+        mail_queue.shutdown()
+        self.assertEqual(len(self.smtp.mails), 5)
+
+    def message(self):
+        with self.app.app_context():
+            return Message("hello", recipients=["user@example.com"], body="hello")
+
+
+class ConcurrentBorrowingCase(RoutesCase):
+    def setUp(self):
+        # concurrent requests need their own connections to the same database,
+        # which in memory databases cannot provide. Each test gets its own file.
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        class FileDatabaseConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+
+        self.config_class = FileDatabaseConfig
+        super().setUp()
+
+    def test_concurrent_borrowings(self):
+        item = Item(name="treuficelle", quantity=50)
+        db.session.add(item)
+        db.session.commit()
+        headers = {"Authorization": "Bearer " + self.get_token()}
+        tomorrow = date.today() + timedelta(days=1)
+
+        def borrow(i):
+            # overlapping borrowings of 1 or 2 units, for robb or john
+            start = tomorrow + timedelta(days=i % 3)
+            data = {
+                "borrowing_date": start.isoformat(),
+                "return_date": (start + timedelta(days=2)).isoformat(),
+                "borrowed_quantity": 1 + i % 2,
+            }
+            url = f"/api/borrowings/borrow/1/{1 + i % 2}"
+            return self.app.test_client().post(url, headers=headers, json=data)
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            responses = list(executor.map(borrow, range(300)))
+        statuses = [r.status_code for r in responses]
+        self.assertTrue(set(statuses) <= {201, 400, 409})
+        created = [r.get_json()["id"] for r in responses if r.status_code == 201]
+        self.assertEqual(Borrowing.query.count(), len(created))
+        self.assertEqual(Item.query.get(1).version, len(created))
+        # the item is never over-committed, and is committed as much as it can be
+        peak = Item.peak_usages([1], tomorrow, tomorrow + timedelta(days=4))[1]
+        self.assertLessEqual(peak, 50)
+        self.assertGreaterEqual(peak, 49)
+
+    def test_concurrent_checkouts(self):
+        db.session.add_all([Item(name="cable", quantity=30), Item(name="lamp")])
+        db.session.commit()
+        headers = {"Authorization": "Bearer " + self.get_token()}
+        tomorrow = date.today() + timedelta(days=1)
+        data = {
+            "borrowing_date": tomorrow.isoformat(),
+            "return_date": tomorrow.isoformat(),
+        }
+
+        def borrow(i):
+            # checkouts of both items, racing with borrowings of the first one
+            client = self.app.test_client()
+            if i % 2:
+                return client.post(
+                    "/api/borrowings/borrow/1/2", headers=headers, json=data
+                )
+            return client.post(
+                "/api/borrowings/checkout/2",
+                headers=headers,
+                json=dict(data, items=[{"id": 1}, {"id": 2, "quantity": 2}]),
+            )
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            responses = list(executor.map(borrow, range(200)))
+        self.assertTrue(set(r.status_code for r in responses) <= {201, 400, 409})
+        checkouts = len(
+            [r for i, r in enumerate(responses) if r.status_code == 201 and i % 2 == 0]
+        )
+        self.assertEqual(Item.query.get(2).version, checkouts)
+        self.assertEqual(Borrowing.query.filter_by(item_id=2).count(), checkouts)
+        peak = Item.peak_usages([1], tomorrow, tomorrow)[1]
+        self.assertEqual(peak, 30)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)